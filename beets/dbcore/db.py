@@ -26,9 +26,77 @@ import contextlib
 import collections
 
 import beets
-from beets.util.functemplate import Template
+from beets.util import functemplate
 from beets.dbcore import types
-from .query import MatchQuery, NullSort, TrueQuery
+from .query import MatchQuery, NullSort, TrueQuery, sql_regexp
+
+
+# Memoized SQL statement text.
+
+SQL_CACHE_SIZE = 1024
+"""The maximum number of statements kept in the SQL text cache.
+"""
+
+_sql_cache = {}
+
+
+def _cached_sql(key, build):
+    """Get the text of an SQL statement identified by `key`, a hashable
+    description of the statement's "shape" (such as its table and the
+    set of columns it touches). The text is generated by calling
+    `build` the first time a key is requested.
+
+    Generating statements once keeps their text identical from call to
+    call, which lets SQLite reuse its prepared statements.
+    """
+    try:
+        return _sql_cache[key]
+    except KeyError:
+        if len(_sql_cache) >= SQL_CACHE_SIZE:
+            _sql_cache.clear()
+        sql = _sql_cache[key] = build()
+        return sql
+
+
+# Full-text search support.
+
+_fts_support = None
+
+
+def fts_supported():
+    """Determine whether SQLite supports FTS5 with the trigram
+    tokenizer, which full-text search tables need.
+    """
+    global _fts_support
+    if _fts_support is None:
+        conn = sqlite3.connect(':memory:')
+        try:
+            conn.execute("CREATE VIRTUAL TABLE t USING fts5(a, "
+                         "tokenize='trigram')")
+        except sqlite3.OperationalError:
+            _fts_support = False
+        else:
+            _fts_support = True
+        finally:
+            conn.close()
+    return _fts_support
+
+
+def fts_enabled():
+    """Determine whether full-text search tables are used: the
+    `fulltext_search` option is on and SQLite supports them.
+    """
+    return beets.config['fulltext_search'].get(bool) and fts_supported()
+
+
+def fts_table(model_cls):
+    """Get the name of the full-text search table for `model_cls`, or
+    None if the model cannot have one: all of its search fields must be
+    fixed fields.
+    """
+    fields = model_cls._search_fields
+    if fields and all(field in model_cls._fields for field in fields):
+        return '{0}_fts'.format(model_cls._table)
 
 
 class FormattedMapping(collections.Mapping):
@@ -44,10 +112,22 @@ class FormattedMapping(collections.Mapping):
     def __init__(self, model, for_path=False):
         self.for_path = for_path
         self.model = model
-        self.model_keys = model.keys(True)
+        self._model_keys = None
+        if for_path:
+            self._sep_repl = beets.config['path_sep_replace'].get(unicode)
+
+    @property
+    def model_keys(self):
+        """The names of the model's fields, including computed fields.
+        The list is only built when the mapping is iterated; looking up
+        single keys does not need it.
+        """
+        if self._model_keys is None:
+            self._model_keys = self.model.keys(True)
+        return self._model_keys
 
     def __getitem__(self, key):
-        if key in self.model_keys:
+        if key in self.model:
             return self._get_formatted(self.model, key)
         else:
             raise KeyError(key)
@@ -69,14 +149,93 @@ class FormattedMapping(collections.Mapping):
             value = value.decode('utf8', 'ignore')
 
         if self.for_path:
-            sep_repl = beets.config['path_sep_replace'].get(unicode)
             for sep in (os.path.sep, os.path.altsep):
                 if sep:
-                    value = value.replace(sep, sep_repl)
+                    value = value.replace(sep, self._sep_repl)
 
         return value
 
 
+class LazyConvertDict(object):
+    """A mapping of field values for a model object that converts the
+    raw values stored in the database using the model's types only when
+    they are first accessed.
+
+    The raw values are either a database row, in which case `positions`
+    maps field names to indices in the row (and is shared among all the
+    rows of a query), or a plain dictionary.
+    """
+    __slots__ = ('_model_cls', '_raw', '_positions', '_converted')
+
+    def __init__(self, model_cls, raw, positions=None):
+        self._model_cls = model_cls
+        self._raw = raw
+        self._positions = positions
+        self._converted = {}
+
+    def _raw_keys(self):
+        if self._positions is None:
+            return self._raw.keys()
+        return self._positions.keys()
+
+    def _has_raw(self, key):
+        if self._positions is None:
+            return key in self._raw
+        return key in self._positions
+
+    def _get_raw(self, key):
+        if self._positions is None:
+            return self._raw[key]
+        return self._raw[self._positions[key]]
+
+    def __getitem__(self, key):
+        if key in self._converted:
+            return self._converted[key]
+        elif self._has_raw(key):
+            value = self._model_cls._type(key).from_sql(self._get_raw(key))
+            self._converted[key] = value
+            return value
+        else:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self._converted[key] = value
+
+    def __delitem__(self, key):
+        # Deletion is rare: convert everything and drop the raw values
+        # so the key does not reappear.
+        self._converted = dict(self.items())
+        self._raw = {}
+        self._positions = None
+        del self._converted[key]
+
+    def __contains__(self, key):
+        return key in self._converted or self._has_raw(key)
+
+    def keys(self):
+        keys = list(self._converted)
+        keys.extend(k for k in self._raw_keys() if k not in self._converted)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def __reduce__(self):
+        # Copies (and pickles) are plain dictionaries of converted values.
+        return dict, (self.items(),)
+
+
 # Abstract base for model classes.
 
 class Model(object):
@@ -132,6 +291,14 @@ class Model(object):
     are subclasses of `Sort`.
     """
 
+    _indices = {}
+    """A mapping describing the SQLite indices to maintain on the main
+    table. The keys are index names (unique within the table) and the
+    values are sequences of fixed field names to index, in order. A
+    field name may be followed by a collation (e.g., ``'album COLLATE
+    NOCASE'``) so the index can serve case-insensitive sorts.
+    """
+
     _always_dirty = False
     """By default, fields only become "dirty" when their value actually
     changes. Enabling this flag marks fields as dirty even when the new
@@ -163,23 +330,27 @@ class Model(object):
         self._dirty = set()
         self._values_fixed = {}
         self._values_flex = {}
+        self._incomplete = False
 
         # Initial contents.
         self.update(values)
         self.clear_dirty()
 
     @classmethod
-    def _awaken(cls, db=None, fixed_values={}, flex_values={}):
+    def _awaken(cls, db=None, fixed_values={}, flex_values={},
+                positions=None):
         """Create an object with values drawn from the database.
 
         This is a performance optimization: the checks involved with
-        ordinary construction are bypassed.
+        ordinary construction are bypassed, and values are only
+        converted from their SQL representation when they are first
+        accessed. `fixed_values` is a mapping or, if `positions` is
+        given, a database row whose columns are located using that
+        mapping from field names to indices.
         """
         obj = cls(db)
-        for key, value in fixed_values.iteritems():
-            obj._values_fixed[key] = cls._type(key).from_sql(value)
-        for key, value in flex_values.iteritems():
-            obj._values_flex[key] = cls._type(key).from_sql(value)
+        obj._values_fixed = LazyConvertDict(cls, fixed_values, positions)
+        obj._values_flex = LazyConvertDict(cls, flex_values)
         return obj
 
     def __repr__(self):
@@ -223,6 +394,8 @@ class Model(object):
         if key in getters:  # Computed.
             return getters[key](self)
         elif key in self._fields:  # Fixed.
+            if self._incomplete and key not in self._values_fixed:
+                self._load_missing()
             return self._values_fixed.get(key)
         elif key in self._values_flex:  # Flexible.
             return self._values_flex[key]
@@ -298,7 +471,8 @@ class Model(object):
     def __contains__(self, key):
         """Determine whether `key` is an attribute on this object.
         """
-        return key in self.keys(True)
+        return key in self._fields or key in self._values_flex or \
+            key in self._getters()
 
     def __iter__(self):
         """Iterate over the available field names (excluding computed
@@ -336,44 +510,48 @@ class Model(object):
         """
         self._check_db()
 
-        # Build assignments for query.
-        assignments = []
+        # Collect the dirty fixed fields and their values.
+        fields = []
         subvars = []
         for key in self._fields:
             if key != 'id' and key in self._dirty:
                 self._dirty.remove(key)
-                assignments.append(key + '=?')
+                fields.append(key)
                 value = self._type(key).to_sql(self[key])
                 subvars.append(value)
-        assignments = ','.join(assignments)
 
         with self._db.transaction() as tx:
             # Main table update.
-            if assignments:
-                query = 'UPDATE {0} SET {1} WHERE id=?'.format(
-                    self._table, assignments
+            if fields:
+                fields = tuple(fields)
+                query = _cached_sql(
+                    ('update', self._table, fields),
+                    lambda: 'UPDATE {0} SET {1} WHERE id=?'.format(
+                        self._table, ','.join(key + '=?' for key in fields)
+                    )
                 )
                 subvars.append(self.id)
                 tx.mutate(query, subvars)
 
             # Modified/added flexible attributes.
+            flex_insert = _cached_sql(
+                ('flex_insert', self._flex_table),
+                lambda: 'INSERT INTO {0} (entity_id, key, value) '
+                        'VALUES (?, ?, ?);'.format(self._flex_table)
+            )
             for key, value in self._values_flex.items():
                 if key in self._dirty:
                     self._dirty.remove(key)
-                    tx.mutate(
-                        'INSERT INTO {0} '
-                        '(entity_id, key, value) '
-                        'VALUES (?, ?, ?);'.format(self._flex_table),
-                        (self.id, key, value),
-                    )
+                    tx.mutate(flex_insert, (self.id, key, value))
 
             # Deleted flexible attributes.
+            flex_delete = _cached_sql(
+                ('flex_delete', self._flex_table),
+                lambda: 'DELETE FROM {0} '
+                        'WHERE entity_id=? AND key=?'.format(self._flex_table)
+            )
             for key in self._dirty:
-                tx.mutate(
-                    'DELETE FROM {0} '
-                    'WHERE entity_id=? AND key=?'.format(self._flex_table),
-                    (self.id, key)
-                )
+                tx.mutate(flex_delete, (self.id, key))
 
         self.clear_dirty()
 
@@ -385,20 +563,43 @@ class Model(object):
         assert stored_obj is not None, "object {0} not in DB".format(self.id)
         self._values_fixed = {}
         self._values_flex = {}
+        self._incomplete = False
         self.update(dict(stored_obj))
         self.clear_dirty()
 
+    def _load_missing(self):
+        """Load the fixed fields that were left out when the object was
+        fetched from the database (see the `fields` argument of
+        `Database._fetch`).
+        """
+        self._incomplete = False
+        if not self._db or not self.id:
+            return
+        stored_obj = self._db._get(type(self), self.id)
+        if stored_obj is not None:
+            for key in self._fields:
+                if key not in self._values_fixed:
+                    self._values_fixed[key] = stored_obj._values_fixed.get(key)
+
     def remove(self):
         """Remove the object's associated rows from the database.
         """
         self._check_db()
         with self._db.transaction() as tx:
             tx.mutate(
-                'DELETE FROM {0} WHERE id=?'.format(self._table),
+                _cached_sql(
+                    ('delete', self._table),
+                    lambda: 'DELETE FROM {0} WHERE id=?'.format(self._table)
+                ),
                 (self.id,)
             )
             tx.mutate(
-                'DELETE FROM {0} WHERE entity_id=?'.format(self._flex_table),
+                _cached_sql(
+                    ('delete_flex', self._flex_table),
+                    lambda: 'DELETE FROM {0} WHERE entity_id=?'.format(
+                        self._flex_table
+                    )
+                ),
                 (self.id,)
             )
 
@@ -444,7 +645,7 @@ class Model(object):
         """
         # Perform substitution.
         if isinstance(template, basestring):
-            template = Template(template)
+            template = functemplate.template(template)
         return template.substitute(self.formatted(for_path),
                                    self._template_funcs())
 
@@ -466,7 +667,14 @@ class Results(object):
     """An item query result set. Iterating over the collection lazily
     constructs LibModel objects that reflect database rows.
     """
-    def __init__(self, model_class, rows, db, query=None, sort=None):
+    chunk_size = 256
+    """The number of rows that are materialized at once. The flexible
+    attributes for each chunk are fetched in one query, so this must not
+    exceed SQLite's limit on the number of host parameters (999).
+    """
+
+    def __init__(self, model_class, rows, db, query=None, sort=None,
+                 ids=None, cols='*'):
         """Create a result set that will construct objects of type
         `model_class`.
 
@@ -474,6 +682,13 @@ class Results(object):
         constructed. `rows` is a query result: a list of mappings. The
         new objects will be associated with the database `db`.
 
+        Instead of all the `rows`, a list of row `ids` may be given. Then
+        the rows are not held in memory: they are fetched from the
+        database a chunk at a time as objects are materialized. Rows that
+        have been deleted in the meantime are skipped. `rows` may then
+        hold the first rows, already read, so that they are not fetched
+        again. `cols` is the list of columns to fetch (in SQL syntax).
+
         If `query` is provided, it is used as a predicate to filter the
         results for a "slow query" that cannot be evaluated by the
         database directly. If `sort` is provided, it is used to sort the
@@ -487,15 +702,75 @@ class Results(object):
         self.query = query
         self.sort = sort
 
-        # We keep a queue of rows we haven't yet consumed for
-        # materialization. We preserve the original total number of
-        # rows.
-        self._rows = rows
-        self._row_count = len(rows)
+        # The rows (or the ids of the rows) to materialize. We keep the
+        # total number of rows and the number that has been consumed
+        # for materialization so far.
+        self._rows = rows or []
+        self._ids = ids
+        self._cols = cols
+        self._row_count = len(self._rows if ids is None else ids)
+        self._consumed = 0
+
+        # The number of objects, once it has been counted.
+        self._length = None
 
         # The materialized objects corresponding to rows that have been
-        # consumed.
+        # consumed and, once built, the objects in slow-sorted order.
         self._objects = []
+        self._sorted_objects = None
+
+    @classmethod
+    def _from_objects(cls, model_class, objects, db):
+        """Create a result set for a list of already-materialized
+        objects.
+        """
+        results = cls(model_class, [], db)
+        results._objects = objects
+        return results
+
+    def _get_rows(self, start, stop):
+        """Get the rows in the range [`start`, `stop`) of the result
+        set, fetching them from the database if necessary.
+        """
+        if self._ids is None or stop <= len(self._rows):
+            # All rows, or rows read along with the ids, are at hand.
+            return self._rows[start:stop]
+
+        ids = self._ids[start:stop]
+        if not ids:
+            return []
+        table = self.model_class._table
+        sql = _cached_sql(
+            ('select_ids', table, self._cols, len(ids)),
+            lambda: 'SELECT {0} FROM {1} WHERE id IN ({2})'
+                    .format(self._cols, table, ', '.join('?' * len(ids)))
+        )
+        with self.db.transaction(False) as tx:
+            rows = tx.query(sql, ids)
+
+        # Restore the original order, skipping deleted rows.
+        by_id = dict((row[b'id'], row) for row in rows)
+        return [by_id[id] for id in ids if id in by_id]
+
+    def _count_rows(self, start, enough=None):
+        """Count the rows from `start` on that still exist in the
+        database (when the result set holds row ids). If `enough` is
+        given, stop counting once at least that many rows are found.
+        """
+        table = self.model_class._table
+        count = 0
+        with self.db.transaction(False) as tx:
+            for chunk in xrange(start, self._row_count, self.chunk_size):
+                if enough is not None and count >= enough:
+                    break
+                ids = self._ids[chunk:chunk + self.chunk_size]
+                sql = _cached_sql(
+                    ('count_ids', table, len(ids)),
+                    lambda: 'SELECT COUNT(*) FROM {0} WHERE id IN ({1})'
+                            .format(table, ', '.join('?' * len(ids)))
+                )
+                count += tx.query(sql, ids)[0][0]
+        return count
 
     def _get_objects(self):
         """Construct and generate Model objects for they query. The
@@ -505,28 +780,44 @@ class Results(object):
         For performance, this generator caches materialized objects to
         avoid constructing them more than once. This way, iterating over
         a `Results` object a second time should be much faster than the
-        first.
+        first. Rows are materialized in chunks of `chunk_size` so that
+        the flexible attributes for a whole chunk can be fetched with a
+        single query.
         """
         index = 0  # Position in the materialized objects.
-        while index < len(self._objects) or self._rows:
+        while index < len(self._objects) or self._unconsumed():
             # Are there previously-materialized objects to produce?
             if index < len(self._objects):
                 yield self._objects[index]
                 index += 1
 
-            # Otherwise, we consume another row, materialize its object
-            # and produce it.
+            # Otherwise, we consume another chunk of rows and
+            # materialize their objects.
             else:
-                while self._rows:
-                    row = self._rows.pop(0)
-                    obj = self._make_model(row)
-                    # If there is a slow-query predicate, ensurer that the
-                    # object passes it.
-                    if not self.query or self.query.match(obj):
-                        self._objects.append(obj)
-                        index += 1
-                        yield obj
-                        break
+                self._materialize_chunk()
+
+    def _unconsumed(self):
+        """Are there rows that have not yet been materialized?
+        """
+        return self._consumed < self._row_count
+
+    def _materialize_chunk(self):
+        """Consume the next chunk of rows, construct their objects, and
+        add those that pass the slow-query predicate (if any) to the
+        materialized object list.
+        """
+        start = self._consumed
+        self._consumed += self.chunk_size
+        for obj in self._filter(self._get_rows(start, self._consumed)):
+            self._objects.append(obj)
+
+    def _filter(self, rows):
+        """Construct objects for a sequence of rows and generate those
+        that pass the slow-query predicate (if any).
+        """
+        for obj in self._make_models(rows):
+            if not self.query or self.query.match(obj):
+                yield obj
 
     def __iter__(self):
         """Construct and generate Model objects for all matching
@@ -534,36 +825,111 @@ class Results(object):
         """
         if self.sort:
             # Slow sort. Must build the full list first.
-            objects = self.sort.sort(list(self._get_objects()))
-            return iter(objects)
+            if self._sorted_objects is None:
+                self._sorted_objects = \
+                    self.sort.sort(list(self._get_objects()))
+            return iter(self._sorted_objects)
 
         else:
             # Objects are pre-sorted (i.e., by the database).
             return self._get_objects()
 
-    def _make_model(self, row):
-        # Get the flexible attributes for the object.
-        with self.db.transaction() as tx:
-            flex_rows = tx.query(
-                'SELECT * FROM {0} WHERE entity_id=?'.format(
-                    self.model_class._flex_table
-                ),
-                (row[b'id'],)
-            )
+    def stream(self):
+        """Generate Model objects for all matching objects, in sorted
+        order, without keeping them in this result set. Unlike ordinary
+        iteration, this uses a constant amount of memory (unless a slow
+        sort requires all objects to be built first).
+        """
+        if self.sort or not self._unconsumed():
+            for obj in self:
+                yield obj
+            return
 
-        cols = dict(row)
-        values = dict((k, v) for (k, v) in cols.items()
-                      if not k[:4] == 'flex')
-        flex_values = dict((row[b'key'], row[b'value']) for row in flex_rows)
+        for start in xrange(0, self._row_count, self.chunk_size):
+            rows = self._get_rows(start, start + self.chunk_size)
+            for obj in self._filter(rows):
+                yield obj
 
-        # Construct the Python object
-        obj = self.model_class._awaken(self.db, values, flex_values)
-        return obj
+    def slice(self, start=None, stop=None):
+        """Get a new result set containing the objects in the range
+        [`start`, `stop`) of this one. The range has the semantics of
+        Python's slices.
+
+        If the query and sort are evaluated by the database, no objects
+        outside of the range are built. Otherwise, the whole result set
+        must be materialized first.
+        """
+        if self.query or self.sort:
+            return self._from_objects(self.model_class,
+                                      list(self)[start:stop], self.db)
+        elif not self._unconsumed():
+            return self._from_objects(self.model_class,
+                                      self._objects[start:stop], self.db)
+        elif self._ids is None:
+            return Results(self.model_class, self._rows[start:stop],
+                           self.db)
+        else:
+            return Results(self.model_class, None, self.db,
+                           ids=self._ids[start:stop], cols=self._cols)
+
+    def _make_models(self, rows):
+        """Construct Model objects for a sequence of rows. The flexible
+        attributes for all the rows are fetched with a single query.
+        """
+        if not rows:
+            return []
+        flex_attrs = self._get_flex_attrs([row[b'id'] for row in rows])
+
+        # All the rows have the same columns: find them once.
+        positions = dict((key, i) for i, key in enumerate(rows[0].keys()))
+        incomplete = not all(key in positions
+                             for key in self.model_class._fields)
+
+        objs = []
+        for row in rows:
+            obj = self._make_model(row, flex_attrs.get(row[b'id'], {}),
+                                   positions)
+            obj._incomplete = incomplete
+            objs.append(obj)
+        return objs
+
+    def _get_flex_attrs(self, ids):
+        """Get the flexible attributes for the objects with the given
+        ids. Return a dictionary mapping each id to a dictionary of
+        flexible attributes (ids without any flexible attributes are
+        omitted).
+        """
+        flex_attrs = defaultdict(dict)
+        if not ids:
+            return flex_attrs
+
+        flex_table = self.model_class._flex_table
+        sql = _cached_sql(
+            ('flex_select', flex_table, len(ids)),
+            lambda: 'SELECT entity_id, key, value FROM {0} '
+                    'WHERE entity_id IN ({1})'
+                    .format(flex_table, ', '.join('?' * len(ids)))
+        )
+        with self.db.transaction(False) as tx:
+            flex_rows = tx.query(sql, ids)
+        for row in flex_rows:
+            flex_attrs[row[b'entity_id']][row[b'key']] = row[b'value']
+        return flex_attrs
+
+    def _make_model(self, row, flex_values={}, positions=None):
+        """Construct a Model object for a row, keeping the row itself
+        as the object's fixed values. `positions` maps the columns of
+        the row to their indices.
+        """
+        if positions is None:
+            positions = dict((key, i) for i, key in enumerate(row.keys()))
+        return self.model_class._awaken(self.db, row, flex_values,
+                                        positions)
 
     def __len__(self):
         """Get the number of matching objects.
         """
-        if not self._rows:
+        if not self._unconsumed():
             # Fully materialized. Just count the objects.
             return len(self._objects)
 
@@ -574,6 +940,14 @@ class Results(object):
                 count += 1
             return count
 
+        elif self._ids is not None:
+            # Rows may have been deleted since their ids were read, and
+            # iteration skips them. Count the rows that remain (once).
+            if self._length is None:
+                self._length = len(self._objects) + \
+                    self._count_rows(self._consumed)
+            return self._length
+
         else:
             # A fast query. Just count the rows.
             return self._row_count
@@ -581,23 +955,32 @@ class Results(object):
     def __nonzero__(self):
         """Does this result contain any objects?
         """
+        if self.query:
+            # A slow query. Stop at the first matching object.
+            return self.get() is not None
+        elif self._ids is not None and self._length is None and \
+                self._unconsumed():
+            # Stop at the first row that still exists.
+            return bool(self._objects) or \
+                self._count_rows(self._consumed, 1) > 0
         return bool(len(self))
 
     def __getitem__(self, n):
-        """Get the nth item in this result set. This is inefficient: all
-        items up to n are materialized and thrown away.
+        """Get the nth item in this result set. The objects up to the
+        nth (or all of them, for a negative index or a slow sort) are
+        materialized and kept, so looking up an index again returns the
+        same object.
         """
-        if not self._rows and not self.sort:
-            # Fully materialized and already in order. Just look up the
-            # object.
-            return self._objects[n]
+        if self.sort or n < 0:
+            objects = list(self)
+        else:
+            while n >= len(self._objects) and self._unconsumed():
+                self._materialize_chunk()
+            objects = self._objects
 
-        it = iter(self)
         try:
-            for i in range(n):
-                it.next()
-            return it.next()
-        except StopIteration:
+            return objects[n]
+        except IndexError:
             raise IndexError('result index {0} out of range'.format(n))
 
     def get(self):
@@ -614,9 +997,16 @@ class Results(object):
 class Transaction(object):
     """A context manager for safe, concurrent access to the database.
     All SQL commands should be executed through a transaction.
+
+    A transaction is either a write transaction (the default) or a
+    read-only transaction. When the database allows concurrent reads,
+    read-only transactions do not wait for the database lock, so any
+    number of them can run alongside a single write transaction.
     """
-    def __init__(self, db):
+    def __init__(self, db, write=True):
         self.db = db
+        self.write = write
+        self._locked = False
 
     def __enter__(self):
         """Begin a transaction. This transaction may be created while
@@ -625,10 +1015,18 @@ class Transaction(object):
         with self.db._tx_stack() as stack:
             first = not stack
             stack.append(self)
+            root = stack[0]
         if first:
             # Beginning a "root" transaction, which corresponds to an
             # SQLite transaction.
+            if self.write or not self.db._concurrent_reads:
+                self.db._db_lock.acquire()
+                self._locked = True
+        elif self.write and not root._locked:
+            # A write nested inside a read-only transaction: the root
+            # transaction must now hold the lock until it completes.
             self.db._db_lock.acquire()
+            root._locked = True
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -642,7 +1040,9 @@ class Transaction(object):
         if empty:
             # Ending a "root" transaction. End the SQLite transaction.
             self.db._connection().commit()
-            self.db._db_lock.release()
+            if self._locked:
+                self._locked = False
+                self.db._db_lock.release()
 
     def query(self, statement, subvals=()):
         """Execute an SQL statement with substitution values and return
@@ -658,6 +1058,12 @@ class Transaction(object):
         cursor = self.db._connection().execute(statement, subvals)
         return cursor.lastrowid
 
+    def mutate_many(self, statement, subvals_seq):
+        """Execute an SQL statement once for each sequence of
+        substitution values in `subvals_seq`.
+        """
+        self.db._connection().executemany(statement, subvals_seq)
+
     def script(self, statements):
         """Execute a string containing multiple SQL statements."""
         self.db._connection().executescript(statements)
@@ -689,12 +1095,22 @@ class Database(object):
         # whole-second sleeps (!) that would trigger its internal
         # timeout. Using this lock ensures only one SQLite transaction
         # is active at a time.
+        #
+        # When concurrent reads are enabled, the database uses SQLite's
+        # write-ahead log so readers never block on a writer. Then, this
+        # lock only serializes write transactions.
         self._db_lock = threading.Lock()
+        self._concurrent_reads = (
+            path != ':memory:' and
+            beets.config['concurrent_reads'].get(bool)
+        )
 
         # Set up database schema.
         for model_cls in self._models:
             self._make_table(model_cls._table, model_cls._fields)
             self._make_attribute_table(model_cls._flex_table)
+            self._make_indices(model_cls)
+            self._make_fts_table(model_cls)
 
     # Primitive access control: connections and transactions.
 
@@ -711,14 +1127,30 @@ class Database(object):
                 conn = sqlite3.connect(
                     self.path,
                     timeout=beets.config['timeout'].as_number(),
+                    cached_statements=beets.config['statement_cache_size']
+                    .get(int),
                 )
 
                 # Access SELECT results like dictionaries.
                 conn.row_factory = sqlite3.Row
 
+                if self._concurrent_reads:
+                    # Write-ahead logging lets readers proceed while
+                    # another connection is writing.
+                    conn.execute('PRAGMA journal_mode=WAL')
+
+                self._register_functions(conn)
+
                 self._connections[thread_id] = conn
                 return conn
 
+    def _register_functions(self, conn):
+        """Install the SQL functions that queries may use on a new
+        connection. Subclasses can override this to add their own
+        functions.
+        """
+        conn.create_function('regexp', 2, sql_regexp)
+
     @contextlib.contextmanager
     def _tx_stack(self):
         """A context manager providing access to the current thread's
@@ -729,11 +1161,12 @@ class Database(object):
         with self._shared_map_lock:
             yield self._tx_stacks[thread_id]
 
-    def transaction(self):
+    def transaction(self, write=True):
         """Get a :class:`Transaction` object for interacting directly
-        with the underlying SQLite database.
+        with the underlying SQLite database. Pass `write=False` for a
+        transaction that only reads from the database.
         """
-        return Transaction(self)
+        return Transaction(self, write)
 
     # Schema setup and migration.
 
@@ -742,7 +1175,7 @@ class Database(object):
         from field names to `Type`s. Columns are added if necessary.
         """
         # Get current schema.
-        with self.transaction() as tx:
+        with self.transaction(False) as tx:
             rows = tx.query('PRAGMA table_info(%s)' % table)
         current_fields = set([row[1] for row in rows])
 
@@ -788,36 +1221,324 @@ class Database(object):
                     ON {0} (entity_id);
                 """.format(flex_table))
 
+    def _index_spec(self, model_cls):
+        """Get the indices that should exist on the table for
+        `model_cls`: a mapping from index names to the sequences of
+        columns they index. These are the model's declared `_indices` and
+        the fields listed for the table in the `index` configuration
+        option. Configured fields that are not fixed fields of the model
+        cannot be indexed and are ignored.
+        """
+        table = model_cls._table
+        indices = dict(model_cls._indices)
+
+        view = beets.config['index'][table]
+        if view.exists():
+            for fields in view.get(list):
+                if isinstance(fields, basestring):
+                    fields = [fields]
+                if all(field in model_cls._fields for field in fields):
+                    indices['_'.join(fields)] = fields
+
+        return dict(('{0}_index_{1}'.format(table, name), tuple(columns))
+                    for name, columns in indices.items())
+
+    def _make_indices(self, model_cls):
+        """Create the indices in the specification for `model_cls` that
+        are missing and drop the ones that are obsolete. Indices whose
+        definition has changed are recreated. Only indices created by
+        this method (whose name starts with `<table>_index_`) are
+        touched.
+        """
+        table = model_cls._table
+        spec = dict(
+            (name, 'CREATE INDEX {0} ON {1} ({2})'.format(
+                name, table, ', '.join(columns)))
+            for name, columns in self._index_spec(model_cls).items()
+        )
+        prefix = '{0}_index_'.format(table)
+
+        with self.transaction(False) as tx:
+            rows = tx.query(
+                "SELECT name, sql FROM sqlite_master "
+                "WHERE type = 'index' AND tbl_name = ?", (table,)
+            )
+        current = dict((row[0], row[1]) for row in rows
+                       if row[0].startswith(prefix))
+
+        setup_sql = ''
+        for name, sql in current.items():
+            if spec.get(name) != sql:
+                setup_sql += 'DROP INDEX {0};\n'.format(name)
+        for name, sql in sorted(spec.items()):
+            if current.get(name) != sql:
+                setup_sql += '{0};\n'.format(sql)
+
+        if setup_sql:
+            with self.transaction() as tx:
+                tx.script(setup_sql)
+
+    def _make_fts_table(self, model_cls):
+        """Create the full-text search table for `model_cls` if it is
+        enabled, or drop it if it is not. The table indexes the model's
+        search fields. It is an FTS5 "external content" table, kept in
+        sync with the main table by triggers, so every way of changing
+        the main table also updates the index.
+        """
+        table = model_cls._table
+        fts = fts_table(model_cls)
+        if not fts:
+            return
+
+        fields = model_cls._search_fields
+        create = None
+        if fts_enabled():
+            create = ("CREATE VIRTUAL TABLE {0} USING fts5({1}, "
+                      "content='{2}', content_rowid='id', "
+                      "tokenize='trigram')").format(fts, ', '.join(fields),
+                                                    table)
+
+        with self.transaction(False) as tx:
+            rows = tx.query("SELECT sql FROM sqlite_master "
+                            "WHERE type = 'table' AND name = ?", (fts,))
+        current = rows[0][0] if rows else None
+        if current == create:
+            return
+
+        setup_sql = ''
+        if current:
+            setup_sql += """
+                DROP TRIGGER IF EXISTS {0}_insert;
+                DROP TRIGGER IF EXISTS {0}_delete;
+                DROP TRIGGER IF EXISTS {0}_update;
+                DROP TABLE {0};
+                """.format(fts)
+        if create:
+            cols = ', '.join(fields)
+            new_vals = ', '.join('new.' + f for f in fields)
+            old_vals = ', '.join('old.' + f for f in fields)
+            setup_sql += """
+                {create};
+                CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {fts} (rowid, {cols})
+                        VALUES (new.id, {new});
+                END;
+                CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {fts} ({fts}, rowid, {cols})
+                        VALUES ('delete', old.id, {old});
+                END;
+                CREATE TRIGGER {fts}_update AFTER UPDATE OF {cols}
+                        ON {table} BEGIN
+                    INSERT INTO {fts} ({fts}, rowid, {cols})
+                        VALUES ('delete', old.id, {old});
+                    INSERT INTO {fts} (rowid, {cols})
+                        VALUES (new.id, {new});
+                END;
+                INSERT INTO {fts} ({fts}) VALUES ('rebuild');
+                """.format(create=create, fts=fts, table=table, cols=cols,
+                           new=new_vals, old=old_vals)
+
+        with self.transaction() as tx:
+            tx.script(setup_sql)
+
+    # Adding objects.
+
+    def bulk_insert(self, objs):
+        """Add a sequence of new Model objects to the database. This is
+        equivalent to calling `add` on each object, but each table is
+        written using a few batched statements rather than several
+        statements per object.
+
+        The objects' `id` and `added` fields are set along with any
+        current field values.
+        """
+        # Group the objects by model, preserving their order.
+        by_model = collections.OrderedDict()
+        for obj in objs:
+            by_model.setdefault(type(obj), []).append(obj)
+
+        with self.transaction() as tx:
+            for model_cls, models in by_model.items():
+                self._bulk_insert_models(tx, model_cls, models)
+
+    def _bulk_insert_models(self, tx, model_cls, objs):
+        """Insert objects of a single model type within the transaction
+        `tx`.
+        """
+        columns = [key for key in model_cls._fields if key != 'id']
+        insert = _cached_sql(
+            ('insert', model_cls._table, tuple(columns)),
+            lambda: 'INSERT INTO {0} (id, {1}) VALUES ({2})'.format(
+                model_cls._table,
+                ', '.join(columns),
+                ', '.join('?' * (len(columns) + 1)),
+            )
+        )
+
+        rows = []
+        for obj in objs:
+            obj._db = self
+            obj.added = time.time()
+            rows.append([model_cls._type(key).to_sql(obj[key])
+                         for key in columns])
+
+        # Insert the first row to obtain its id. This also makes the
+        # connection hold SQLite's write lock, so the remaining rows
+        # can be given consecutive ids explicitly.
+        first_id = tx.mutate(insert, [None] + rows[0])
+        tx.mutate_many(insert, ([first_id + i] + row
+                                for i, row in enumerate(rows[1:], 1)))
+
+        # Flexible attributes.
+        flex_rows = []
+        for i, obj in enumerate(objs):
+            obj.id = first_id + i
+            for key, value in obj._values_flex.items():
+                if value is not None:
+                    flex_rows.append((obj.id, key, value))
+        tx.mutate_many(
+            'INSERT INTO {0} (entity_id, key, value) '
+            'VALUES (?, ?, ?)'.format(model_cls._flex_table),
+            flex_rows
+        )
+
+        for obj in objs:
+            obj.clear_dirty()
+
     # Querying.
 
-    def _fetch(self, model_cls, query=None, sort=None):
+    def _select_sql(self, model_cls, cols, where, order_by):
+        """Get a SQL statement selecting the columns `cols` from the rows
+        of the table for `model_cls` matching the `where` clause, in the
+        order given by the `order_by` clause (either may be None). The
+        statement takes the limit and offset as its last two parameters.
+        """
+        return _cached_sql(
+            ('select', model_cls._table, cols, where, order_by),
+            lambda: "SELECT {0} FROM {1} WHERE {2} {3} LIMIT ? OFFSET ?"
+                    .format(cols, model_cls._table, where or '1',
+                            "ORDER BY {0}".format(order_by)
+                            if order_by else '')
+        )
+
+    def _fetch(self, model_cls, query=None, sort=None, limit=None,
+               offset=0, fields=None):
         """Fetch the objects of type `model_cls` matching the given
         query. The query may be given as a string, string sequence, a
         Query object, or None (to fetch everything). `sort` is an
         `Sort` object.
+
+        `limit` and `offset` restrict the results to a window of the
+        (sorted) matching objects. When the query and sort can be
+        evaluated by the database, this happens in SQL and only the
+        requested rows are read.
+
+        Small result sets are read right away. For larger ones, only the
+        ids of the matching rows are read; the rows themselves are
+        fetched a chunk at a time while iterating over the `Results`.
+
+        `fields` optionally lists the names of the fields that will be
+        used. Then only those fixed fields are read; the objects load
+        the rest from the database if they are accessed. All fields are
+        read if the query or the sort is evaluated in Python or if a
+        computed field is requested.
         """
         query = query or TrueQuery()  # A null query.
         sort = sort or NullSort()  # Unsorted.
         where, subvals = query.clause()
         order_by = sort.order_clause()
-
-        sql = ("SELECT * FROM {0} WHERE {1} {2}").format(
-            model_cls._table,
-            where or '1',
-            "ORDER BY {0}".format(order_by) if order_by else '',
-        )
-
-        with self.transaction() as tx:
-            rows = tx.query(sql, subvals)
-
-        return Results(
-            model_cls, rows, self,
-            None if where else query,  # Slow query component.
-            sort if sort.is_slow() else None,  # Slow sort component.
-        )
+        slow_query = None if where else query
+        slow_sort = sort if sort.is_slow() else None
+
+        cols = '*'
+        if fields is not None and not (slow_query or slow_sort) and \
+                not any(f in model_cls._getters() for f in fields):
+            cols = ', '.join(['id'] + sorted(
+                set(f for f in fields if f in model_cls._fields) - set(['id'])
+            ))
+
+        # The window can be applied in SQL only when SQL decides which
+        # rows match and in what order.
+        if slow_query or slow_sort:
+            sql_limit, sql_offset = -1, 0
+        else:
+            sql_limit = -1 if limit is None else limit
+            sql_offset = offset
+
+        # Read the first chunk's worth of rows (plus one, to tell
+        # whether there are more).
+        first = Results.chunk_size + 1
+        if 0 <= sql_limit < first:
+            first = sql_limit
+        sql = self._select_sql(model_cls, cols, where, order_by)
+        with self.transaction(False) as tx:
+            rows = tx.query(sql, list(subvals) + [first, sql_offset])
+
+            if len(rows) <= Results.chunk_size:
+                results = Results(model_cls, rows, self,
+                                  slow_query, slow_sort)
+            else:
+                sql = self._select_sql(model_cls, 'id', where, order_by)
+                ids = [row[b'id'] for row in tx.query(
+                    sql, list(subvals) + [sql_limit, sql_offset]
+                )]
+                results = Results(model_cls, rows[:Results.chunk_size],
+                                  self, slow_query, slow_sort, ids=ids,
+                                  cols=cols)
+
+        if (slow_query or slow_sort) and (limit is not None or offset):
+            stop = None if limit is None else offset + limit
+            results = results.slice(offset, stop)
+        return results
 
     def _get(self, model_cls, id):
         """Get a Model object by its id or None if the id does not
         exist.
         """
         return self._fetch(model_cls, MatchQuery('id', id)).get()
+
+    def _query_plan(self, model_cls, query=None, sort=None):
+        """Describe how SQLite evaluates the parts of `query` and `sort`
+        that are handled by the database. Return a list of strings from
+        SQLite's ``EXPLAIN QUERY PLAN``, which name the indices used (if
+        any).
+        """
+        query = query or TrueQuery()
+        sort = sort or NullSort()
+        where, subvals = query.clause()
+        sql = self._select_sql(model_cls, '*', where, sort.order_clause())
+        with self.transaction(False) as tx:
+            rows = tx.query('EXPLAIN QUERY PLAN ' + sql,
+                            list(subvals) + [-1, 0])
+        return [row[b'detail'] for row in rows]
+
+    def _aggregate(self, model_cls, aggregates, query=None):
+        """Compute a sequence of `Aggregate` functions over the objects
+        of type `model_cls` matching `query`. Return a list with the
+        result for each aggregate.
+
+        When the query can be evaluated by the database and the
+        aggregates only involve fixed fields, everything is computed in
+        a single SQL statement. Otherwise, the matching objects are
+        built and the aggregates are computed in Python.
+        """
+        query = query or TrueQuery()
+        where, subvals = query.clause()
+        fast = where is not None and all(
+            field in model_cls._fields
+            for aggregate in aggregates for field in aggregate.fields
+        )
+
+        if fast:
+            cols = ', '.join(a.col_clause() for a in aggregates)
+            sql = _cached_sql(
+                ('aggregate', model_cls._table, cols, where),
+                lambda: 'SELECT {0} FROM {1} WHERE {2}'.format(
+                    cols, model_cls._table, where or '1'
+                )
+            )
+            with self.transaction(False) as tx:
+                return list(tx.query(sql, subvals)[0])
+
+        objs = list(self._fetch(model_cls, query).stream())
+        return [aggregate.compute(objs) for aggregate in aggregates]
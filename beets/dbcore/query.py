@@ -18,6 +18,7 @@ from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
 import re
+import copy
 from operator import mul
 from beets import util
 from datetime import datetime, timedelta
@@ -89,20 +90,58 @@ class FieldQuery(Query):
     determines whether a certain pattern string matches a certain value
     string. Subclasses may also provide `col_clause` to implement the
     same matching functionality in SQLite.
+
+    Queries on flexible attributes are not "fast", but they can still
+    be evaluated by SQLite if `table` and `flex_table` are set to the
+    model's main and attribute table names: `col_clause` is then applied
+    to the attribute's value in a subquery on the attribute table.
+    """
+    flex_column = 'value'
+    """The SQL expression used in place of the field name when the
+    query is evaluated against a flexible attribute's value, which is
+    always stored as text.
     """
+
     def __init__(self, field, pattern, fast=True):
         self.field = field
         self.pattern = pattern
         self.fast = fast
+        self.table = None
+        self.flex_table = None
 
     def col_clause(self):
         return None, ()
 
+    def flex_clause(self):
+        """Generate an SQLite expression implementing the query for a
+        flexible attribute: an `EXISTS` subquery on the attribute table
+        that applies `col_clause` to the attribute's value.
+
+        Objects without the attribute are never matched by the
+        subquery, so queries that match a missing value are left to
+        Python.
+        """
+        if self.match_missing():
+            return None, ()
+        value_query = copy.copy(self)
+        value_query.field = self.flex_column
+        clause, subvals = value_query.col_clause()
+        if not clause:
+            return None, ()
+        clause = ('EXISTS (SELECT 1 FROM {0} WHERE {0}.entity_id = {1}.id '
+                  'AND {0}.key = ? AND ({2}))').format(
+            self.flex_table, self.table, clause
+        )
+        return clause, [self.field] + list(subvals)
+
     def clause(self):
         if self.fast:
             return self.col_clause()
+        elif self.table and self.flex_table:
+            # Matching a flexattr in the attribute table.
+            return self.flex_clause()
         else:
-            # Matching a flexattr. This is a slow query.
+            # Matching a computed field. This is a slow query.
             return None, ()
 
     @classmethod
@@ -112,6 +151,12 @@ class FieldQuery(Query):
         """
         raise NotImplementedError()
 
+    def match_missing(self):
+        """Determine whether the query matches objects that do not have
+        the field at all.
+        """
+        return self.value_match(self.pattern, None)
+
     def match(self, item):
         return self.value_match(self.pattern, item.get(self.field))
 
@@ -145,6 +190,10 @@ class NoneQuery(FieldQuery):
     def col_clause(self):
         return self.field + " IS NULL", ()
 
+    def match_missing(self):
+        # A missing flexible attribute also counts as null.
+        return True
+
     @classmethod
     def match(self, item):
         try:
@@ -192,6 +241,34 @@ class SubstringQuery(StringFieldQuery):
         return pattern.lower() in value.lower()
 
 
+REGEXP_CACHE_SIZE = 256
+"""The maximum number of compiled patterns kept by `compile_regexp`.
+"""
+
+_regexp_cache = {}
+
+
+def compile_regexp(pattern):
+    """Compile a regular expression pattern string, reusing the
+    compiled pattern if the same string was compiled recently. Raises
+    `re.error` for invalid patterns.
+    """
+    try:
+        return _regexp_cache[pattern]
+    except KeyError:
+        if len(_regexp_cache) >= REGEXP_CACHE_SIZE:
+            _regexp_cache.clear()
+        compiled = _regexp_cache[pattern] = re.compile(pattern)
+        return compiled
+
+
+def sql_regexp(pattern, value):
+    """Implement SQLite's `value REGEXP pattern` operator with the same
+    semantics as `RegexpQuery.value_match`.
+    """
+    return compile_regexp(pattern).search(util.as_string(value)) is not None
+
+
 class RegexpQuery(StringFieldQuery):
     """A query that matches a regular expression in a specific item
     field.
@@ -202,13 +279,18 @@ class RegexpQuery(StringFieldQuery):
     def __init__(self, field, pattern, fast=True):
         super(RegexpQuery, self).__init__(field, pattern, fast)
         try:
-            self.pattern = re.compile(self.pattern)
+            self.pattern = compile_regexp(self.pattern)
         except re.error as exc:
             # Invalid regular expression.
             raise InvalidQueryArgumentTypeError(pattern,
                                                 "a regular expression",
                                                 format(exc))
 
+    def col_clause(self):
+        # The `REGEXP` operator is implemented by `sql_regexp`, which
+        # the database registers on each of its connections.
+        return self.field + " REGEXP ?", [self.pattern.pattern]
+
     @classmethod
     def string_match(cls, pattern, value):
         return pattern.search(value) is not None
@@ -251,6 +333,16 @@ class BytesQuery(MatchQuery):
         return self.field + " = ?", [self.buf_pattern]
 
 
+NUMERIC_FLEX_VALUE = ("(CASE WHEN value GLOB '*[0-9]*' AND "
+                      "value NOT GLOB '*[^0-9.eE+ -]*' "
+                      "THEN CAST(value AS REAL) END)")
+"""The SQL expression for a flexible attribute's value as a number.
+SQLite casts any text to a number (text that is not a number becomes
+0), so values that do not look like numbers are NULL instead and never
+match, as in Python.
+"""
+
+
 class NumericQuery(FieldQuery):
     """Matches numeric fields. A syntax using Ruby-style range ellipses
     (``..``) lets users specify one- or two-sided ranges. For example,
@@ -259,6 +351,8 @@ class NumericQuery(FieldQuery):
     Raises InvalidQueryError when the pattern does not represent an int or
     a float.
     """
+    flex_column = NUMERIC_FLEX_VALUE
+
     def _convert(self, s):
         """Convert a string to a numeric type (float or int).
 
@@ -291,6 +385,9 @@ class NumericQuery(FieldQuery):
             self.rangemin = self._convert(parts[0])
             self.rangemax = self._convert(parts[1])
 
+    def match_missing(self):
+        return False
+
     def match(self, item):
         if self.field not in item:
             return False
@@ -383,13 +480,25 @@ class AnyFieldQuery(CollectionQuery):
         self.fields = fields
         self.query_class = cls
 
+        # If the fields have a full-text search table (`fts_table`) for
+        # the model's main `table`, it is used to narrow the candidates
+        # before testing each field.
+        self.table = None
+        self.fts_table = None
+
         subqueries = []
         for field in self.fields:
             subqueries.append(cls(field, pattern, True))
         super(AnyFieldQuery, self).__init__(subqueries)
 
     def clause(self):
-        return self.clause_with_joiner('or')
+        clause, subvals = self.clause_with_joiner('or')
+        if clause and self.fts_table:
+            clause = ('{0}.id IN (SELECT rowid FROM {1} WHERE {1} MATCH ?) '
+                      'AND ({2})').format(self.table, self.fts_table, clause)
+            phrase = '"{0}"'.format(self.pattern.replace('"', '""'))
+            subvals = [phrase] + list(subvals)
+        return clause, subvals
 
     def match(self, item):
         for subq in self.subqueries:
@@ -581,11 +690,16 @@ class DateQuery(FieldQuery):
     The value of a date field can be matched against a date interval by
     using an ellipsis interval syntax similar to that of NumericQuery.
     """
+    flex_column = NUMERIC_FLEX_VALUE
+
     def __init__(self, field, pattern, fast=True):
         super(DateQuery, self).__init__(field, pattern, fast)
         start, end = _parse_periods(pattern)
         self.interval = DateInterval.from_periods(start, end)
 
+    def match_missing(self):
+        return False
+
     def match(self, item):
         timestamp = float(item[self.field])
         date = datetime.utcfromtimestamp(timestamp)
@@ -760,6 +874,44 @@ class FixedFieldSort(FieldSort):
         return "{0} {1} {2}".format(self.field, collate, order)
 
 
+class FlexFieldSort(FieldSort):
+    """Sort object to sort on a flexible attribute. The attribute's
+    value is looked up in the attribute table `flex_table` for each row
+    of `table`, so the sort can be done by the database.
+
+    If `numeric` is set, values are compared as numbers rather than as
+    strings (all flexible attributes are stored as text).
+    """
+    def __init__(self, field, ascending=True, case_insensitive=True,
+                 table=None, flex_table=None, numeric=False):
+        super(FlexFieldSort, self).__init__(field, ascending,
+                                            case_insensitive)
+        self.table = table
+        self.flex_table = flex_table
+        self.numeric = numeric
+
+    def order_clause(self):
+        order = "ASC" if self.ascending else "DESC"
+        value = 'CAST(value AS REAL)' if self.numeric else 'value'
+        collate = 'COLLATE NOCASE' \
+            if self.case_insensitive and not self.numeric else ''
+        return ("(SELECT {0} FROM {1} WHERE {1}.entity_id = {2}.id "
+                "AND {1}.key = '{3}') {4} {5}").format(
+            value, self.flex_table, self.table,
+            self.field.replace("'", "''"), collate, order,
+        )
+
+    def sort(self, objs):
+        # Objects without the attribute sort first, as in SQL.
+        def key(obj):
+            field_val = obj.get(self.field)
+            if self.case_insensitive and isinstance(field_val, unicode):
+                field_val = field_val.lower()
+            return field_val is not None, field_val
+
+        return sorted(objs, key=key, reverse=not self.ascending)
+
+
 class SlowFieldSort(FieldSort):
     """A sort criterion by some model field other than a fixed field:
     i.e., a computed or flexible field.
@@ -784,3 +936,109 @@ class NullSort(Sort):
 
     def __hash__(self):
         return 0
+
+
+# Aggregation.
+
+class Aggregate(object):
+    """An abstract aggregate function computed over the objects that
+    match a query. Like queries and sorts, aggregates are computed by
+    the database when they only involve fixed fields and in Python
+    otherwise.
+
+    An aggregate applies to one or more `fields`. When several fields
+    are given, the aggregated value for each object is the product of
+    the fields. With no fields, the object itself is aggregated.
+    """
+    sql_function = None
+    """The name of the SQL aggregate function.
+    """
+
+    def __init__(self, *fields):
+        self.fields = fields
+
+    def col_clause(self):
+        """Generate a SQL expression that computes the aggregate.
+        """
+        expr = ' * '.join(self.fields) or '*'
+        return '{0}({1})'.format(self.sql_function, expr)
+
+    def value(self, obj):
+        """Get the value to aggregate for a single object, or None if
+        the object has no value for some field.
+        """
+        if not self.fields:
+            return obj
+        product = 1
+        for field in self.fields:
+            value = obj.get(field)
+            if value is None:
+                return None
+            product *= value
+        return product
+
+    def compute(self, objs):
+        """Compute the aggregate over the (non-null) values of a
+        sequence of objects in Python.
+        """
+        values = [self.value(obj) for obj in objs]
+        return self.reduce([v for v in values if v is not None])
+
+    def reduce(self, values):
+        """Reduce a list of values to the aggregate result.
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__,
+                                 ', '.join(map(repr, self.fields)))
+
+
+class Count(Aggregate):
+    """Count the objects that have a value for the fields (or all the
+    objects, if no fields are given).
+    """
+    sql_function = 'COUNT'
+
+    def reduce(self, values):
+        return len(values)
+
+
+class CountDistinct(Aggregate):
+    """Count the distinct values of a field.
+    """
+    def __init__(self, field):
+        super(CountDistinct, self).__init__(field)
+
+    def col_clause(self):
+        return 'COUNT(DISTINCT {0})'.format(self.fields[0])
+
+    def reduce(self, values):
+        return len(set(values))
+
+
+class Sum(Aggregate):
+    """The sum of the values, or None if there are none.
+    """
+    sql_function = 'SUM'
+
+    def reduce(self, values):
+        return sum(values) if values else None
+
+
+class Min(Aggregate):
+    """The smallest value, or None if there are none.
+    """
+    sql_function = 'MIN'
+
+    def reduce(self, values):
+        return min(values) if values else None
+
+
+class Max(Aggregate):
+    """The largest value, or None if there are none.
+    """
+    sql_function = 'MAX'
+
+    def reduce(self, values):
+        return max(values) if values else None
@@ -19,6 +19,8 @@ from __future__ import division, absolute_import, print_function
 import re
 import itertools
 from . import query
+from . import types
+from .db import fts_enabled, fts_table
 import beets
 
 PARSE_QUERY_PART_REGEX = re.compile(
@@ -102,14 +104,43 @@ def construct_query_part(model_cls, prefixes, query_part):
             # The query type matches a specific field, but none was
             # specified. So we use a version of the query that matches
             # any field.
-            return query.AnyFieldQuery(pattern, model_cls._search_fields,
-                                       query_class)
+            q = query.AnyFieldQuery(pattern, model_cls._search_fields,
+                                    query_class)
+
+            # Substring searches for at least three characters (the
+            # length of a trigram) can use the full-text index.
+            if query_class is query.SubstringQuery and \
+                    len(pattern) >= 3 and fts_enabled():
+                q.table = model_cls._table
+                q.fts_table = fts_table(model_cls)
+            return q
         else:
             # Other query type.
             return query_class(pattern)
 
     key = key.lower()
-    return query_class(key.lower(), pattern, key in model_cls._fields)
+    fast = key in model_cls._fields
+
+    # Regular expressions are matched against a value's string form.
+    # SQL only sees that form in text fields: the stored values of other
+    # types (e.g., 0 for a false boolean or NULL for a missing number)
+    # must first be converted by the field's type, in Python.
+    in_sql = True
+    if issubclass(query_class, query.RegexpQuery):
+        field_type = model_cls._fields.get(key) or \
+            model_cls._types.get(key) or types.DEFAULT
+        if not isinstance(field_type, (types.String, types.Default)):
+            fast = in_sql = False
+
+    q = query_class(key, pattern, fast)
+
+    # Queries on flexible (but not computed) fields can be evaluated
+    # in SQL using the model's attribute table.
+    if in_sql and not fast and isinstance(q, query.FieldQuery) and \
+            key not in model_cls._getters():
+        q.table = model_cls._table
+        q.flex_table = model_cls._flex_table
+    return q
 
 
 def query_from_strings(query_cls, model_cls, prefixes, query_parts):
@@ -144,9 +175,16 @@ def construct_sort_part(model_cls, part):
                                        case_insensitive)
     elif field in model_cls._fields:
         sort = query.FixedFieldSort(field, is_ascending, case_insensitive)
-    else:
-        # Flexible or computed.
+    elif field in model_cls._getters():
+        # Computed.
         sort = query.SlowFieldSort(field, is_ascending, case_insensitive)
+    else:
+        # Flexible.
+        numeric = issubclass(model_cls._type(field).query,
+                             (query.NumericQuery, query.DateQuery))
+        sort = query.FlexFieldSort(field, is_ascending, case_insensitive,
+                                   model_cls._table, model_cls._flex_table,
+                                   numeric)
     return sort
 
 
@@ -23,10 +23,11 @@ import os
 import re
 import pickle
 import itertools
+import sqlite3
+import threading
 from collections import defaultdict
 from tempfile import mkdtemp
-from bisect import insort, bisect_left
-from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 import shutil
 import time
 
@@ -46,7 +47,6 @@ action = Enum('action',
               ['SKIP', 'ASIS', 'TRACKS', 'MANUAL', 'APPLY', 'MANUAL_ID',
                'ALBUMS'])
 
-QUEUE_SIZE = 128
 SINGLE_ARTIST_THRESH = 0.25
 VARIOUS_ARTISTS = u'Various Artists'
 PROGRESS_KEY = 'tagprogress'
@@ -65,7 +65,7 @@ class ImportAbort(Exception):
 # Utilities.
 
 def _open_state():
-    """Reads the state file, returning a dictionary."""
+    """Reads the legacy pickled state file, returning a dictionary."""
     try:
         with open(config['statefile'].as_filename()) as f:
             return pickle.load(f)
@@ -78,71 +78,210 @@ def _open_state():
         return {}
 
 
-def _save_state(state):
-    """Writes the state dictionary out to disk."""
-    try:
-        with open(config['statefile'].as_filename(), 'w') as f:
-            pickle.dump(state, f)
-    except IOError as exc:
-        log.error(u'state file could not be written: {0}', exc)
+def _blob(paths):
+    """Encode a path or a sequence of paths as a BLOB for the state
+    database. Paths cannot contain NUL bytes, so they separate the
+    paths in a sequence.
+    """
+    if isinstance(paths, bytes):
+        return buffer(paths)
+    return buffer(b'\0'.join(paths))
 
 
-# Utilities for reading and writing the beets progress file, which
-# allows long tagging tasks to be resumed when they pause (or crash).
+class ImportState(object):
+    """The importer's persistent state, kept in an SQLite database: the
+    progress of interrupted imports, for resuming them, the history of
+    imported directories, for incremental imports, and the fingerprints
+    of directories that incremental imports can skip.
+
+    Each finished album is a row in an indexed table, so recording and
+    looking up an album takes the same time however long the history
+    is. The methods can be called from any thread.
+    """
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS progress (
+                    toppath BLOB, path BLOB, PRIMARY KEY (toppath, path)
+                );
+                CREATE TABLE IF NOT EXISTS history (
+                    paths BLOB PRIMARY KEY
+                );
+                CREATE TABLE IF NOT EXISTS albums (
+                    path BLOB PRIMARY KEY, paths BLOB, fingerprint BLOB
+                );
+                CREATE TABLE IF NOT EXISTS dirs (
+                    path BLOB PRIMARY KEY, album BLOB, subdirs BLOB
+                );
+            """)
+        if version < self.SCHEMA_VERSION:
+            self._migrate()
+
+    def _migrate(self):
+        """Fill a new database with the state from the legacy pickled
+        state file, if any.
+        """
+        state = _open_state()
+        with self.lock, self.conn:
+            for toppath, paths in state.get(PROGRESS_KEY, {}).items():
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO progress VALUES (?, ?)',
+                    [(_blob(toppath), _blob(path)) for path in paths]
+                )
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO history VALUES (?)',
+                [(_blob(paths),) for paths in state.get(HISTORY_KEY, ())]
+            )
+            self.conn.execute(
+                'PRAGMA user_version = {0}'.format(self.SCHEMA_VERSION)
+            )
+
+    def _query(self, statement, subvals=()):
+        with self.lock:
+            return self.conn.execute(statement, subvals).fetchall()
+
+    def _mutate(self, statement, rows):
+        """Execute a statement for each of the parameter tuples in
+        `rows` in a single transaction.
+        """
+        try:
+            with self.lock, self.conn:
+                self.conn.executemany(statement, rows)
+        except sqlite3.Error as exc:
+            log.error(u'state database could not be written: {0}', exc)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def progress_add(self, toppath, paths):
+        self._mutate('INSERT OR IGNORE INTO progress VALUES (?, ?)',
+                     [(_blob(toppath), _blob(path)) for path in paths])
+
+    def progress_element(self, toppath, path):
+        return bool(self._query(
+            'SELECT 1 FROM progress WHERE toppath = ? AND path = ?',
+            (_blob(toppath), _blob(path))
+        ))
+
+    def has_progress(self, toppath):
+        return bool(self._query(
+            'SELECT 1 FROM progress WHERE toppath = ? LIMIT 1',
+            (_blob(toppath),)
+        ))
+
+    def progress_reset(self, toppath):
+        self._mutate('DELETE FROM progress WHERE toppath = ?',
+                     [(_blob(toppath),)])
+
+    def history_add(self, paths):
+        self._mutate('INSERT OR IGNORE INTO history VALUES (?)',
+                     [(_blob(paths),)])
+
+    def history_contains(self, paths):
+        return bool(self._query('SELECT 1 FROM history WHERE paths = ?',
+                                (_blob(paths),)))
+
+    def history_get(self):
+        rows = self._query('SELECT paths FROM history')
+        return set(tuple(bytes(row[0]).split(b'\0')) for row in rows)
+
+    def album_add(self, dirs, paths, fingerprint):
+        """Record the fingerprint of a completely imported album. `dirs`
+        is a list of `(path, subdirs)` pairs for the album's directories,
+        where `subdirs` lists the names of the directory's
+        subdirectories. The first directory identifies the album.
+        `fingerprint` is a string describing the state of the
+        directories in `paths`.
+        """
+        album = dirs[0][0]
+        self._mutate('INSERT OR REPLACE INTO albums VALUES (?, ?, ?)',
+                     [(_blob(album), _blob(paths), _blob(fingerprint))])
+        self._mutate('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                     [(_blob(path), _blob(album), _blob(subdirs))
+                      for path, subdirs in dirs])
+
+    def dir_album(self, path):
+        """If the directory at `path` was recorded as part of an album,
+        return the path identifying the album and the names of the
+        directory's subdirectories. Otherwise, return None.
+        """
+        rows = self._query('SELECT album, subdirs FROM dirs WHERE path = ?',
+                           (_blob(path),))
+        if not rows:
+            return None
+        subdirs = bytes(rows[0][1])
+        return bytes(rows[0][0]), subdirs.split(b'\0') if subdirs else []
+
+    def album_fingerprint(self, album):
+        """If the album identified by the directory `album` was
+        recorded, return the paths of the directories its fingerprint
+        describes and the fingerprint. Otherwise, return None.
+        """
+        rows = self._query(
+            'SELECT paths, fingerprint FROM albums WHERE path = ?',
+            (_blob(album),)
+        )
+        if not rows:
+            return None
+        return bytes(rows[0][0]).split(b'\0'), bytes(rows[0][1])
+
 
-def progress_read():
-    state = _open_state()
-    return state.setdefault(PROGRESS_KEY, {})
+_state = None
+_state_lock = threading.Lock()
 
 
-@contextmanager
-def progress_write():
-    state = _open_state()
-    progress = state.setdefault(PROGRESS_KEY, {})
-    yield progress
-    _save_state(state)
+def import_state():
+    """Get the `ImportState` for the database configured by the
+    `statedb` option, opening it if necessary.
+    """
+    global _state
+    path = config['statedb'].as_filename()
+    with _state_lock:
+        if _state is None or _state.path != path:
+            if _state is not None:
+                _state.close()
+            try:
+                _state = ImportState(path)
+            except sqlite3.Error as exc:
+                # Keep the state in memory for this run instead.
+                log.error(u'state database could not be opened: {0}', exc)
+                _state = ImportState(':memory:')
+                _state.path = path
+        return _state
+
 
+# Utilities for reading and writing the beets progress file, which
+# allows long tagging tasks to be resumed when they pause (or crash).
 
 def progress_add(toppath, *paths):
     """Record that the files under all of the `paths` have been imported
     under `toppath`.
     """
-    with progress_write() as state:
-        imported = state.setdefault(toppath, [])
-        for path in paths:
-            # Normally `progress_add` will be called with the path
-            # argument increasing. This is because of the ordering in
-            # `albums_in_dir`. We take advantage of that to make the
-            # code faster
-            if imported and imported[len(imported) - 1] <= path:
-                imported.append(path)
-            else:
-                insort(imported, path)
+    import_state().progress_add(toppath, paths)
 
 
 def progress_element(toppath, path):
     """Return whether `path` has been imported in `toppath`.
     """
-    state = progress_read()
-    if toppath not in state:
-        return False
-    imported = state[toppath]
-    i = bisect_left(imported, path)
-    return i != len(imported) and imported[i] == path
+    return import_state().progress_element(toppath, path)
 
 
 def has_progress(toppath):
     """Return `True` if there exist paths that have already been
     imported under `toppath`.
     """
-    state = progress_read()
-    return toppath in state
+    return import_state().has_progress(toppath)
 
 
 def progress_reset(toppath):
-    with progress_write() as state:
-        if toppath in state:
-            del state[toppath]
+    import_state().progress_reset(toppath)
 
 
 # Similarly, utilities for manipulating the "incremental" import log.
@@ -153,22 +292,148 @@ def history_add(paths):
     """Indicate that the import of the album in `paths` is completed and
     should not be repeated in incremental imports.
     """
-    state = _open_state()
-    if HISTORY_KEY not in state:
-        state[HISTORY_KEY] = set()
+    import_state().history_add(paths)
 
-    state[HISTORY_KEY].add(tuple(paths))
 
-    _save_state(state)
+def history_contains(paths):
+    """Return whether the album in `paths` was completed in an earlier
+    incremental import.
+    """
+    return import_state().history_contains(paths)
 
 
 def history_get():
     """Get the set of completed path tuples in incremental imports.
     """
-    state = _open_state()
-    if HISTORY_KEY not in state:
-        return set()
-    return state[HISTORY_KEY]
+    return import_state().history_get()
+
+
+# Directories that incremental imports can skip.
+
+class DirectoryPruner(object):
+    """Lets incremental imports skip the albums that earlier imports
+    found to be completely imported and whose directories have not
+    changed since.
+
+    A directory's state is its modification time and inode, which
+    change when entries are added to, removed from or renamed in the
+    directory. An album's fingerprint is the state of all of its
+    directories (several for a multi-disc album) and, for a multi-disc
+    album whose discs are sibling directories, of their parent, where a
+    new disc would appear. An album is skipped or walked as a whole:
+    skipping only the unchanged discs of a changed album would import
+    the others as a separate, partial album.
+
+    The `prune` method serves as the `prune` callback for `sorted_walk`
+    and can be called from several threads: it skips the directories of
+    unchanged albums, and remembers the state of the other directories
+    so that `done` can record their albums' fingerprints once the
+    albums turn out to be imported.
+    """
+    # Fingerprints of directories changed less than this many seconds
+    # before they were examined are not recorded, because a later
+    # change might not alter the modification time on file systems
+    # with coarse timestamps.
+    MIN_AGE = 2.0
+
+    def __init__(self):
+        self.state = import_state()
+        self.lock = threading.Lock()
+        self.walked = {}
+        self.albums = {}
+        self.pruned = 0
+
+    def prune(self, path):
+        """Return the recorded subdirectories of `path` if it can be
+        skipped, or None if it needs to be listed.
+        """
+        try:
+            st = os.stat(syspath(path))
+        except OSError:
+            return None
+
+        recorded = self.state.dir_album(path)
+        if recorded:
+            album, subdirs = recorded
+            if self._unchanged(album, path):
+                return subdirs
+
+        with self.lock:
+            self.walked[path] = [(st.st_mtime, st.st_ino), time.time(), None]
+        return None
+
+    def _unchanged(self, album, path):
+        """Return whether the recorded album identified by the directory
+        `album`, which includes the directory `path`, is unchanged. The
+        answer is kept, so all of the album's directories are skipped or
+        walked together.
+        """
+        with self.lock:
+            if album in self.albums:
+                paths, unchanged = self.albums[album]
+                return unchanged and path in paths
+
+        recorded = self.state.album_fingerprint(album)
+        paths, unchanged = [], False
+        if recorded:
+            paths, fingerprint = recorded
+            try:
+                states = [os.stat(syspath(p)) for p in paths]
+            except OSError:
+                pass
+            else:
+                unchanged = fingerprint == _fingerprint(
+                    (st.st_mtime, st.st_ino) for st in states
+                )
+
+        with self.lock:
+            if album not in self.albums:
+                self.albums[album] = (set(paths), unchanged)
+                if unchanged:
+                    log.debug(u'Skipping unchanged directory: {0}',
+                              displayable_path(album))
+                    self.pruned += 1
+            paths, unchanged = self.albums[album]
+        return unchanged and path in paths
+
+    def listed(self, path, subdirs):
+        """Remember the subdirectories found when listing `path`.
+        """
+        with self.lock:
+            if path in self.walked:
+                self.walked[path][2] = list(subdirs)
+
+    def done(self, dirs):
+        """Record that the album in the directories `dirs` has been
+        imported.
+        """
+        paths = list(dirs)
+        if any(pat.match(os.path.basename(dirs[0]))
+               for pat in MULTIDISC_PATS):
+            # The discs may be siblings: a new one changes the parent.
+            paths.append(os.path.dirname(dirs[0]))
+
+        with self.lock:
+            walked = [self.walked.pop(path, None) for path in dirs]
+            walked += [self.walked.get(path) for path in paths[len(dirs):]]
+        if None in walked or any(w[2] is None for w in walked[:len(dirs)]):
+            return
+        for state, examined, _ in walked:
+            if examined - state[0] < self.MIN_AGE:
+                return
+
+        self.state.album_add(
+            [(path, w[2]) for path, w in zip(dirs, walked)],
+            paths, _fingerprint(w[0] for w in walked)
+        )
+
+
+def _fingerprint(states):
+    """Describe the state of several directories, given as `(mtime,
+    inode)` pairs, as a string.
+    """
+    return b'\0'.join(b'{0!r} {1}'.format(mtime, inode)
+                      for mtime, inode in states)
 
 
 # Abstract session class.
@@ -188,6 +453,7 @@ class ImportSession(object):
         self.query = query
         self.seen_idents = set()
         self._is_resuming = dict()
+        self.stats = None
 
         # Normalize the paths.
         if self.paths:
@@ -295,7 +561,15 @@ class ImportSession(object):
                 stages += [group_albums(self)]
 
             if self.config['autotag']:
-                stages += [lookup_candidates(self), user_query(self)]
+                # Look up several tasks' candidates at once if enabled.
+                threads = config['import']['lookup_threads'].get(int)
+                if threads > 1:
+                    stages += [pipeline.OrderedStage(
+                        lookup_candidates(self) for _ in range(threads)
+                    )]
+                else:
+                    stages += [lookup_candidates(self)]
+                stages += [user_query(self)]
             else:
                 stages += [import_asis(self)]
 
@@ -303,23 +577,41 @@ class ImportSession(object):
 
             # Plugin stages.
             for stage_func in plugins.import_stages():
-                stages.append(plugin_stage(self, stage_func))
+                stages.append(pipeline.name_stage(
+                    plugin_stage(self, stage_func),
+                    _plugin_stage_name(stage_func)
+                ))
 
             stages += [manipulate_files(self)]
 
-        pl = pipeline.Pipeline(stages)
+        pl = pipeline.Pipeline(stages, stats=True)
 
         # Run the pipeline.
         plugins.send('import_begin', session=self)
         try:
             if config['threaded']:
-                pl.run_parallel(QUEUE_SIZE)
+                pl.run_parallel(self._queue_sizes(pl), weigh=_task_size)
             else:
                 pl.run_sequential()
         except ImportAbort:
             # User aborted operation. Silently stop.
             pass
 
+        # Report where the time went.
+        self.stats = pl.stats
+        plugins.send('import_stats', session=self, stats=self.stats)
+
+    def _queue_sizes(self, pl):
+        """Get the sizes of the queues between the stages of the
+        pipeline `pl`, in tracks, from the `queue_size` option and the
+        per-stage overrides in `queue_sizes`. Each queue is named after
+        the stage that reads from it.
+        """
+        default = config['import']['queue_size'].get(int)
+        overrides = config['import']['queue_sizes'].get(dict)
+        return [int(overrides.get(st.name, default))
+                for st in pl.stats[1:]]
+
     # Incremental and resumed imports
 
     def already_imported(self, toppath, paths):
@@ -329,18 +621,11 @@ class ImportSession(object):
         if self.is_resuming(toppath) \
            and all(map(lambda p: progress_element(toppath, p), paths)):
             return True
-        if self.config['incremental'] \
-           and tuple(paths) in self.history_dirs:
+        if self.config['incremental'] and history_contains(paths):
             return True
 
         return False
 
-    @property
-    def history_dirs(self):
-        if not hasattr(self, '_history_dirs'):
-            self._history_dirs = history_get()
-        return self._history_dirs
-
     def is_resuming(self, toppath):
         """Return `True` if user wants to resume import of this path.
 
@@ -409,6 +694,9 @@ class ImportTask(object):
         # TODO remove this eventually
         self.should_remove_duplicates = False
         self.is_album = True
+        # The `DirectoryPruner` that records the album's directories
+        # once it is imported, if any.
+        self.pruner = None
 
     def set_choice(self, choice):
         """Given an AlbumMatch or TrackMatch object or an action constant,
@@ -508,6 +796,9 @@ class ImportTask(object):
             self.save_progress()
         if session.config['incremental']:
             self.save_history()
+            if self.pruner:
+                # Later incremental imports can skip the directories.
+                self.pruner.done(self.paths)
 
         self.cleanup(copy=session.config['copy'],
                      delete=session.config['delete'],
@@ -833,7 +1124,7 @@ class SingletonImportTask(ImportTask):
         with lib.transaction():
             self.record_replaced(lib)
             self.remove_replaced(lib)
-            lib.add(self.item)
+            lib.add_many([self.item])
             self.reimport_metadata(lib)
 
     def infer_album_fields(self):
@@ -870,6 +1161,7 @@ class SentinelImportTask(ImportTask):
         self.should_remove_duplicates = False
         self.is_album = True
         self.choice_flag = None
+        self.pruner = None
 
     def save_history(self):
         pass
@@ -991,6 +1283,16 @@ class ImportTaskFactory(object):
         self.skipped = 0  # Skipped due to incremental/resume.
         self.imported = 0  # "Real" tasks created.
         self.is_archive = ArchiveImportTask.is_archive(syspath(toppath))
+        self.pool = None  # Threads reading tags, while generating tasks.
+
+        # Skip unchanged, imported directories in incremental imports.
+        if session.config['incremental'] and \
+                session.config['incremental_skip_unchanged'] and \
+                not session.config['singletons'] and \
+                not session.config['flat']:
+            self.pruner = DirectoryPruner()
+        else:
+            self.pruner = None
 
     def tasks(self):
         """Yield all import tasks for music found in the user-specified
@@ -1005,6 +1307,22 @@ class ImportTaskFactory(object):
         If `self.toppath` is an archive, it is adjusted to point to the
         extracted data.
         """
+        # Read the files' tags in a pool of threads, if enabled.
+        threads = config['import']['read_threads'].get(int)
+        if threads > 1:
+            self.pool = ThreadPool(threads)
+        try:
+            for task in self._tasks():
+                yield task
+        finally:
+            if self.pool:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+    def _tasks(self):
+        """Generate the import tasks, as described in `tasks`.
+        """
         # Check whether this is an archive.
         if self.is_archive:
             archive_task = self.unarchive()
@@ -1014,16 +1332,22 @@ class ImportTaskFactory(object):
         # Search for music in the directory.
         for dirs, paths in self.paths():
             if self.session.config['singletons']:
-                for path in paths:
-                    tasks = self._create(self.singleton(path))
-                    for task in tasks:
+                for singleton in self.singletons(paths):
+                    for task in self._create(singleton):
                         yield task
                 yield self.sentinel(dirs)
 
             else:
+                skipped = self.skipped
                 tasks = self._create(self.album(paths, dirs))
                 for task in tasks:
                     yield task
+                if self.pruner and self.skipped > skipped:
+                    # Already imported, so it can be skipped next time.
+                    self.pruner.done(dirs)
+
+        if self.pruner:
+            self.skipped += self.pruner.pruned
 
         # Produce the final sentinel for this toppath to indicate that
         # it is finished. This is usually just a SentinelImportTask, but
@@ -1064,16 +1388,25 @@ class ImportTaskFactory(object):
                 paths += paths_in_dir
             yield [self.toppath], paths
         else:
-            for dirs, paths in albums_in_dir(self.toppath):
+            for dirs, paths in albums_in_dir(self.toppath, self.pruner):
                 yield dirs, paths
 
-    def singleton(self, path):
-        """Return a `SingletonImportTask` for the music file.
+    def skip_singleton(self, path):
+        """Return whether the music file was imported before and should
+        be skipped. Skipped files are logged and counted in
+        `self.skipped`.
         """
         if self.session.already_imported(self.toppath, [path]):
             log.debug(u'Skipping previously-imported path: {0}',
                       displayable_path(path))
             self.skipped += 1
+            return True
+        return False
+
+    def singleton(self, path):
+        """Return a `SingletonImportTask` for the music file.
+        """
+        if self.skip_singleton(path):
             return None
 
         item = self.read_item(path)
@@ -1082,6 +1415,27 @@ class ImportTaskFactory(object):
         else:
             return None
 
+    def singletons(self, paths):
+        """Generate a `SingletonImportTask` for each of the music files
+        (or None for files that are skipped or cannot be read), reading
+        the files in parallel if enabled.
+        """
+        if not self.pool:
+            for path in paths:
+                yield self.singleton(path)
+            return
+
+        skip = [self.skip_singleton(path) for path in paths]
+        items = iter(self.read_items(
+            [path for path, skipped in zip(paths, skip) if not skipped]
+        ))
+        for skipped in skip:
+            item = None if skipped else items.next()
+            if item:
+                yield SingletonImportTask(self.toppath, item)
+            else:
+                yield None
+
     def album(self, paths, dirs=None):
         """Return a `ImportTask` with all media files from paths.
 
@@ -1100,11 +1454,12 @@ class ImportTaskFactory(object):
             self.skipped += 1
             return None
 
-        items = map(self.read_item, paths)
-        items = [item for item in items if item]
+        items = [item for item in self.read_items(paths) if item]
 
         if items:
-            return ImportTask(self.toppath, dirs, items)
+            task = ImportTask(self.toppath, dirs, items)
+            task.pruner = self.pruner
+            return task
         else:
             return None
 
@@ -1143,6 +1498,15 @@ class ImportTaskFactory(object):
         log.debug(u'Archive extracted to: {0}', self.toppath)
         return archive_task
 
+    def read_items(self, paths):
+        """Return a list of the `Item` objects read from the paths, in
+        the same order, with None in place of files that cannot be read.
+        With a reader pool, the files are read concurrently.
+        """
+        if self.pool and len(paths) > 1:
+            return self.pool.map(self.read_item, paths)
+        return map(self.read_item, paths)
+
     def read_item(self, path):
         """Return an `Item` read from the path.
 
@@ -1331,6 +1695,26 @@ def apply_choices(session, task):
     task.add(session.lib)
 
 
+def _task_size(task):
+    """Get the number of tracks in a task for limiting the size of the
+    import pipeline's queues.
+    """
+    if isinstance(task, ImportTask) and task.items:
+        return len(task.items)
+    return 1
+
+
+def _plugin_stage_name(func):
+    """Get the name of a plugin's import stage function for the
+    pipeline statistics, prefixed with the plugin's name for methods.
+    """
+    name = getattr(func, '__name__', u'plugin')
+    plugin = getattr(func, '__self__', None)
+    if plugin is not None and hasattr(plugin, 'name'):
+        name = u'{0}.{1}'.format(plugin.name, name)
+    return name
+
+
 @pipeline.mutator_stage
 def plugin_stage(session, func, task):
     """A coroutine (pipeline stage) that calls the given function with
@@ -1408,18 +1792,28 @@ def group_albums(session):
 
 MULTIDISC_MARKERS = (r'dis[ck]', r'cd')
 MULTIDISC_PAT_FMT = r'^(.*%s[\W_]*)\d'
+MULTIDISC_PATS = [re.compile(MULTIDISC_PAT_FMT % marker, re.I)
+                  for marker in MULTIDISC_MARKERS]
 
 
-def albums_in_dir(path):
+def albums_in_dir(path, pruner=None):
     """Recursively searches the given directory and returns an iterable
     of (paths, items) where paths is a list of directories and items is
     a list of Items that is probably an album. Specifically, any folder
     containing any media files is an album.
+
+    If a `DirectoryPruner` is given, the directories it prunes are
+    skipped.
     """
     collapse_pat = collapse_paths = collapse_items = None
     ignore = config['ignore'].as_str_seq()
+    threads = config['import']['walk_threads'].get(int)
+    prune = pruner.prune if pruner else None
 
-    for root, dirs, files in sorted_walk(path, ignore=ignore, logger=log):
+    for root, dirs, files in sorted_walk(path, ignore=ignore, logger=log,
+                                         threads=threads, prune=prune):
+        if pruner:
+            pruner.listed(root, dirs)
         items = [os.path.join(root, f) for f in files]
         # If we're currently collapsing the constituent directories in a
         # multi-disc album, check whether we should continue collapsing
@@ -1446,8 +1840,7 @@ def albums_in_dir(path):
         # 1") or it contains no items but only directories that are
         # named in this way.
         start_collapsing = False
-        for marker in MULTIDISC_MARKERS:
-            marker_pat = re.compile(MULTIDISC_PAT_FMT % marker, re.I)
+        for marker_pat in MULTIDISC_PATS:
             match = marker_pat.match(os.path.basename(root))
 
             # Is this directory the root of a nested multi-disc album?
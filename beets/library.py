@@ -23,6 +23,9 @@ import shlex
 import unicodedata
 import time
 import re
+import threading
+import weakref
+from collections import OrderedDict, defaultdict
 from unidecode import unidecode
 import platform
 
@@ -31,6 +34,7 @@ from beets.mediafile import MediaFile, MutagenError, UnreadableFileError
 from beets import plugins
 from beets import util
 from beets.util import bytestring_path, syspath, normpath, samefile
+from beets.util import functemplate
 from beets.util.functemplate import Template
 from beets import dbcore
 from beets.dbcore import types
@@ -206,9 +210,9 @@ class SmartArtistSort(dbcore.query.Sort):
         order = "ASC" if self.ascending else "DESC"
         field = 'albumartist' if self.album else 'artist'
         collate = 'COLLATE NOCASE' if self.case_insensitive else ''
-        return ('(CASE {0}_sort WHEN NULL THEN {0} '
-                'WHEN "" THEN {0} '
-                'ELSE {0}_sort END) {1} {2}').format(field, collate, order)
+        return "COALESCE(NULLIF({0}_sort, ''), {0}) {1} {2}".format(
+            field, collate, order
+        )
 
     def sort(self, objs):
         if self.album:
@@ -285,16 +289,29 @@ class LibModel(dbcore.Model):
         return funcs
 
     def store(self):
+        fields = set(self._dirty)
         super(LibModel, self).store()
-        plugins.send('database_change', lib=self._db, model=self)
+        self._db._changed(self, fields)
 
     def remove(self):
         super(LibModel, self).remove()
-        plugins.send('database_change', lib=self._db, model=self)
+        self._db._changed(self)
 
     def add(self, lib=None):
         super(LibModel, self).add(lib)
-        plugins.send('database_change', lib=self._db, model=self)
+        self._db._changed(self)
+
+    @classmethod
+    def _template_fields(cls, template):
+        """Get the names of the fields needed to format objects of this
+        class with `template` (a string, or None for the default
+        format).
+        """
+        if not template:
+            template = beets.config[cls._format_config_key].get(unicode)
+        if isinstance(template, basestring):
+            template = functemplate.template(template)
+        return template.variables()
 
     def __format__(self, spec):
         if not spec:
@@ -322,22 +339,36 @@ class FormattedItemMapping(dbcore.db.FormattedMapping):
     def __init__(self, item, for_path=False):
         super(FormattedItemMapping, self).__init__(item, for_path)
         self.album = item.get_album()
-        self.album_keys = []
-        if self.album:
-            for key in self.album.keys(True):
-                if key in Album.item_keys or key not in item._fields.keys():
-                    self.album_keys.append(key)
-        self.all_keys = set(self.model_keys).union(self.album_keys)
+
+    def _is_album_key(self, key):
+        """Determine whether `key` is looked up on the album: either an
+        album-level field shared with items or a field only albums
+        have.
+        """
+        return (self.album is not None and
+                (key in Album.item_keys or key not in self.model._fields)
+                and key in self.album)
+
+    @property
+    def album_keys(self):
+        if not self.album:
+            return []
+        return [key for key in self.album.keys(True)
+                if self._is_album_key(key)]
+
+    @property
+    def all_keys(self):
+        return set(self.model_keys).union(self.album_keys)
 
     def _get(self, key):
         """Get the value for a key, either from the album or the item.
         Raise a KeyError for invalid keys.
         """
-        if self.for_path and key in self.album_keys:
+        if self.for_path and self._is_album_key(key):
             return self._get_formatted(self.album, key)
-        elif key in self.model_keys:
+        elif key in self.model:
             return self._get_formatted(self.model, key)
-        elif key in self.album_keys:
+        elif self._is_album_key(key):
             return self._get_formatted(self.album, key)
         else:
             raise KeyError(key)
@@ -460,8 +491,34 @@ class Item(LibModel):
 
     _sorts = {'artist': SmartArtistSort}
 
+    _indices = {
+        'album_id': ('album_id',),
+        'path': ('path',),
+        'mb_trackid': ('mb_trackid',),
+        'artist_title': ('artist', 'title'),
+        # Serves the default `sort_item` order, `artist+ album+ disc+
+        # track+`, matching the clauses built by `SmartArtistSort` and
+        # `FixedFieldSort` for case-insensitive sorting.
+        'default_sort': (
+            "COALESCE(NULLIF(artist_sort, ''), artist) COLLATE NOCASE",
+            'album COLLATE NOCASE',
+            'disc COLLATE NOCASE',
+            'track COLLATE NOCASE',
+        ),
+    }
+
     _format_config_key = 'format_item'
 
+    @classmethod
+    def _template_fields(cls, template):
+        # Formatting an item looks up its album, and the `artist` and
+        # `albumartist` fields fall back to one another.
+        fields = super(Item, cls)._template_fields(template)
+        fields.add('album_id')
+        if fields & set(['artist', 'albumartist']):
+            fields.update(['artist', 'albumartist'])
+        return fields
+
     @classmethod
     def _getters(cls):
         getters = plugins.item_field_getters()
@@ -686,8 +743,6 @@ class Item(LibModel):
             util.remove(self.path)
             util.prune_dirs(os.path.dirname(self.path), self._db.directory)
 
-        self._db._memotable = {}
-
     def move(self, copy=False, link=False, basedir=None, with_album=True):
         """Move the item to its designated location within the library
         directory (provided by destination()). Subdirectories are
@@ -747,27 +802,13 @@ class Item(LibModel):
         basedir = basedir or self._db.directory
         path_formats = path_formats or self._db.path_formats
 
-        # Use a path format based on a query, falling back on the
-        # default.
-        for query, path_format in path_formats:
-            if query == PF_KEY_DEFAULT:
-                continue
-            query, _ = parse_query_string(query, type(self))
+        # Use the first path format whose query matches the item. The
+        # default format comes last and matches everything.
+        for query, subpath_tmpl in self._db.parsed_path_formats(path_formats):
             if query.match(self):
-                # The query matches the item! Use the corresponding path
-                # format.
                 break
         else:
-            # No query matched; fall back to default.
-            for query, path_format in path_formats:
-                if query == PF_KEY_DEFAULT:
-                    break
-            else:
-                assert False, "no default path format"
-        if isinstance(path_format, Template):
-            subpath_tmpl = path_format
-        else:
-            subpath_tmpl = Template(path_format)
+            assert False, "no default path format"
 
         # Evaluate the selected template.
         subpath = self.evaluate_template(subpath_tmpl, True)
@@ -862,6 +903,17 @@ class Album(LibModel):
         'artist': SmartArtistSort,
     }
 
+    _indices = {
+        'albumartist_album': ('albumartist', 'album'),
+        'mb_albumid': ('mb_albumid',),
+        # Serves the default `sort_album` order, `albumartist+ album+`.
+        'default_sort': (
+            "COALESCE(NULLIF(albumartist_sort, ''), albumartist) "
+            "COLLATE NOCASE",
+            'album COLLATE NOCASE',
+        ),
+    }
+
     item_keys = [
         'added',
         'albumartist',
@@ -1024,7 +1076,8 @@ class Album(LibModel):
         image = bytestring_path(image)
         item_dir = item_dir or self.item_dir()
 
-        filename_tmpl = Template(beets.config['art_filename'].get(unicode))
+        filename_tmpl = functemplate.template(
+            beets.config['art_filename'].get(unicode))
         subpath = self.evaluate_template(filename_tmpl, True)
         if beets.config['asciify_paths']:
             subpath = unidecode(subpath)
@@ -1099,17 +1152,73 @@ class Album(LibModel):
 
 # Query construction helpers.
 
+QUERY_CACHE_SIZE = 256
+"""The maximum number of parsed queries kept by `parse_query_parts` and
+`parse_query_string`.
+"""
+
+_query_cache = {}
+
+
+def _query_prefixes():
+    """Get the query types and their prefix characters.
+    """
+    prefixes = {':': dbcore.query.RegexpQuery}
+    prefixes.update(plugins.queries())
+    return prefixes
+
+
+def _cached_query(key, model_cls, prefixes, parse):
+    """Get the `(query, sort)` pair for a query identified by `key`,
+    calling `parse` to build it the first time it is requested.
+
+    Besides the key, the parsed query depends on the prefixes, the
+    model's field types and computed fields, and the configuration, so
+    these are part of the cache key too. Cached queries are shared, so
+    callers must not modify them.
+
+    Queries containing path separators are never cached: whether they
+    are path queries depends on the file system and the working
+    directory. Neither are queries without a model class.
+    """
+    kind, parts = key
+    if kind == 'string':
+        parts = (parts,)
+    if model_cls is None or any(os.sep in part for part in parts):
+        return parse()
+
+    key = (key, model_cls,
+           frozenset(prefixes.items()),
+           frozenset(model_cls._types.items()),
+           frozenset(model_cls._getters()),
+           beets.config['sort_case_insensitive'].get(bool),
+           dbcore.db.fts_enabled())
+    try:
+        return _query_cache[key]
+    except KeyError:
+        if len(_query_cache) >= QUERY_CACHE_SIZE:
+            _query_cache.clear()
+        parsed = _query_cache[key] = parse()
+        return parsed
+
+
 def parse_query_parts(parts, model_cls):
     """Given a beets query string as a list of components, return the
     `Query` and `Sort` they represent.
 
     Like `dbcore.parse_sorted_query`, with beets query prefixes and
-    special path query detection.
+    special path query detection. Results are memoized.
     """
-    # Get query types and their prefix characters.
-    prefixes = {':': dbcore.query.RegexpQuery}
-    prefixes.update(plugins.queries())
+    prefixes = _query_prefixes()
+    return _cached_query(
+        ('parts', tuple(parts)), model_cls, prefixes,
+        lambda: _parse_query_parts(parts, model_cls, prefixes)
+    )
+
 
+def _parse_query_parts(parts, model_cls, prefixes):
+    """Parse a list of query components without memoization.
+    """
     # Special-case path-like queries, which are non-field queries
     # containing path separators (/).
     path_parts = []
@@ -1138,27 +1247,57 @@ def parse_query_string(s, model_cls):
     represent.
 
     The string is split into components using shell-like syntax.
+    Results are memoized.
     """
     assert isinstance(s, unicode), "Query is not unicode: {0!r}".format(s)
+    prefixes = _query_prefixes()
+    return _cached_query(
+        ('string', s), model_cls, prefixes,
+        lambda: _parse_query_parts(_split_query_string(s), model_cls,
+                                   prefixes)
+    )
+
 
+def _split_query_string(s):
+    """Split a query string into components using shell-like syntax.
+    """
     # A bug in Python < 2.7.3 prevents correct shlex splitting of
     # Unicode strings.
     # http://bugs.python.org/issue6988
     s = s.encode('utf8')
     try:
-        parts = [p.decode('utf8') for p in shlex.split(s)]
+        return [p.decode('utf8') for p in shlex.split(s)]
     except ValueError as exc:
         raise dbcore.InvalidQueryError(s, exc)
-    return parse_query_parts(parts, model_cls)
 
 
 # The Library: interface to the database.
 
+class _ObjectCache(object):
+    """The objects a thread fetched recently from a library.
+    """
+    def __init__(self):
+        # Objects keyed by model class and id, in least-recently-used
+        # order.
+        self.objects = OrderedDict()
+        # The database's data version when the cache was last checked.
+        self.version = None
+        # The transaction during which the cache was last checked.
+        self.transaction = None
+        # Whether the thread has run a query, which checks the cache.
+        self.fetched = False
+
+
 class Library(dbcore.Database):
     """A database of music containing songs and albums.
     """
     _models = (Item, Album)
 
+    object_cache_size = 1024
+    """The maximum number of objects kept by `get_item` and `get_album`
+    for reuse in each thread.
+    """
+
     def __init__(self, path='library.blb',
                  directory='~/Music',
                  path_formats=((PF_KEY_DEFAULT,
@@ -1172,7 +1311,57 @@ class Library(dbcore.Database):
         self.path_formats = path_formats
         self.replacements = replacements
 
-        self._memotable = {}  # Used for template substitution performance.
+        # Memoized template function values (used by `%aunique`). The
+        # table is cleared whenever an album is added, changed or
+        # removed.
+        self._memotable = {}
+
+        # The path formats last used by `parsed_path_formats` and their
+        # parsed form.
+        self._parsed_path_formats = ((), [])
+
+        # Recently fetched objects for each thread. Each thread's
+        # `_ObjectCache` lives in thread-local storage, so it goes away
+        # with its thread; the weak set lets changes reach the caches of
+        # all live threads. The generation counts invalidations so that
+        # objects fetched before one are not cached after it.
+        self._object_cache_local = threading.local()
+        self._object_caches = weakref.WeakSet()
+        self._object_cache_generation = 0
+        self._object_cache_lock = threading.Lock()
+
+    # Path formats.
+
+    def parsed_path_formats(self, path_formats=None):
+        """Get the path formats (by default, the library's own) as a
+        list of `(Query, Template)` pairs. The default format comes last
+        with a query that matches everything.
+
+        The result is reused as long as the same path formats are
+        requested, so queries and templates are parsed only once.
+        """
+        path_formats = tuple(path_formats or self.path_formats)
+        last_formats, parsed = self._parsed_path_formats
+        if len(last_formats) == len(path_formats) and \
+                all(a is b for a, b in zip(last_formats, path_formats)):
+            return parsed
+
+        parsed = []
+        default = None
+        for query, path_format in path_formats:
+            if not isinstance(path_format, Template):
+                path_format = functemplate.template(path_format)
+            if query == PF_KEY_DEFAULT:
+                if default is None:
+                    default = path_format
+            else:
+                query, _ = parse_query_string(query, Item)
+                parsed.append((query, path_format))
+        if default is not None:
+            parsed.append((dbcore.query.TrueQuery(), default))
+
+        self._parsed_path_formats = (path_formats, parsed)
+        return parsed
 
     # Adding objects to the database.
 
@@ -1181,9 +1370,18 @@ class Library(dbcore.Database):
         database. Return the object's new id.
         """
         obj.add(self)
-        self._memotable = {}
         return obj.id
 
+    def add_many(self, objs):
+        """Add a sequence of new :class:`Item` and :class:`Album` objects
+        to the library database using batched statements. Return a list
+        of the objects' new ids.
+        """
+        self.bulk_insert(objs)
+        for obj in objs:
+            self._changed(obj)
+        return [obj.id for obj in objs]
+
     def add_album(self, items):
         """Create a new album consisting of a list of items.
 
@@ -1202,30 +1400,42 @@ class Library(dbcore.Database):
         # Store or add the items.
         with self.transaction():
             album.add(self)
+            new_items = []
             for item in items:
                 item.album_id = album.id
                 if item.id is None:
-                    item.add(self)
+                    new_items.append(item)
                 else:
                     item.store()
+            if new_items:
+                self.add_many(new_items)
 
         return album
 
     # Querying.
 
-    def _fetch(self, model_cls, query, sort=None):
-        """Parse a query and fetch. If a order specification is present
-        in the query string the `sort` argument is ignored.
+    def _parse_query(self, model_cls, query):
+        """Parse a query given as a string or a list of strings into a
+        `(query, sort)` pair. Other queries are returned unchanged along
+        with a None sort.
         """
-        # Parse the query, if necessary.
         try:
-            parsed_sort = None
             if isinstance(query, basestring):
-                query, parsed_sort = parse_query_string(query, model_cls)
+                return parse_query_string(query, model_cls)
             elif isinstance(query, (list, tuple)):
-                query, parsed_sort = parse_query_parts(query, model_cls)
+                return parse_query_parts(query, model_cls)
         except dbcore.query.InvalidQueryArgumentTypeError as exc:
             raise dbcore.InvalidQueryError(query, exc)
+        return query, None
+
+    def _fetch(self, model_cls, query, sort=None, limit=None, offset=0,
+               fields=None):
+        """Parse a query and fetch. If a order specification is present
+        in the query string the `sort` argument is ignored. `limit` and
+        `offset` select a window of the results and `fields` limits the
+        fields that are read up front.
+        """
+        query, parsed_sort = self._parse_query(model_cls, query)
 
         # Any non-null sort specified by the parsed query overrides the
         # provided sort.
@@ -1233,7 +1443,7 @@ class Library(dbcore.Database):
             sort = parsed_sort
 
         return super(Library, self)._fetch(
-            model_cls, query, sort
+            model_cls, query, sort, limit, offset, fields
         )
 
     @staticmethod
@@ -1250,23 +1460,210 @@ class Library(dbcore.Database):
         return dbcore.sort_from_strings(
             Item, beets.config['sort_item'].as_str_seq())
 
-    def albums(self, query=None, sort=None):
-        """Get :class:`Album` objects matching the query.
+    def albums(self, query=None, sort=None, limit=None, offset=0,
+               fields=None):
+        """Get :class:`Album` objects matching the query. If `limit` is
+        given, at most that many albums are returned, skipping the first
+        `offset`. If `fields` is given, only those fields are read up
+        front (others are loaded when they are accessed).
+        """
+        self._object_cache(fetch=True)
+        return self._fetch(Album, query,
+                           sort or self.get_default_album_sort(),
+                           limit, offset, fields)
+
+    def items(self, query=None, sort=None, limit=None, offset=0,
+              fields=None):
+        """Get :class:`Item` objects matching the query. If `limit` is
+        given, at most that many items are returned, skipping the first
+        `offset`. If `fields` is given, only those fields are read up
+        front (others are loaded when they are accessed).
+        """
+        self._object_cache(fetch=True)
+        return self._fetch(Item, query,
+                           sort or self.get_default_item_sort(),
+                           limit, offset, fields)
+
+    def _query_plan(self, model_cls, query=None, sort=None):
+        """Parse a query and describe how the database evaluates it,
+        including the default sort for the model.
         """
-        return self._fetch(Album, query, sort or self.get_default_album_sort())
+        query, parsed_sort = self._parse_query(model_cls, query)
+        if parsed_sort and not isinstance(parsed_sort, dbcore.query.NullSort):
+            sort = parsed_sort
+        if sort is None:
+            if model_cls is Album:
+                sort = self.get_default_album_sort()
+            else:
+                sort = self.get_default_item_sort()
+        return super(Library, self)._query_plan(model_cls, query, sort)
 
-    def items(self, query=None, sort=None):
-        """Get :class:`Item` objects matching the query.
+    def _aggregate(self, model_cls, aggregates, query=None):
+        """Parse a query and compute aggregates over the matching
+        objects.
         """
-        return self._fetch(Item, query, sort or self.get_default_item_sort())
+        query, _ = self._parse_query(model_cls, query)
+        return super(Library, self)._aggregate(model_cls, aggregates, query)
+
+    def aggregate_albums(self, aggregates, query=None):
+        """Compute a list of :class:`beets.dbcore.query.Aggregate`
+        functions (counts, sums, etc.) over the :class:`Album` objects
+        matching the query. Return a list of results.
+        """
+        return self._aggregate(Album, aggregates, query)
+
+    def aggregate_items(self, aggregates, query=None):
+        """Compute a list of :class:`beets.dbcore.query.Aggregate`
+        functions (counts, sums, etc.) over the :class:`Item` objects
+        matching the query. Return a list of results.
+        """
+        return self._aggregate(Item, aggregates, query)
+
+    def _album_disambiguators(self, keys, disam):
+        """Find the albums that have the same values for all the fields
+        in `keys` as some other album. Return a dictionary mapping the
+        ids of these albums to the first field in `disam` that has a
+        different value for each album in their group, or None if there
+        is no such field. All the fields must be fixed album fields.
+
+        The groups are found with a single query, so this is much faster
+        than looking for the albums that match each album in turn.
+        """
+        sql = (
+            'SELECT a.id, {cols} FROM {table} a JOIN '
+            '(SELECT {keys} FROM {table} GROUP BY {keys} '
+            'HAVING COUNT(*) > 1) g ON {join}'
+        ).format(
+            table=Album._table,
+            cols=', '.join('a.' + field for field in keys + disam),
+            keys=', '.join(keys),
+            join=' AND '.join('a.{0} IS g.{0}'.format(key) for key in keys),
+        )
+        with self.transaction(False) as tx:
+            rows = [tuple(row) for row in tx.query(sql)]
+
+        # Group the albums by their key values.
+        groups = defaultdict(list)
+        for row in rows:
+            groups[row[1:len(keys) + 1]].append(row)
+
+        disambiguators = {}
+        for group in groups.values():
+            for i, field in enumerate(disam, len(keys) + 1):
+                from_sql = Album._type(field).from_sql
+                values = set(from_sql(row[i]) for row in group)
+                if len(values) == len(group):
+                    disambiguator = field
+                    break
+            else:
+                disambiguator = None
+            for row in group:
+                disambiguators[row[0]] = disambiguator
+        return disambiguators
 
     # Convenience accessors.
 
+    def _changed(self, obj, fields=None):
+        """Note that the object `obj` has changed in the database: drop
+        it from the object cache and send the `database_change` event.
+        `fields` is the set of fields that were stored, or None if the
+        object was added or removed.
+        """
+        with self._object_cache_lock:
+            for cache in self._object_caches:
+                cache.objects.pop((type(obj), obj.id), None)
+            self._object_cache_generation += 1
+        if isinstance(obj, Album):
+            self._forget_memoized(fields)
+        plugins.send('database_change', lib=self, model=obj)
+
+    def _data_version(self):
+        """Get SQLite's data version for this thread's connection. It
+        changes whenever another connection (in this process or another
+        one) commits a change to the database.
+        """
+        with self.transaction(False) as tx:
+            rows = tx.query('PRAGMA data_version')
+        return rows[0][0] if rows else None
+
+    def _object_cache(self, fetch=False):
+        """Get the object cache for the current thread. The cache is
+        emptied if another connection has changed the database since it
+        was last checked.
+
+        The check runs for each query (`fetch`) and once per
+        transaction. Lookups outside a transaction rely on the check
+        made by the thread's last query, if it has made one.
+        """
+        cache = getattr(self._object_cache_local, 'cache', None)
+        if cache is None:
+            cache = self._object_cache_local.cache = _ObjectCache()
+            with self._object_cache_lock:
+                self._object_caches.add(cache)
+
+        with self._tx_stack() as stack:
+            root = stack[0] if stack else None
+        if root is None:
+            stale = fetch or not cache.fetched
+        else:
+            stale = fetch or root is not cache.transaction
+        if stale:
+            version = self._data_version()
+            with self._object_cache_lock:
+                if version is None or version != cache.version:
+                    cache.objects.clear()
+                cache.version = version
+            cache.transaction = root
+            cache.fetched = cache.fetched or fetch
+        return cache
+
+    def _forget_memoized(self, fields=None):
+        """Drop the memoized template values that may depend on the
+        given album fields, or all of them if `fields` is None (when an
+        album is added or removed). `%aunique` values only depend on
+        their key and disambiguator fields.
+        """
+        if fields is None:
+            self._memotable = {}
+            return
+        for memokey in list(self._memotable):
+            if memokey[0] == 'aunique':
+                used = memokey[1].split() + memokey[2].split()
+                if fields.isdisjoint(used):
+                    continue
+            del self._memotable[memokey]
+
+    def _get_cached(self, model_cls, id):
+        """Get a Model object by its id, like `_get`, but reuse an object
+        fetched recently in the same thread if it is unchanged. Objects
+        are cached until they are stored or removed, or until another
+        connection changes the database. Objects that have unsaved
+        changes are not reused.
+        """
+        key = (model_cls, id)
+        cache = self._object_cache().objects
+        with self._object_cache_lock:
+            obj = cache.pop(key, None)
+            if obj is not None and not obj._dirty:
+                cache[key] = obj  # Most recently used.
+                return obj
+            generation = self._object_cache_generation
+
+        obj = self._get(model_cls, id)
+        if obj is not None:
+            with self._object_cache_lock:
+                if generation == self._object_cache_generation:
+                    cache[key] = obj
+                    while len(cache) > self.object_cache_size:
+                        cache.popitem(last=False)
+        return obj
+
     def get_item(self, id):
         """Fetch an :class:`Item` by its ID. Returns `None` if no match is
-        found.
+        found. The same object may be returned by several calls in one
+        thread until it is stored or removed.
         """
-        return self._get(Item, id)
+        return self._get_cached(Item, id)
 
     def get_album(self, item_or_id):
         """Given an album ID or an item associated with an album, return
@@ -1279,7 +1676,7 @@ class Library(dbcore.Database):
             album_id = item_or_id.album_id
         if album_id is None:
             return None
-        return self._get(Album, album_id)
+        return self._get_cached(Album, album_id)
 
 
 # Default path template resources.
@@ -1386,13 +1783,28 @@ class DefaultTemplateFunctions(object):
             return u''
         if self.item.album_id is None:
             return u''
+
+        keys = keys or 'albumartist album'
+        disam = disam or 'albumtype year label catalognum albumdisambig'
+
+        # When all the fields are stored in the albums table, the
+        # disambiguation for every album is computed at once.
+        fields = keys.split() + disam.split()
+        if all(field in Album._fields for field in fields):
+            memokey = ('aunique', keys, disam)
+            disambiguators = self.lib._memotable.get(memokey)
+            if disambiguators is None:
+                disambiguators = self.lib._album_disambiguators(
+                    keys.split(), disam.split()
+                )
+                self.lib._memotable[memokey] = disambiguators
+            return self._aunique_string(disambiguators)
+
         memokey = ('aunique', keys, disam, self.item.album_id)
         memoval = self.lib._memotable.get(memokey)
         if memoval is not None:
             return memoval
 
-        keys = keys or 'albumartist album'
-        disam = disam or 'albumtype year label catalognum albumdisambig'
         keys = keys.split()
         disam = disam.split()
 
@@ -1415,28 +1827,47 @@ class DefaultTemplateFunctions(object):
             self.lib._memotable[memokey] = u''
             return u''
 
-        # Find the first disambiguator that distinguishes the albums.
-        for disambiguator in disam:
-            # Get the value for each album for the current field.
-            disam_values = set([getattr(a, disambiguator) for a in albums])
+        disambiguator = _find_disambiguator(albums, disam)
+        res = self._aunique_string({album.id: disambiguator})
+        self.lib._memotable[memokey] = res
+        return res
 
-            # If the set of unique values is equal to the number of
-            # albums in the disambiguation set, we're done -- this is
-            # sufficient disambiguation.
-            if len(disam_values) == len(albums):
-                break
+    def _aunique_string(self, disambiguators):
+        """Format the `%aunique` value for the current item's album given
+        a mapping from the ids of ambiguous albums to the field that
+        disambiguates them (or None when no field does).
+        """
+        album_id = self.item.album_id
+        if album_id not in disambiguators:
+            return u''
 
-        else:
+        disambiguator = disambiguators[album_id]
+        if disambiguator is None:
             # No disambiguator distinguished all fields.
-            res = u' {0}'.format(album.id)
-            self.lib._memotable[memokey] = res
-            return res
+            return u' {0}'.format(album_id)
+
+        album = self.lib.get_album(self.item)
+        if not album:
+            return u''
 
         # Flatten disambiguation value into a string.
         disam_value = album.formatted(True).get(disambiguator)
-        res = u' [{0}]'.format(disam_value)
-        self.lib._memotable[memokey] = res
-        return res
+        return u' [{0}]'.format(disam_value)
+
+
+def _find_disambiguator(albums, disam):
+    """Find the first field in `disam` that has a different value for
+    each of the albums, or None if there is no such field.
+    """
+    for disambiguator in disam:
+        # Get the value for each album for the current field.
+        disam_values = set([getattr(a, disambiguator) for a in albums])
+
+        # If the set of unique values is equal to the number of
+        # albums in the disambiguation set, we're done -- this is
+        # sufficient disambiguation.
+        if len(disam_values) == len(albums):
+            return disambiguator
 
 
 # Get the name of tmpl_* functions in the above class.
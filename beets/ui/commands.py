@@ -34,6 +34,7 @@ from beets import util
 from beets.util import syspath, normpath, ancestry, displayable_path
 from beets import library
 from beets import config
+from beets.dbcore import query as db_query
 from beets import logging
 from beets.util.confit import _package_path
 
@@ -869,10 +870,34 @@ def import_files(lib, paths, query):
     session = TerminalImportSession(lib, loghandler, paths, query)
     session.run()
 
+    if config['import']['stats']:
+        print_import_stats(session.stats)
+
     # Emit event.
     plugins.send('import', lib=lib, paths=paths)
 
 
+def print_import_stats(stats):
+    """Print a table of the per-stage statistics of an import pipeline
+    (a list of `pipeline.StageStats` objects).
+    """
+    row = u'{0:<24} {1:>7} {2:>7} {3:>9} {4:>9} {5:>9} {6:>6}'
+    ui.print_(row.format(u'stage', u'in', u'out', u'busy', u'idle',
+                         u'blocked', u'queue'))
+    for st in stats:
+        if st.queue_high_water is None:
+            queue = u'-'
+        else:
+            queue = st.queue_high_water
+        ui.print_(row.format(
+            st.name, st.msgs_in, st.msgs_out,
+            u'{0:.2f}s'.format(st.busy),
+            u'{0:.2f}s'.format(st.idle),
+            u'{0:.2f}s'.format(st.blocked),
+            queue,
+        ))
+
+
 def import_func(lib, opts, args):
     config['import'].set_args(opts)
 
@@ -968,6 +993,10 @@ import_cmd.parser.add_option(
     '--pretend', dest='pretend', action='store_true',
     help='just print the files to import'
 )
+import_cmd.parser.add_option(
+    '--stats', dest='stats', action='store_true',
+    help='print how long each import step took'
+)
 import_cmd.func = import_func
 default_commands.append(import_cmd)
 
@@ -979,10 +1008,12 @@ def list_items(lib, query, album, fmt=''):
     albums instead of single items.
     """
     if album:
-        for album in lib.albums(query):
+        fields = library.Album._template_fields(fmt)
+        for album in lib.albums(query, fields=fields).stream():
             ui.print_(format(album, fmt))
     else:
-        for item in lib.items(query):
+        fields = library.Item._template_fields(fmt)
+        for item in lib.items(query, fields=fields).stream():
             ui.print_(format(item, fmt))
 
 
@@ -1159,26 +1190,23 @@ default_commands.append(remove_cmd)
 
 def show_stats(lib, query, exact):
     """Shows some statistics about the matched items."""
-    items = lib.items(query)
-
-    total_size = 0
-    total_time = 0.0
-    total_items = 0
-    artists = set()
-    albums = set()
-    album_artists = set()
+    (total_items, total_time, approx_size, artists, albums,
+     album_artists) = lib.aggregate_items([
+         db_query.Count(),
+         db_query.Sum('length'),
+         db_query.Sum('length', 'bitrate'),
+         db_query.CountDistinct('artist'),
+         db_query.CountDistinct('album_id'),
+         db_query.CountDistinct('albumartist'),
+     ], query)
+    total_time = total_time or 0.0
 
-    for item in items:
-        if exact:
+    if exact:
+        total_size = 0
+        for item in lib.items(query).stream():
             total_size += os.path.getsize(item.path)
-        else:
-            total_size += int(item.length * item.bitrate / 8)
-        total_time += item.length
-        total_items += 1
-        artists.add(item.artist)
-        album_artists.add(item.albumartist)
-        if item.album_id:
-            albums.add(item.album_id)
+    else:
+        total_size = int((approx_size or 0) / 8)
 
     size_str = '' + ui.human_bytes(total_size)
     if exact:
@@ -1195,9 +1223,9 @@ Album artists: {7}""".format(
         ' ({0:.2f} seconds)'.format(total_time) if exact else '',
         'Total size' if exact else 'Approximate total size',
         size_str,
-        len(artists),
-        len(albums),
-        len(album_artists)),
+        artists,
+        albums,
+        album_artists),
     )
 
 
@@ -1216,6 +1244,34 @@ stats_cmd.func = stats_func
 default_commands.append(stats_cmd)
 
 
+# index: Show database indices and the query plan for a query.
+
+def show_indices(lib, query, album):
+    """Print the database indices for items (or albums). If a query is
+    given, print how the database evaluates it instead, which includes
+    the indices it uses.
+    """
+    model_cls = library.Album if album else library.Item
+    if query:
+        for line in lib._query_plan(model_cls, query):
+            print_(line)
+    else:
+        for name, columns in sorted(lib._index_spec(model_cls).items()):
+            print_(u'{0}: {1}'.format(name, u', '.join(columns)))
+
+
+def index_func(lib, opts, args):
+    show_indices(lib, decargs(args), opts.album)
+
+
+index_cmd = ui.Subcommand(
+    'index', help='show database indices and how a query uses them'
+)
+index_cmd.parser.add_album_option()
+index_cmd.func = index_func
+default_commands.append(index_cmd)
+
+
 # version: Show current beets version.
 
 def show_version(lib, opts, args):
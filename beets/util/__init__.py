@@ -23,6 +23,7 @@ import re
 import shutil
 import fnmatch
 from collections import Counter
+from multiprocessing.pool import ThreadPool
 import traceback
 import subprocess
 import platform
@@ -152,18 +153,37 @@ def ancestry(path):
     return out
 
 
-def sorted_walk(path, ignore=(), logger=None):
-    """Like `os.walk`, but yields things in case-insensitive sorted,
-    breadth-first order.  Directory and file names matching any glob
-    pattern in `ignore` are skipped. If `logger` is provided, then
-    warning messages are logged there when a directory cannot be listed.
+def _scandir_fallback(path):
+    """Yield `(name, is_dir)` pairs for the entries in a directory using
+    `os.listdir` and a `stat` call per entry.
     """
-    # Make sure the path isn't a Unicode string.
-    path = bytestring_path(path)
+    for name in os.listdir(path):
+        yield name, os.path.isdir(os.path.join(path, name))
+
+
+try:
+    from scandir import scandir as _scandir_impl
+except ImportError:
+    _scandir_impl = getattr(os, 'scandir', None)
 
-    # Get all the directories and files at this level.
+
+def _scandir(path):
+    """Yield `(name, is_dir)` pairs for the entries in a directory. When
+    `scandir` is available, the directory entry types it returns avoid
+    a `stat` call per entry on most file systems.
+    """
+    if _scandir_impl is None:
+        return _scandir_fallback(path)
+    return ((entry.name, entry.is_dir()) for entry in _scandir_impl(path))
+
+
+def _sorted_listdir(path, ignore=(), logger=None):
+    """List a directory for `sorted_walk`. Return a pair of the sorted
+    subdirectory and file names that do not match any of the glob
+    patterns in `ignore`, or None if the directory cannot be listed.
+    """
     try:
-        contents = os.listdir(syspath(path))
+        contents = list(_scandir(syspath(path)))
     except OSError as exc:
         if logger:
             logger.warn(u'could not list directory {0}: {1}'.format(
@@ -172,7 +192,7 @@ def sorted_walk(path, ignore=(), logger=None):
         return
     dirs = []
     files = []
-    for base in contents:
+    for base, is_dir in contents:
         base = bytestring_path(base)
 
         # Skip ignored filenames.
@@ -185,23 +205,85 @@ def sorted_walk(path, ignore=(), logger=None):
             continue
 
         # Add to output as either a file or a directory.
-        cur = os.path.join(path, base)
-        if os.path.isdir(syspath(cur)):
+        if is_dir:
             dirs.append(base)
         else:
             files.append(base)
 
-    # Sort lists (case-insensitive) and yield the current level.
+    # Sort lists (case-insensitive).
     dirs.sort(key=bytes.lower)
     files.sort(key=bytes.lower)
-    yield (path, dirs, files)
-
-    # Recurse into directories.
-    for base in dirs:
-        cur = os.path.join(path, base)
-        # yield from sorted_walk(...)
-        for res in sorted_walk(cur, ignore, logger):
-            yield res
+    return dirs, files
+
+
+def sorted_walk(path, ignore=(), logger=None, threads=1, prune=None):
+    """Like `os.walk`, but yields things in case-insensitive sorted,
+    depth-first order.  Directory and file names matching any glob
+    pattern in `ignore` are skipped. If `logger` is provided, then
+    warning messages are logged there when a directory cannot be listed.
+
+    If `threads` is greater than one, the subdirectories of each
+    directory are listed in parallel by a pool of that many threads
+    while the caller processes the directory. The order of the results
+    does not change. As with `os.walk`, removing names from the yielded
+    directory list skips those subdirectories.
+
+    If `prune` is given, it is called with the path of each directory
+    before the directory is listed. When it returns a list of
+    subdirectory names instead of None, the directory is neither
+    listed nor yielded, and the walk continues with those
+    subdirectories.
+    """
+    # Make sure the path isn't a Unicode string.
+    path = bytestring_path(path)
+
+    def listdir(cur):
+        if prune:
+            subdirs = prune(cur)
+            if subdirs is not None:
+                return subdirs, None
+        return _sorted_listdir(cur, ignore, logger)
+
+    if threads > 1:
+        pool = ThreadPool(threads)
+
+        def schedule(cur):
+            return pool.apply_async(listdir, (cur,)).get
+    else:
+        pool = None
+
+        def schedule(cur):
+            return lambda: listdir(cur)
+
+    # A stack of directories still to be visited and functions getting
+    # their listings.
+    stack = [(path, schedule(path))]
+    try:
+        while stack:
+            cur, listing = stack.pop()
+            listing = listing()
+            if listing is None:
+                continue
+            dirs, files = listing
+
+            # Start listing the subdirectories before yielding (when
+            # listing in parallel).
+            pending = {}
+            if pool:
+                for base in dirs:
+                    pending[base] = schedule(os.path.join(cur, base))
+
+            # Pruned directories have no listing to yield.
+            if files is not None:
+                yield (cur, dirs, files)
+
+            # Recurse into directories.
+            for base in reversed(dirs):
+                sub = os.path.join(cur, base)
+                stack.append((sub, pending.get(base) or schedule(sub)))
+    finally:
+        if pool:
+            pool.terminate()
 
 
 def mkdirall(path):
@@ -511,6 +511,12 @@ class Template(object):
     def __eq__(self, other):
         return self.original == other.original
 
+    def variables(self):
+        """Get the set of variable names referenced by the template,
+        including those in function arguments.
+        """
+        return set(name.decode('utf8') for name in self.expr.translate()[1])
+
     def interpret(self, values={}, functions={}):
         """Like `substitute`, but forces the interpreter (rather than
         the compiled version) to be used. The interpreter includes
@@ -555,6 +561,27 @@ class Template(object):
         return wrapper_func
 
 
+TEMPLATE_CACHE_SIZE = 256
+"""The maximum number of templates kept by `template`.
+"""
+
+_template_cache = {}
+
+
+def template(fmt):
+    """Get a `Template` for the string `fmt`. Templates are parsed and
+    compiled only the first time a string is requested; later calls
+    return the same object.
+    """
+    try:
+        return _template_cache[fmt]
+    except KeyError:
+        if len(_template_cache) >= TEMPLATE_CACHE_SIZE:
+            _template_cache.clear()
+        tmpl = _template_cache[fmt] = Template(fmt)
+        return tmpl
+
+
 # Performance tests.
 
 if __name__ == b'__main__':
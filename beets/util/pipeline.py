@@ -28,21 +28,41 @@ When running a parallel pipeline, it is also possible to use
 multiple coroutines for the same pipeline stage; this lets you speed
 up a bottleneck stage by dividing its work among multiple threads.
 To do so, pass an iterable of coroutines to the Pipeline constructor
-in place of any single coroutine.
+in place of any single coroutine. The messages leaving such a stage
+may be reordered; wrap the coroutines in an `OrderedStage` to keep
+them in the order in which they arrived.
+
+Threads cannot spread CPU-bound work over several cores. Stages made
+from functions decorated with `process_stage` instead run in a pool of
+worker processes when the pipeline is run in parallel; their messages
+are pickled on the way to and from the workers and keep their order.
+
+Pass `stats=True` to the Pipeline constructor to record how many
+messages each stage handles and where its time goes; see `StageStats`.
 """
 
 from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
 import Queue
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
+from collections import deque
+import cPickle as pickle
+import functools
+import multiprocessing
 import sys
+import time
+import weakref
 
 BUBBLE = b'__PIPELINE_BUBBLE__'
 POISON = b'__PIPELINE_POISON__'
 
 DEFAULT_QUEUE_SIZE = 16
 
+# How long (in seconds) a process stage waits for a new message before
+# checking whether its workers have finished earlier ones.
+PROCESS_POLL_INTERVAL = 0.05
+
 
 def _invalidate_queue(q, val=None, sync=True):
     """Breaks a Queue such that it never blocks, always has size 1,
@@ -79,11 +99,38 @@ class CountedQueue(Queue.Queue):
     """A queue that keeps track of the number of threads that are
     still feeding into it. The queue is poisoned when all threads are
     finished with the queue.
+
+    If `weigh` is given, it is called with each message to get its
+    size (at least 1), and `maxsize` limits the total size of the
+    queued messages instead of their number: a message is accepted as
+    long as the queue holds less than `maxsize`. The queue remembers
+    the largest total size it has held in `high_water`.
     """
-    def __init__(self, maxsize=0):
+    def __init__(self, maxsize=0, weigh=None):
         Queue.Queue.__init__(self, maxsize)
         self.nthreads = 0
         self.poisoned = False
+        self.weigh = weigh
+        self.weights = deque()
+        self.weight = 0
+        self.high_water = 0
+
+    def _qsize(self):
+        if self.maxsize > 0:
+            return min(self.weight, self.maxsize)
+        return self.weight
+
+    def _put(self, item):
+        Queue.Queue._put(self, item)
+        weight = max(1, self.weigh(item)) if self.weigh else 1
+        self.weights.append(weight)
+        self.weight += weight
+        if self.weight > self.high_water:
+            self.high_water = self.weight
+
+    def _get(self):
+        self.weight -= self.weights.popleft()
+        return Queue.Queue._get(self)
 
     def acquire(self):
         """Indicate that a thread will start putting into this queue.
@@ -132,6 +179,40 @@ class MultiMessage(object):
         self.messages = messages
 
 
+# The names of the coroutines made by stage decorators, which would
+# otherwise all be named after the decorators' inner functions.
+_stage_names = weakref.WeakKeyDictionary()
+
+
+def name_stage(coro, name):
+    """Set the name used for the statistics of a stage coroutine and
+    return the coroutine.
+    """
+    _stage_names[coro] = name
+    return coro
+
+
+def _stage_name(coro):
+    """Get the name of a stage coroutine for its statistics.
+    """
+    if isinstance(coro, ProcessStage):
+        return coro.func.__name__
+    try:
+        return _stage_names[coro]
+    except (KeyError, TypeError):
+        return getattr(coro, '__name__', type(coro).__name__)
+
+
+def _named(func, coro):
+    """Wrap the coroutine function `coro` made by a stage decorator so
+    that its coroutines are named after the decorated `func`.
+    """
+    @functools.wraps(func)
+    def make(*args):
+        return name_stage(coro(*args), func.__name__)
+    return make
+
+
 def multiple(messages):
     """Yield multiple([message, ..]) from a pipeline stage to send
     multiple values to the next pipeline stage.
@@ -158,7 +239,7 @@ def stage(func):
         while True:
             task = yield task
             task = func(*(args + (task,)))
-    return coro
+    return _named(func, coro)
 
 
 def mutator_stage(func):
@@ -181,9 +262,122 @@ def mutator_stage(func):
         while True:
             task = yield task
             func(*(args + (task,)))
+    return _named(func, coro)
+
+
+def process_stage(func):
+    """Decorate a function to become a stage that runs in worker
+    processes, like `stage`, when the pipeline is run in parallel.
+
+    The function must be defined at the top level of its module so the
+    workers can find it, and its arguments, the messages it receives
+    and the values it returns must be picklable. It cannot change the
+    messages it receives in place: only its return value is sent to the
+    next stage. When the pipeline is run sequentially, the function is
+    simply called in the current thread.
+
+    >>> @process_stage
+    ... def square(n):
+    ...     return n * n
+    >>> pipe = Pipeline([
+    ...     iter([1, 2, 3]),
+    ...     square(),
+    ... ])
+    >>> list(pipe.pull())
+    [1, 4, 9]
+    """
+    @functools.wraps(func)
+    def coro(*args):
+        return ProcessStage(func, args)
+    coro.func = func
     return coro
 
 
+def _run_process_stage(payload):
+    """Call the function of a `process_stage` on a message. This runs
+    in a worker process: `payload` is a pickled tuple of the module and
+    name of the stage, its arguments and the message, and the pickled
+    return value is returned.
+    """
+    module, name, args, msg = pickle.loads(payload)
+    __import__(module)
+    func = getattr(sys.modules[module], name).func
+    return pickle.dumps(func(*(args + (msg,))), pickle.HIGHEST_PROTOCOL)
+
+
+class ProcessStage(object):
+    """A pipeline stage created by a function decorated with
+    `process_stage`. It behaves like a stage coroutine in the current
+    thread, but `Pipeline.run_parallel` sends its messages to a pool of
+    worker processes instead.
+    """
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+    def next(self):
+        return None
+
+    def send(self, msg):
+        return self.func(*(self.args + (msg,)))
+
+    def payload(self, msg):
+        """Pickle a message and the stage's arguments for a worker.
+        """
+        return pickle.dumps(
+            (self.func.__module__, self.func.__name__, self.args, msg),
+            pickle.HIGHEST_PROTOCOL
+        )
+
+
+class OrderedStage(tuple):
+    """A pipeline stage made of several coroutines that run in parallel
+    threads, like a list of coroutines, but whose output messages keep
+    the order of the messages the stage received.
+    """
+
+
+class StageStats(object):
+    """Statistics about one stage of a pipeline, shared by all of the
+    stage's threads:
+
+    - `msgs_in` and `msgs_out`: the number of messages the stage
+      received and sent.
+    - `busy`: the time (in seconds) spent running the stage.
+    - `idle`: the time spent waiting for messages from the previous
+      stage.
+    - `blocked`: the time spent waiting for room in the next stage's
+      queue (or, in an `OrderedStage`, for earlier messages to be
+      sent).
+    - `queue_high_water`: the largest number (or total size, if the
+      pipeline weighs its messages) of messages waiting in the queue
+      after the stage, or None for the last stage and for sequential
+      pipelines.
+
+    The times are summed over the stage's threads.
+    """
+    def __init__(self, name, threads=1):
+        self.name = name
+        self.threads = threads
+        self.msgs_in = 0
+        self.msgs_out = 0
+        self.busy = 0.0
+        self.idle = 0.0
+        self.blocked = 0.0
+        self.queue_high_water = None
+        self.lock = Lock()
+
+    def add(self, msgs_in=0, msgs_out=0, busy=0.0, idle=0.0, blocked=0.0):
+        """Add to the counters.
+        """
+        with self.lock:
+            self.msgs_in += msgs_in
+            self.msgs_out += msgs_out
+            self.busy += busy
+            self.idle += idle
+            self.blocked += blocked
+
+
 def _allmsgs(obj):
     """Returns a list of all the messages encapsulated in obj. If obj
     is a MultiMessage, returns its enclosed messages. If obj is BUBBLE,
@@ -205,6 +399,7 @@ class PipelineThread(Thread):
         self.abort_flag = False
         self.all_threads = all_threads
         self.exc_info = None
+        self.stats = None
 
     def abort(self):
         """Shut down the thread at the next chance possible.
@@ -225,6 +420,43 @@ class PipelineThread(Thread):
         for thread in self.all_threads:
             thread.abort()
 
+    def _get(self, **kwargs):
+        """Get a message from the input queue, recording the wait as
+        idle time.
+        """
+        if self.stats is None:
+            return self.in_queue.get(**kwargs)
+        start = time.time()
+        try:
+            msg = self.in_queue.get(**kwargs)
+        finally:
+            self.stats.add(idle=time.time() - start)
+        if msg is not POISON:
+            self.stats.add(msgs_in=1)
+        return msg
+
+    def _put(self, msg):
+        """Put a message into the output queue, recording the wait as
+        blocked time.
+        """
+        if self.stats is None:
+            self.out_queue.put(msg)
+            return
+        start = time.time()
+        self.out_queue.put(msg)
+        self.stats.add(msgs_out=1, blocked=time.time() - start)
+
+    def _timed(self, func, *args):
+        """Call `func` with `args`, recording the time as busy time.
+        """
+        if self.stats is None:
+            return func(*args)
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.stats.add(busy=time.time() - start)
+
 
 class FirstPipelineThread(PipelineThread):
     """The thread running the first stage in a parallel pipeline setup.
@@ -248,7 +480,7 @@ class FirstPipelineThread(PipelineThread):
 
                 # Get the value from the generator.
                 try:
-                    msg = self.coro.next()
+                    msg = self._timed(self.coro.next)
                 except StopIteration:
                     break
 
@@ -257,9 +489,9 @@ class FirstPipelineThread(PipelineThread):
                     with self.abort_lock:
                         if self.abort_flag:
                             return
-                    self.out_queue.put(msg)
+                    self._put(msg)
 
-        except:
+        except BaseException:
             self.abort_all(sys.exc_info())
             return
 
@@ -289,7 +521,7 @@ class MiddlePipelineThread(PipelineThread):
                         return
 
                 # Get the message from the previous stage.
-                msg = self.in_queue.get()
+                msg = self._get()
                 if msg is POISON:
                     break
 
@@ -298,16 +530,178 @@ class MiddlePipelineThread(PipelineThread):
                         return
 
                 # Invoke the current stage.
-                out = self.coro.send(msg)
+                out = self._timed(self.coro.send, msg)
 
                 # Send messages to next stage.
                 for msg in _allmsgs(out):
                     with self.abort_lock:
                         if self.abort_flag:
                             return
-                    self.out_queue.put(msg)
+                    self._put(msg)
+
+        except BaseException:
+            self.abort_all(sys.exc_info())
+            return
+
+        # Pipeline is shutting down normally.
+        self.out_queue.release()
+
+
+class _Sequencer(object):
+    """Shared state for the threads of an `OrderedStage`: messages are
+    numbered as the threads take them from the input queue, and each
+    thread waits until the results for all earlier messages have been
+    sent before sending its own.
+    """
+    def __init__(self):
+        self.take_lock = Lock()
+        self.send_cond = Condition()
+        self.next_taken = 0
+        self.next_sent = 0
+
+
+class OrderedPipelineThread(MiddlePipelineThread):
+    """A thread running one of the coroutines in an `OrderedStage`.
+    """
+    def __init__(self, coro, in_queue, out_queue, all_threads, sequencer):
+        super(OrderedPipelineThread, self).__init__(coro, in_queue,
+                                                    out_queue, all_threads)
+        self.sequencer = sequencer
+
+    def abort(self):
+        super(OrderedPipelineThread, self).abort()
+
+        # Wake up the threads waiting for their turn to send.
+        with self.sequencer.send_cond:
+            self.sequencer.send_cond.notify_all()
+
+    def run(self):
+        seq = self.sequencer
+        try:
+            # Prime the coroutine.
+            self.coro.next()
+
+            while True:
+                with self.abort_lock:
+                    if self.abort_flag:
+                        return
+
+                # Get the message from the previous stage and its
+                # position in the stage's input.
+                with seq.take_lock:
+                    msg = self._get()
+                    if msg is POISON:
+                        break
+                    index = seq.next_taken
+                    seq.next_taken += 1
+
+                with self.abort_lock:
+                    if self.abort_flag:
+                        return
+
+                # Invoke the current stage.
+                out = _allmsgs(self._timed(self.coro.send, msg))
+
+                # Send messages to next stage once the messages for all
+                # earlier inputs have been sent.
+                with seq.send_cond:
+                    start = time.time()
+                    while seq.next_sent != index:
+                        if self.abort_flag:
+                            return
+                        seq.send_cond.wait()
+                    if self.stats is not None:
+                        self.stats.add(blocked=time.time() - start)
+                    for msg in out:
+                        with self.abort_lock:
+                            if self.abort_flag:
+                                return
+                        self._put(msg)
+                    seq.next_sent += 1
+                    seq.send_cond.notify_all()
+
+        except BaseException:
+            self.abort_all(sys.exc_info())
+            return
+
+        # Pipeline is shutting down normally.
+        self.out_queue.release()
+
 
-        except:
+class ProcessPipelineThread(PipelineThread):
+    """A thread feeding the messages for a `ProcessStage` to `pool`, a
+    `multiprocessing.Pool` of `processes` worker processes. At most one
+    message per worker is processed at a time, and the results are sent
+    to the next stage in order. The pool belongs to the caller, which
+    must create it before any thread starts (forking a process while
+    other threads hold locks can deadlock the workers) and terminate it.
+    """
+    def __init__(self, stage, in_queue, out_queue, all_threads, pool,
+                 processes):
+        super(ProcessPipelineThread, self).__init__(all_threads)
+        self.stage = stage
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.out_queue.acquire()
+        self.pool = pool
+        self.processes = processes
+
+    def _send(self, result):
+        """Send the messages from a worker's result to the next stage.
+        Return False if the thread was aborted.
+        """
+        for msg in _allmsgs(pickle.loads(self._timed(result.get))):
+            with self.abort_lock:
+                if self.abort_flag:
+                    return False
+            self._put(msg)
+        return True
+
+    def run(self):
+        pending = deque()
+        try:
+            while True:
+                with self.abort_lock:
+                    if self.abort_flag:
+                        return
+
+                # Get the message from the previous stage. While
+                # workers are busy, only wait briefly so that their
+                # results are not held back.
+                try:
+                    if pending:
+                        msg = self._get(timeout=PROCESS_POLL_INTERVAL)
+                    else:
+                        msg = self._get()
+                except Queue.Empty:
+                    msg = None
+                else:
+                    if msg is POISON:
+                        break
+
+                with self.abort_lock:
+                    if self.abort_flag:
+                        return
+
+                # Hand the message to a worker.
+                if msg is not None:
+                    pending.append(self.pool.apply_async(
+                        _run_process_stage, (self.stage.payload(msg),)
+                    ))
+
+                # Send the results that are ready (in order) and wait
+                # for the oldest one if every worker is busy.
+                while pending and (pending[0].ready() or
+                                   len(pending) >= self.processes):
+                    if not self._send(pending.popleft()):
+                        return
+
+            # Send the remaining results.
+            while pending:
+                if not self._send(pending.popleft()):
+                    return
+
+        except BaseException:
             self.abort_all(sys.exc_info())
             return
 
@@ -335,7 +729,7 @@ class LastPipelineThread(PipelineThread):
                         return
 
                 # Get the message from the previous stage.
-                msg = self.in_queue.get()
+                msg = self._get()
                 if msg is POISON:
                     break
 
@@ -344,9 +738,9 @@ class LastPipelineThread(PipelineThread):
                         return
 
                 # Send to consumer.
-                self.coro.send(msg)
+                self._timed(self.coro.send, msg)
 
-        except:
+        except BaseException:
             self.abort_all(sys.exc_info())
             return
 
@@ -356,9 +750,11 @@ class Pipeline(object):
     is a coroutine that receives messages from the previous stage and
     yields messages to be sent to the next stage.
     """
-    def __init__(self, stages):
+    def __init__(self, stages, stats=False):
         """Makes a new pipeline from a list of coroutines. There must
-        be at least two stages.
+        be at least two stages, and the first cannot be made by a
+        `process_stage` function. If `stats` is true, the pipeline keeps
+        a `StageStats` object for each stage in its `stats` list.
         """
         if len(stages) < 2:
             raise ValueError('pipeline must have at least two stages')
@@ -369,6 +765,16 @@ class Pipeline(object):
             else:
                 # Default to one thread per stage.
                 self.stages.append((stage,))
+        if any(isinstance(coro, ProcessStage) for coro in self.stages[0]):
+            # A process stage only handles messages: it cannot produce
+            # them.
+            raise ValueError('process stage cannot be the first stage')
+
+        if stats:
+            self.stats = [StageStats(_stage_name(stage[0]), len(stage))
+                          for stage in self.stages]
+        else:
+            self.stats = None
 
     def run_sequential(self):
         """Run the pipeline sequentially in the current thread. The
@@ -377,14 +783,29 @@ class Pipeline(object):
         """
         list(self.pull())
 
-    def run_parallel(self, queue_size=DEFAULT_QUEUE_SIZE):
+    def run_parallel(self, queue_size=DEFAULT_QUEUE_SIZE, processes=None,
+                     weigh=None):
         """Run the pipeline in parallel using one thread per stage. The
         messages between the stages are stored in queues of the given
-        size.
+        size, which is either a number or a list with the size of the
+        queue after each stage but the last. If `weigh` is given, the
+        sizes limit the total of `weigh(message)` over the queued
+        messages instead of their number (see `CountedQueue`). Middle
+        stages made by a `process_stage` function each use a pool of
+        `processes` worker processes, which defaults to the number of
+        CPUs.
         """
         queue_count = len(self.stages) - 1
-        queues = [CountedQueue(queue_size) for i in range(queue_count)]
+        if isinstance(queue_size, (list, tuple)):
+            if len(queue_size) != queue_count:
+                raise ValueError('need one queue size per stage but the last')
+            sizes = queue_size
+        else:
+            sizes = [queue_size] * queue_count
+        queues = [CountedQueue(size, weigh) for size in sizes]
         threads = []
+        pools = []
+        processes = processes or multiprocessing.cpu_count()
 
         # Set up first stage.
         for coro in self.stages[0]:
@@ -392,10 +813,25 @@ class Pipeline(object):
 
         # Middle stages.
         for i in range(1, queue_count):
-            for coro in self.stages[i]:
-                threads.append(MiddlePipelineThread(
-                    coro, queues[i - 1], queues[i], threads
-                ))
+            if isinstance(self.stages[i], OrderedStage):
+                sequencer = _Sequencer()
+                for coro in self.stages[i]:
+                    threads.append(OrderedPipelineThread(
+                        coro, queues[i - 1], queues[i], threads, sequencer
+                    ))
+            else:
+                for coro in self.stages[i]:
+                    if isinstance(coro, ProcessStage):
+                        # Fork the workers before any thread starts.
+                        pools.append(multiprocessing.Pool(processes))
+                        threads.append(ProcessPipelineThread(
+                            coro, queues[i - 1], queues[i], threads,
+                            pools[-1], processes
+                        ))
+                    else:
+                        threads.append(MiddlePipelineThread(
+                            coro, queues[i - 1], queues[i], threads
+                        ))
 
         # Last stage.
         for coro in self.stages[-1]:
@@ -403,6 +839,13 @@ class Pipeline(object):
                 LastPipelineThread(coro, queues[-1], threads)
             )
 
+        # Share each stage's statistics among its threads.
+        if self.stats:
+            stage_stats = [st for st, stage in zip(self.stats, self.stages)
+                           for _ in stage]
+            for thread, st in zip(threads, stage_stats):
+                thread.stats = st
+
         # Start threads.
         for thread in threads:
             thread.start()
@@ -414,7 +857,7 @@ class Pipeline(object):
             while threads[-1].isAlive():
                 threads[-1].join(1)
 
-        except:
+        except BaseException:
             # Stop all the threads immediately.
             for thread in threads:
                 thread.abort()
@@ -427,6 +870,14 @@ class Pipeline(object):
             for thread in threads[:-1]:
                 thread.join()
 
+            for pool in pools:
+                pool.terminate()
+                pool.join()
+
+            if self.stats:
+                for st, queue in zip(self.stats, queues):
+                    st.queue_high_water = queue.high_water
+
         for thread in threads:
             exc_info = thread.exc_info
             if exc_info:
@@ -441,27 +892,47 @@ class Pipeline(object):
         yield any messages. Only the first coroutine in each stage is used
         """
         coros = [stage[0] for stage in self.stages]
-
+        for msg in self._pull(coros, self.stats):
+            yield msg
+
+    def _pull(self, coros, stats=None):
+        """Run the coroutines sequentially and yield the messages from
+        the last one. If `stats` is given, it is a list with a
+        `StageStats` object for each coroutine, in which the stage's
+        messages and busy time are recorded.
+        """
         # "Prime" the coroutines.
         for coro in coros[1:]:
             coro.next()
 
         # Begin the pipeline.
-        for out in coros[0]:
+        first = iter(coros[0])
+        while True:
+            start = time.time()
+            try:
+                out = first.next()
+            except StopIteration:
+                break
             msgs = _allmsgs(out)
-            for coro in coros[1:]:
+            if stats:
+                stats[0].add(msgs_out=len(msgs), busy=time.time() - start)
+
+            for i, coro in enumerate(coros[1:], 1):
                 next_msgs = []
                 for msg in msgs:
+                    start = time.time()
                     out = coro.send(msg)
                     next_msgs.extend(_allmsgs(out))
+                    if stats:
+                        stats[i].add(msgs_in=1, busy=time.time() - start)
+                if stats and i < len(coros) - 1:
+                    stats[i].add(msgs_out=len(next_msgs))
                 msgs = next_msgs
             for msg in msgs:
                 yield msg
 
 # Smoke test.
 if __name__ == b'__main__':
-    import time
-
     # Test a normally-terminating pipeline both in sequence and
     # in parallel.
     def produce():
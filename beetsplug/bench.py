@@ -83,6 +83,25 @@ def match_benchmark(lib, prof, query=None, album_id=None):
         print('match duration:', interval)
 
 
+def store_benchmark(lib, prof, query=None):
+    # Mark a few fields on every matching item as dirty without changing
+    # their values, so storing the items leaves the library untouched.
+    items = list(lib.items(query))
+    for item in items:
+        item._dirty.update(['title', 'artist', 'album'])
+
+    def _store_items():
+        with lib.transaction():
+            for item in items:
+                item.store()
+    if prof:
+        cProfile.runctx('_store_items()', {}, {'_store_items': _store_items},
+                        'store.prof')
+    else:
+        interval = timeit.timeit(_store_items, number=1)
+        print('store duration:', interval)
+
+
 class BenchmarkPlugin(BeetsPlugin):
     """A plugin for performing some simple performance benchmarks.
     """
@@ -105,4 +124,12 @@ class BenchmarkPlugin(BeetsPlugin):
         match_bench_cmd.func = lambda lib, opts, args: \
             match_benchmark(lib, opts.profile, ui.decargs(args), opts.id)
 
-        return [aunique_bench_cmd, match_bench_cmd]
+        store_bench_cmd = ui.Subcommand('bench_store',
+                                        help='benchmark for storing items')
+        store_bench_cmd.parser.add_option('-p', '--profile',
+                                          action='store_true', default=False,
+                                          help='performance profiling')
+        store_bench_cmd.func = lambda lib, opts, args: \
+            store_benchmark(lib, opts.profile, ui.decargs(args))
+
+        return [aunique_bench_cmd, match_bench_cmd, store_bench_cmd]
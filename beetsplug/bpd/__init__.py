@@ -948,13 +948,12 @@ class Server(BaseServer):
 
     def cmd_stats(self, conn):
         """Sends some statistics about the library."""
-        with self.lib.transaction() as tx:
-            statement = 'SELECT COUNT(DISTINCT artist), ' \
-                        'COUNT(DISTINCT album), ' \
-                        'COUNT(id), ' \
-                        'SUM(length) ' \
-                        'FROM items'
-            artists, albums, songs, totaltime = tx.query(statement)[0]
+        artists, albums, songs, totaltime = self.lib.aggregate_items([
+            dbcore.query.CountDistinct('artist'),
+            dbcore.query.CountDistinct('album'),
+            dbcore.query.Count(),
+            dbcore.query.Sum('length'),
+        ])
 
         yield (
             u'artists: ' + unicode(artists),
@@ -962,7 +961,7 @@ class Server(BaseServer):
             u'songs: ' + unicode(songs),
             u'uptime: ' + unicode(int(time.time() - self.startup_time)),
             u'playtime: ' + u'0',  # Missing.
-            u'db_playtime: ' + unicode(int(totaltime)),
+            u'db_playtime: ' + unicode(int(totaltime or 0)),
             u'db_update: ' + unicode(int(self.updated_time)),
         )
 
@@ -1055,7 +1054,7 @@ class Server(BaseServer):
         statement = 'SELECT DISTINCT ' + show_key + \
                     ' FROM items WHERE ' + clause + \
                     ' ORDER BY ' + show_key
-        with self.lib.transaction() as tx:
+        with self.lib.transaction(False) as tx:
             rows = tx.query(statement, subvals)
 
         for row in rows:
@@ -1066,11 +1065,11 @@ class Server(BaseServer):
         tag/value query.
         """
         _, key = self._tagtype_lookup(tag)
-        songs = 0
-        playtime = 0.0
-        for item in self.lib.items(dbcore.query.MatchQuery(key, value)):
-            songs += 1
-            playtime += item.length
+        songs, playtime = self.lib.aggregate_items(
+            [dbcore.query.Count(), dbcore.query.Sum('length')],
+            dbcore.query.MatchQuery(key, value),
+        )
+        playtime = playtime or 0.0
         yield u'songs: ' + unicode(songs)
         yield u'playtime: ' + unicode(int(playtime))
 
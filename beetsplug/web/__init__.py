@@ -111,12 +111,15 @@ def resource_query(name):
 
 def resource_list(name):
     """Decorates a function to handle RESTful HTTP request for a list of
-    resources.
+    resources. The optional `limit` and `offset` request arguments
+    select a page of the list.
     """
     def make_responder(list_all):
         def responder():
+            limit = flask.request.args.get('limit', type=int)
+            offset = flask.request.args.get('offset', 0, type=int)
             return app.response_class(
-                json_generator(list_all(), root=name),
+                json_generator(list_all(limit, offset), root=name),
                 mimetype='application/json'
             )
         responder.__name__ = b'all_%s' % name.encode('utf8')
@@ -175,8 +178,8 @@ def get_item(id):
 @app.route('/item/')
 @app.route('/item/query/')
 @resource_list('items')
-def all_items():
-    return g.lib.items()
+def all_items(limit=None, offset=0):
+    return g.lib.items(limit=limit, offset=offset)
 
 
 @app.route('/item/<int:item_id>/file')
@@ -205,8 +208,8 @@ def get_album(id):
 @app.route('/album/')
 @app.route('/album/query/')
 @resource_list('albums')
-def all_albums():
-    return g.lib.albums()
+def all_albums(limit=None, offset=0):
+    return g.lib.albums(limit=limit, offset=offset)
 
 
 @app.route('/album/query/<query:queries>')
@@ -225,7 +228,7 @@ def album_art(album_id):
 
 @app.route('/artist/')
 def all_artists():
-    with g.lib.transaction() as tx:
+    with g.lib.transaction(False) as tx:
         rows = tx.query("SELECT DISTINCT albumartist FROM albums")
     all_artists = [row[0] for row in rows]
     return flask.jsonify(artist_names=all_artists)
@@ -235,7 +238,7 @@ def all_artists():
 
 @app.route('/stats')
 def stats():
-    with g.lib.transaction() as tx:
+    with g.lib.transaction(False) as tx:
         item_rows = tx.query("SELECT COUNT(*) FROM items")
         album_rows = tx.query("SELECT COUNT(*) FROM albums")
     return flask.jsonify({
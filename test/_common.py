@@ -144,6 +144,7 @@ class TestCase(unittest.TestCase):
         # temporary directory.
         self.temp_dir = tempfile.mkdtemp()
         beets.config['statefile'] = os.path.join(self.temp_dir, 'state.pickle')
+        beets.config['statedb'] = os.path.join(self.temp_dir, 'state.db')
         beets.config['library'] = os.path.join(self.temp_dir, 'library.db')
         beets.config['directory'] = os.path.join(self.temp_dir, 'libdir')
 
@@ -18,11 +18,17 @@ from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
 import os
+import copy
+import pickle
 import sqlite3
+import threading
 
+from test import _common
 from test._common import unittest
+import beets
 from beets import dbcore
 from tempfile import mkstemp
+from mock import patch
 
 
 # Fixture: concrete database and model classes. For migration tests, we
@@ -115,6 +121,29 @@ class TestDatabaseTwoModels(dbcore.Database):
     pass
 
 
+class IndexedTestModel2(TestModel2):
+    _indices = {
+        'one': ('field_one',),
+        'one_two': ('field_one', 'field_two'),
+    }
+
+
+class IndexedTestDatabase2(dbcore.Database):
+    _models = (IndexedTestModel2,)
+    pass
+
+
+class ChangedIndexTestModel2(TestModel2):
+    _indices = {
+        'one': ('field_one COLLATE NOCASE',),
+    }
+
+
+class ChangedIndexTestDatabase2(dbcore.Database):
+    _models = (ChangedIndexTestModel2,)
+    pass
+
+
 class MigrationTest(unittest.TestCase):
     """Tests the ability to change the database schema between
     versions.
@@ -207,6 +236,26 @@ class ModelTest(unittest.TestCase):
         other_model = self.db._get(TestModel1, model.id)
         self.assertEqual(other_model.foo, 'bar')
 
+    def test_bulk_insert(self):
+        models = [TestModel1(field_one=i) for i in range(3)]
+        models[2].foo = 'bar'
+        self.db.bulk_insert(models)
+        rows = self.db._connection().execute(
+            'select * from test order by id'
+        ).fetchall()
+        self.assertEqual([row[b'field_one'] for row in rows], [0, 1, 2])
+        self.assertEqual([row[b'id'] for row in rows],
+                         [m.id for m in models])
+        other_model = self.db._get(TestModel1, models[2].id)
+        self.assertEqual(other_model.foo, 'bar')
+
+    def test_bulk_insert_after_add(self):
+        model = TestModel1()
+        model.add(self.db)
+        models = [TestModel1(), TestModel1()]
+        self.db.bulk_insert(models)
+        self.assertEqual([m.id for m in models], [model.id + 1, model.id + 2])
+
     def test_delete_flexattr(self):
         model = TestModel1()
         model['foo'] = 'bar'
@@ -274,6 +323,292 @@ class ModelTest(unittest.TestCase):
         self.assertNotIn('flex_field', model2)
 
 
+class CountingType(dbcore.types.Integer):
+    """An integer type that counts its conversions from SQL.
+    """
+    conversions = 0
+
+    def from_sql(self, sql_value):
+        CountingType.conversions += 1
+        return super(CountingType, self).from_sql(sql_value)
+
+
+class LazyTestModel(TestModel1):
+    _fields = {
+        'id': dbcore.types.PRIMARY_ID,
+        'field_one': CountingType(),
+    }
+    _types = {
+        'flex_one': CountingType(),
+    }
+
+
+class LazyTestDatabase(dbcore.Database):
+    _models = (LazyTestModel,)
+    pass
+
+
+class LazyConversionTest(unittest.TestCase):
+    def setUp(self):
+        self.db = LazyTestDatabase(':memory:')
+        model = LazyTestModel()
+        model.field_one = 1
+        model.flex_one = 2
+        model.flex_two = 'x'
+        model.add(self.db)
+        CountingType.conversions = 0
+        self.model = self.db._fetch(LazyTestModel).get()
+
+    def tearDown(self):
+        self.db._connection().close()
+
+    def test_values_converted_on_access(self):
+        self.assertEqual(CountingType.conversions, 0)
+        self.assertEqual(self.model.field_one, 1)
+        self.assertEqual(self.model.flex_one, 2)
+        self.assertEqual(CountingType.conversions, 2)
+
+    def test_values_converted_once(self):
+        self.model.field_one
+        self.model.field_one
+        self.assertEqual(CountingType.conversions, 1)
+
+    def test_dict_api(self):
+        self.assertEqual(sorted(self.model.keys()),
+                         ['added', 'field_one', 'flex_one', 'flex_two', 'id'])
+        self.assertEqual(dict(self.model)['flex_one'], 2)
+        self.assertIn('flex_two', self.model)
+
+    def test_set_value(self):
+        self.model.field_one = 5
+        self.assertEqual(self.model.field_one, 5)
+        self.assertEqual(self.model._dirty, set(['field_one']))
+
+    def test_delete_flex_value(self):
+        del self.model.flex_two
+        self.assertNotIn('flex_two', self.model)
+        self.assertEqual(self.model.flex_one, 2)
+
+    def test_copy_and_pickle(self):
+        values = copy.deepcopy(self.model._values_flex)
+        self.assertEqual(values['flex_one'], 2)
+        values = pickle.loads(pickle.dumps(self.model._values_fixed))
+        self.assertEqual(values['field_one'], 1)
+
+
+class ProjectionTest(unittest.TestCase):
+    def setUp(self):
+        self.db = TestDatabase2(':memory:')
+        model = TestModel2()
+        model.field_one = 1
+        model.field_two = 2
+        model.flex = 'x'
+        model.add(self.db)
+
+    def tearDown(self):
+        self.db._connection().close()
+
+    def test_fetch_only_requested_fields(self):
+        model = self.db._fetch(TestModel2, fields=['field_one']).get()
+        self.assertEqual(sorted(model._values_fixed.keys()),
+                         ['field_one', 'id'])
+        self.assertEqual(model.flex, 'x')
+
+    def test_missing_field_loaded_on_access(self):
+        model = self.db._fetch(TestModel2, fields=['field_one']).get()
+        self.assertEqual(model.field_two, 2)
+        self.assertFalse(model._incomplete)
+
+    def test_store_keeps_unfetched_fields(self):
+        model = self.db._fetch(TestModel2, fields=['field_one']).get()
+        model.field_one = 3
+        model.store()
+        model = self.db._fetch(TestModel2).get()
+        self.assertEqual(model.field_one, 3)
+        self.assertEqual(model.field_two, 2)
+
+    def test_slow_query_fetches_all_fields(self):
+        q = dbcore.query.SubstringQuery('flex', 'x', False)
+        model = self.db._fetch(TestModel2, q, fields=['field_one']).get()
+        self.assertFalse(model._incomplete)
+
+    def test_fields_across_chunks(self):
+        for i in range(dbcore.db.Results.chunk_size + 10):
+            TestModel2(field_two=i).add(self.db)
+        objs = list(self.db._fetch(TestModel2, fields=['field_two']))
+        self.assertIsNone(objs[-1]._values_fixed.get('field_one'))
+        self.assertEqual(objs[-1].field_two,
+                         dbcore.db.Results.chunk_size + 9)
+
+
+class IndexTest(_common.TestCase):
+    def setUp(self):
+        super(IndexTest, self).setUp()
+        self.path = os.path.join(self.temp_dir, 'test.db')
+
+    def indices(self, db):
+        rows = db._connection().execute(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE type = 'index' AND tbl_name = 'test'"
+        ).fetchall()
+        db._connection().close()
+        return dict((row[0], row[1]) for row in rows)
+
+    def test_declared_indices_created(self):
+        indices = self.indices(IndexedTestDatabase2(self.path))
+        self.assertEqual(
+            indices['test_index_one_two'],
+            'CREATE INDEX test_index_one_two ON test (field_one, field_two)'
+        )
+        self.assertIn('test_index_one', indices)
+
+    def test_configured_indices_created(self):
+        beets.config['index']['test'] = ['field_two', ['field_one', 'id']]
+        indices = self.indices(TestDatabase2(self.path))
+        self.assertIn('test_index_field_two', indices)
+        self.assertIn('test_index_field_one_id', indices)
+
+    def test_configured_flex_field_ignored(self):
+        beets.config['index']['test'] = ['flex']
+        indices = self.indices(TestDatabase2(self.path))
+        self.assertNotIn('test_index_flex', indices)
+
+    def test_obsolete_indices_dropped(self):
+        self.indices(IndexedTestDatabase2(self.path))
+        indices = self.indices(TestDatabase2(self.path))
+        self.assertNotIn('test_index_one', indices)
+        self.assertNotIn('test_index_one_two', indices)
+
+    def test_changed_index_recreated(self):
+        self.indices(IndexedTestDatabase2(self.path))
+        indices = self.indices(ChangedIndexTestDatabase2(self.path))
+        self.assertIn('COLLATE NOCASE', indices['test_index_one'])
+        self.assertNotIn('test_index_one_two', indices)
+
+    def test_other_indices_untouched(self):
+        db = TestDatabase2(self.path)
+        db._connection().execute('CREATE INDEX custom ON test (field_two)')
+        db._connection().commit()
+        self.assertIn('custom', self.indices(TestDatabase2(self.path)))
+
+    def test_query_plan_uses_index(self):
+        db = IndexedTestDatabase2(self.path)
+        plan = db._query_plan(IndexedTestModel2,
+                              dbcore.query.MatchQuery('field_one', 1))
+        db._connection().close()
+        self.assertIn('test_index_one', ' '.join(plan))
+
+
+class ConcurrentReadsTest(_common.TestCase):
+    def setUp(self):
+        super(ConcurrentReadsTest, self).setUp()
+        beets.config['concurrent_reads'] = True
+        self.db = TestDatabase1(os.path.join(self.temp_dir, 'test.db'))
+
+    def tearDown(self):
+        self.db._connection().close()
+        super(ConcurrentReadsTest, self).tearDown()
+
+    def test_uses_write_ahead_log(self):
+        row = self.db._connection().execute('PRAGMA journal_mode').fetchone()
+        self.assertEqual(row[0], 'wal')
+
+    def test_read_does_not_wait_for_write(self):
+        TestModel1().add(self.db)
+        counts = []
+
+        def read():
+            counts.append(len(self.db._fetch(TestModel1)))
+
+        with self.db.transaction():
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join(5)
+            self.assertEqual(counts, [1])
+
+    def test_read_does_not_take_lock(self):
+        with self.db.transaction(False):
+            self.assertFalse(self.db._db_lock.locked())
+
+    def test_write_nested_in_read_takes_lock(self):
+        with self.db.transaction(False):
+            with self.db.transaction():
+                self.assertTrue(self.db._db_lock.locked())
+            self.assertTrue(self.db._db_lock.locked())
+        self.assertFalse(self.db._db_lock.locked())
+
+
+class AggregateTest(unittest.TestCase):
+    def setUp(self):
+        self.db = TestDatabase1(':memory:')
+        for one, flex in ((1, 'a'), (2, 'a'), (4, 'b'), (0, None)):
+            model = TestModel1()
+            model.field_one = one
+            if flex:
+                model.flex = flex
+            model.add(self.db)
+
+    def tearDown(self):
+        self.db._connection().close()
+
+    def aggregate(self, query=None):
+        return self.db._aggregate(TestModel1, [
+            dbcore.query.Count(),
+            dbcore.query.Count('field_one'),
+            dbcore.query.Sum('field_one'),
+            dbcore.query.Sum('field_one', 'field_one'),
+            dbcore.query.Min('field_one'),
+            dbcore.query.Max('field_one'),
+        ], query)
+
+    def test_aggregate_in_sql(self):
+        self.assertEqual(self.aggregate(), [4, 4, 7, 21, 0, 4])
+
+    def test_aggregate_fast_query(self):
+        q = dbcore.query.NumericQuery('field_one', '2..')
+        self.assertEqual(self.aggregate(q), [2, 2, 6, 20, 2, 4])
+
+    def test_aggregate_slow_query(self):
+        q = dbcore.query.SubstringQuery('flex', 'a', False)
+        self.assertEqual(self.aggregate(q), [2, 2, 3, 5, 1, 2])
+
+    def test_aggregate_no_matches(self):
+        q = dbcore.query.MatchQuery('field_one', 3)
+        self.assertEqual(self.aggregate(q), [0, 0, None, None, None, None])
+
+    def test_count_distinct_flex_field(self):
+        count, = self.db._aggregate(
+            TestModel1, [dbcore.query.CountDistinct('flex')]
+        )
+        self.assertEqual(count, 2)
+
+
+class SQLCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.db = TestDatabase1(':memory:')
+
+    def tearDown(self):
+        self.db._connection().close()
+
+    def test_store_reuses_statement_text(self):
+        model = TestModel1()
+        model.add(self.db)
+        model.field_one = 1
+        model.store()
+        key = ('update', 'test', ('field_one',))
+        sql = dbcore.db._sql_cache[key]
+        model.field_one = 2
+        model.store()
+        self.assertIs(dbcore.db._sql_cache[key], sql)
+        self.assertEqual(self.db._get(TestModel1, model.id).field_one, 2)
+
+    def test_cache_is_bounded(self):
+        for i in range(dbcore.db.SQL_CACHE_SIZE + 1):
+            dbcore.db._cached_sql(('test', i), lambda: 'SELECT 1')
+        self.assertLessEqual(len(dbcore.db._sql_cache),
+                             dbcore.db.SQL_CACHE_SIZE)
+
+
 class FormatTest(unittest.TestCase):
     def test_format_fixed_field(self):
         model = TestModel1()
@@ -438,6 +773,16 @@ class QueryFromStringsTest(unittest.TestCase):
         q = self.qfs([''])
         self.assertIsInstance(q.subqueries[0], dbcore.query.TrueQuery)
 
+    def test_flex_query_uses_attribute_table(self):
+        q = self.qfs(['some_float_field:2..3'])
+        self.assertEqual(q.subqueries[0].flex_table, 'testflex')
+        clause, subvals = q.subqueries[0].clause()
+        self.assertIn('testflex', clause)
+
+    def test_fixed_query_does_not_use_attribute_table(self):
+        q = self.qfs(['field_one:2..3'])
+        self.assertIsNone(q.subqueries[0].flex_table)
+
 
 class SortFromStringsTest(unittest.TestCase):
     def sfs(self, strings):
@@ -467,8 +812,9 @@ class SortFromStringsTest(unittest.TestCase):
 
     def test_flex_field_sort(self):
         s = self.sfs(['flex_field+'])
-        self.assertIsInstance(s, dbcore.query.SlowFieldSort)
-        self.assertEqual(s, dbcore.query.SlowFieldSort('flex_field'))
+        self.assertIsInstance(s, dbcore.query.FlexFieldSort)
+        self.assertEqual(s, dbcore.query.FlexFieldSort('flex_field'))
+        self.assertFalse(s.is_slow())
 
     def test_special_sort(self):
         s = self.sfs(['some_sort+'])
@@ -554,6 +900,17 @@ class ResultsIteratorTest(unittest.TestCase):
         objs = self.db._fetch(TestModel1, q)
         self.assertEqual(len(list(objs)), 2)
 
+    def test_flex_query_in_sql(self):
+        q = dbcore.queryparse.construct_query_part(TestModel1, {}, 'foo:ba')
+        objs = self.db._fetch(TestModel1, q)
+        self.assertIsNone(objs.query)
+        self.assertEqual(len(list(objs)), 2)
+
+    def test_flex_query_in_sql_negative(self):
+        q = dbcore.queryparse.construct_query_part(TestModel1, {}, 'foo:qux')
+        objs = self.db._fetch(TestModel1, q)
+        self.assertEqual(len(list(objs)), 0)
+
     def test_slow_query_negative(self):
         q = dbcore.query.SubstringQuery('foo', 'qux', False)
         objs = self.db._fetch(TestModel1, q)
@@ -581,6 +938,133 @@ class ResultsIteratorTest(unittest.TestCase):
         objs = self.db._fetch(TestModel1)
         self.assertEqual(len(objs), 2)
 
+    def test_flexattrs_across_chunks(self):
+        for i in range(dbcore.db.Results.chunk_size + 10):
+            model = TestModel1()
+            model['foo'] = 'qux{0}'.format(i)
+            model.add(self.db)
+        objs = list(self.db._fetch(TestModel1))
+        self.assertEqual(len(objs), dbcore.db.Results.chunk_size + 12)
+        self.assertEqual(objs[-1].foo, 'qux{0}'.format(
+            dbcore.db.Results.chunk_size + 9
+        ))
+
+    def test_slow_query_across_chunks(self):
+        for i in range(dbcore.db.Results.chunk_size + 10):
+            model = TestModel1()
+            model['foo'] = 'qux'
+            model.add(self.db)
+        q = dbcore.query.SubstringQuery('foo', 'ba', False)
+        objs = self.db._fetch(TestModel1, q)
+        self.assertEqual(len(objs), 2)
+        self.assertEqual(objs[1].foo, 'bar')
+
+    def test_limit_offset(self):
+        objs = self.db._fetch(TestModel1, limit=1, offset=1)
+        self.assertEqual([o.foo for o in objs], ['bar'])
+
+    def test_limit_offset_slow_sort(self):
+        s = dbcore.query.SlowFieldSort('foo')
+        objs = self.db._fetch(TestModel1, sort=s, limit=1, offset=1)
+        self.assertEqual([o.foo for o in objs], ['baz'])
+
+    def test_limit_offset_slow_query(self):
+        q = dbcore.query.SubstringQuery('foo', 'ba', False)
+        objs = self.db._fetch(TestModel1, q, limit=1)
+        self.assertEqual([o.foo for o in objs], ['baz'])
+
+    def test_slice(self):
+        objs = self.db._fetch(TestModel1).slice(1)
+        self.assertEqual(len(objs), 1)
+        self.assertEqual(objs[0].foo, 'bar')
+
+    def test_negative_subscript(self):
+        objs = self.db._fetch(TestModel1)
+        self.assertEqual(objs[-1].foo, 'bar')
+        with self.assertRaises(IndexError):
+            objs[2]
+
+    def test_large_results_fetched_by_id(self):
+        for i in range(dbcore.db.Results.chunk_size + 10):
+            model = TestModel1()
+            model['foo'] = 'qux{0}'.format(i)
+            model.add(self.db)
+        objs = self.db._fetch(TestModel1)
+        self.assertEqual(len(objs.rows), dbcore.db.Results.chunk_size)
+        self.assertEqual(len(objs), dbcore.db.Results.chunk_size + 12)
+        self.assertEqual(objs[-1].foo, 'qux{0}'.format(
+            dbcore.db.Results.chunk_size + 9
+        ))
+        self.assertEqual(len(list(objs.stream())),
+                         dbcore.db.Results.chunk_size + 12)
+
+    def test_deleted_rows_skipped(self):
+        for i in range(dbcore.db.Results.chunk_size + 10):
+            model = TestModel1()
+            model.add(self.db)
+        objs = self.db._fetch(TestModel1)
+        model.remove()
+        self.assertEqual(len(list(objs)), dbcore.db.Results.chunk_size + 11)
+
+    def test_subscript_after_partial_iteration(self):
+        for i in range(dbcore.db.Results.chunk_size + 10):
+            model = TestModel1()
+            model.add(self.db)
+        objs = self.db._fetch(TestModel1)
+        iter(objs).next()
+        last = dbcore.db.Results.chunk_size + 11
+        self.assertIs(objs[0], objs[0])
+        self.assertIs(objs[last], objs[last])
+        objs[last]['foo'] = 'edited'
+        self.assertEqual(list(objs)[last]['foo'], 'edited')
+
+    def test_length_skips_rows_deleted_during_iteration(self):
+        models = []
+        for i in range(dbcore.db.Results.chunk_size + 10):
+            model = TestModel1()
+            model.add(self.db)
+            models.append(model)
+        objs = self.db._fetch(TestModel1)
+        it = iter(objs)
+        it.next()
+        models[-1].remove()
+        models[-2].remove()
+        self.assertEqual(len(objs), dbcore.db.Results.chunk_size + 10)
+        self.assertEqual(len(list(it)) + 1, len(objs))
+
+    def _queries(self):
+        """Record the SQL statements run through transactions.
+        """
+        return patch.object(dbcore.db.Transaction, 'query', autospec=True,
+                            side_effect=dbcore.db.Transaction.query)
+
+    def test_length_counted_once(self):
+        for i in range(dbcore.db.Results.chunk_size + 10):
+            TestModel1().add(self.db)
+        objs = self.db._fetch(TestModel1)
+        with self._queries() as query:
+            self.assertEqual(len(objs), dbcore.db.Results.chunk_size + 12)
+            self.assertEqual(len(objs), dbcore.db.Results.chunk_size + 12)
+        self.assertEqual(query.call_count, 2)  # One per chunk of ids.
+
+    def test_truth_stops_at_first_existing_row(self):
+        for i in range(dbcore.db.Results.chunk_size * 3):
+            TestModel1().add(self.db)
+        objs = self.db._fetch(TestModel1)
+        with self._queries() as query:
+            self.assertTrue(objs)
+        self.assertEqual(query.call_count, 1)
+
+    def test_rows_read_with_ids_not_fetched_again(self):
+        for i in range(dbcore.db.Results.chunk_size + 10):
+            TestModel1().add(self.db)
+        objs = self.db._fetch(TestModel1)
+        with self._queries() as query:
+            objs[dbcore.db.Results.chunk_size - 1]
+        statements = [args[1] for args, _ in query.call_args_list]
+        self.assertEqual(len(statements), 1)
+        self.assertIn('entity_id IN', statements[0])
+
 
 def suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
@@ -579,6 +579,54 @@ class WalkTest(_common.TestCase):
         self.assertEqual(res[0],
                          (self.base, [], []))
 
+    def test_nested_order(self):
+        os.mkdir(os.path.join(self.base, 'd', 'e'))
+        os.mkdir(os.path.join(self.base, 'C'))
+        touch(os.path.join(self.base, 'C', 'w'))
+        res = list(util.sorted_walk(self.base))
+        self.assertEqual([r[0] for r in res], [
+            self.base,
+            os.path.join(self.base, 'C'),
+            os.path.join(self.base, 'd'),
+            os.path.join(self.base, 'd', 'e'),
+        ])
+
+    def test_threaded_walk_same_as_sequential(self):
+        for name in ('b', 'a', 'c'):
+            os.mkdir(os.path.join(self.base, 'd', name))
+            touch(os.path.join(self.base, 'd', name, 'f'))
+        self.assertEqual(list(util.sorted_walk(self.base, threads=4)),
+                         list(util.sorted_walk(self.base)))
+
+    def test_removing_directory_skips_it(self):
+        for threads in (1, 4):
+            res = []
+            for root, dirs, files in util.sorted_walk(self.base,
+                                                      threads=threads):
+                res.append(root)
+                del dirs[:]
+            self.assertEqual(res, [self.base])
+
+    def test_unlistable_directory_skipped(self):
+        res = list(util.sorted_walk(os.path.join(self.base, 'nonexistent')))
+        self.assertEqual(res, [])
+
+    def test_pruned_directory_not_listed(self):
+        os.mkdir(os.path.join(self.base, 'd', 'e'))
+        touch(os.path.join(self.base, 'd', 'e', 'w'))
+
+        def prune(path):
+            if path == os.path.join(self.base, 'd'):
+                return ['e']
+
+        for threads in (1, 4):
+            res = list(util.sorted_walk(self.base, threads=threads,
+                                        prune=prune))
+            self.assertEqual(res, [
+                (self.base, ['d'], ['x', 'y']),
+                (os.path.join(self.base, 'd', 'e'), [], ['w']),
+            ])
+
 
 class UniquePathTest(_common.TestCase):
     def setUp(self):
@@ -19,18 +19,21 @@ from __future__ import (division, absolute_import, print_function,
 """
 import os
 import re
+import pickle
 import shutil
 import StringIO
 import unicodedata
 import sys
+import time
 from tempfile import mkstemp
 from zipfile import ZipFile
 from tarfile import TarFile
 from mock import patch
+from multiprocessing.pool import ThreadPool
 
 from test import _common
 from test._common import unittest
-from beets.util import displayable_path
+from beets.util import displayable_path, pipeline
 from test.helper import TestImportSession, TestHelper, has_program, capture_log
 from beets import importer
 from beets.importer import albums_in_dir
@@ -266,6 +269,24 @@ class NonAutotaggedImportTest(_common.TestCase, ImportHelper):
                 'Tag Artist', 'Tag Album', '%s.mp3' % mediafile.title
             )
 
+    def test_import_records_stage_stats(self):
+        self.importer.run()
+        self.assertEqual(
+            [(st.name, st.msgs_in) for st in self.importer.stats],
+            [('read_tasks', 0), ('import_asis', 2), ('apply_choices', 2),
+             ('manipulate_files', 2)]
+        )
+
+    def test_queue_sizes_per_stage(self):
+        config['import']['queue_size'] = 10
+        config['import']['queue_sizes'] = {'apply_choices': 3}
+        pl = pipeline.Pipeline([
+            iter([]),
+            importer.apply_choices(self.importer),
+            importer.manipulate_files(self.importer),
+        ], stats=True)
+        self.assertEqual(self.importer._queue_sizes(pl), [3, 10])
+
     def test_import_with_move_deletes_import_files(self):
         config['import']['move'] = True
 
@@ -670,6 +691,95 @@ class ImportTracksTest(_common.TestCase, ImportHelper):
         self.assert_file_in_lib('singletons', 'Applied Title 1.mp3')
 
 
+class ReadThreadsTest(_common.TestCase, ImportHelper):
+    """Test reading files' tags with a pool of threads.
+    """
+    def setUp(self):
+        self.setup_beets()
+        self._create_import_dir(5)
+        self.touch('track_0.txt',
+                   dir=os.path.join(self.import_dir, 'the_album'))
+        config['import']['read_threads'] = 3
+
+    def tearDown(self):
+        self.teardown_beets()
+
+    def _tasks(self, singletons=False):
+        self._setup_import_session(singletons=singletons)
+        self.importer.set_config(config['import'])
+        factory = importer.ImportTaskFactory(self.import_dir, self.importer)
+        return [task for task in factory.tasks()
+                if not isinstance(task, importer.SentinelImportTask)]
+
+    def test_album_items_in_order(self):
+        tasks = self._tasks()
+        self.assertEqual(len(tasks), 1)
+        self.assertEqual([item.title for item in tasks[0].items],
+                         ['Tag Title %d' % i for i in range(1, 6)])
+
+    def test_singletons_in_order(self):
+        tasks = self._tasks(singletons=True)
+        self.assertEqual([task.item.title for task in tasks],
+                         ['Tag Title %d' % i for i in range(1, 6)])
+
+    def test_same_as_sequential(self):
+        tasks = self._tasks()
+        config['import']['read_threads'] = 1
+        sequential = self._tasks()
+        self.assertEqual([item.path for item in tasks[0].items],
+                         [item.path for item in sequential[0].items])
+
+    def test_skipped_singletons_same_as_sequential(self):
+        config['import']['incremental'] = True
+        self._setup_import_session(singletons=True)
+        self.importer.set_config(config['import'])
+        album_dir = os.path.join(self.import_dir, 'the_album')
+        paths = [os.path.join(album_dir, name)
+                 for name in sorted(os.listdir(album_dir))]
+        importer.history_add([paths[1]])
+
+        def singletons(threads):
+            factory = importer.ImportTaskFactory(self.import_dir,
+                                                 self.importer)
+            if threads > 1:
+                factory.pool = ThreadPool(threads)
+            tasks = list(factory.singletons(paths))
+            if factory.pool:
+                factory.pool.close()
+                factory.pool.join()
+            return [task and task.item.path for task in tasks], \
+                factory.skipped
+
+        self.assertEqual(singletons(3), singletons(1))
+        tasks, skipped = singletons(3)
+        self.assertIsNone(tasks[1])
+        self.assertEqual(skipped, 1)
+
+
+class LookupThreadsTest(_common.TestCase, ImportHelper):
+    """Test looking up candidates in several threads.
+    """
+    def setUp(self):
+        self.setup_beets(disk=True)
+        self._create_import_dir(5)
+        self._setup_import_session(singletons=True)
+        config['threaded'] = True
+        config['import']['lookup_threads'] = 3
+        self.matcher = AutotagStub().install()
+
+    def tearDown(self):
+        self.teardown_beets()
+        self.matcher.restore()
+
+    def test_tasks_imported_in_order(self):
+        for _ in range(5):
+            self.importer.add_choice(importer.action.ASIS)
+        self.importer.run()
+        items = sorted(self.lib.items(), key=lambda item: item.id)
+        self.assertEqual([item.title for item in items],
+                         ['Tag Title %d' % i for i in range(1, 6)])
+
+
 class ImportCompilationTest(_common.TestCase, ImportHelper):
     """Test ASIS import of a folder containing tracks with different artists.
     """
@@ -1336,6 +1446,57 @@ class IncrementalImportTest(unittest.TestCase, TestHelper):
         importer.run()
         self.assertEqual(len(self.lib.items()), 2)
 
+    def _age_import_dir(self):
+        """Make the directories to import look old enough for their
+        fingerprints to be recorded.
+        """
+        past = time.time() - 60
+        for root, _, _ in os.walk(os.path.join(self.temp_dir, 'import')):
+            os.utime(root, (past, past))
+
+    def _skipped_unchanged(self, importer):
+        with capture_log() as logs:
+            importer.run()
+        return [l for l in logs if 'Skipping unchanged directory' in l]
+
+    def test_unchanged_directory_skipped(self):
+        importer = self.create_importer(album_count=2)
+        self._age_import_dir()
+
+        # The first run records the directories it imports.
+        self.assertEqual(self._skipped_unchanged(importer), [])
+        self.assertEqual(len(self._skipped_unchanged(importer)), 2)
+        self.assertEqual(len(self.lib.albums()), 2)
+
+    def test_skipped_directory_recorded(self):
+        importer = self.create_importer(album_count=2)
+        importer.run()
+        self._age_import_dir()
+
+        # Imported too recently to be recorded, so the second run
+        # records the directories when it skips them.
+        self.assertEqual(self._skipped_unchanged(importer), [])
+        self.assertEqual(len(self._skipped_unchanged(importer)), 2)
+
+    def test_changed_directory_listed(self):
+        importer = self.create_importer(album_count=2)
+        self._age_import_dir()
+        importer.run()
+
+        shutil.copy(os.path.join(_common.RSRC, 'full.mp3'),
+                    os.path.join(self.temp_dir, 'import', 'album 1',
+                                 'new.mp3'))
+        skipped = self._skipped_unchanged(importer)
+        self.assertEqual(len(skipped), 1)
+        self.assertIn('album 0', skipped[0])
+
+    def test_skip_unchanged_disabled(self):
+        self.config['import']['incremental_skip_unchanged'] = False
+        importer = self.create_importer()
+        self._age_import_dir()
+        importer.run()
+        self.assertEqual(self._skipped_unchanged(importer), [])
+
     def test_invalid_state_file(self):
         importer = self.create_importer()
         with open(self.config['statefile'].as_filename(), 'w') as f:
@@ -1344,6 +1505,50 @@ class IncrementalImportTest(unittest.TestCase, TestHelper):
         self.assertEqual(len(self.lib.albums()), 1)
 
 
+class ImportStateTest(_common.TestCase):
+    def setUp(self):
+        super(ImportStateTest, self).setUp()
+        self.state = importer.import_state()
+
+    def test_progress(self):
+        importer.progress_add(b'/top', b'/top/a', b'/top/b')
+        self.assertTrue(importer.has_progress(b'/top'))
+        self.assertTrue(importer.progress_element(b'/top', b'/top/b'))
+        self.assertFalse(importer.progress_element(b'/top', b'/top/c'))
+        self.assertFalse(importer.has_progress(b'/other'))
+
+        importer.progress_reset(b'/top')
+        self.assertFalse(importer.has_progress(b'/top'))
+        self.assertFalse(importer.progress_element(b'/top', b'/top/a'))
+
+    def test_history(self):
+        paths = [b'/top/a', b'/top/\xe4\xff']
+        importer.history_add(paths)
+        importer.history_add(paths)
+        self.assertTrue(importer.history_contains(paths))
+        self.assertFalse(importer.history_contains([b'/top/a']))
+        self.assertEqual(importer.history_get(), set([tuple(paths)]))
+
+    def test_state_persists(self):
+        importer.history_add([b'/top/a'])
+        self.state.close()
+        state = importer.ImportState(config['statedb'].as_filename())
+        self.assertTrue(state.history_contains([b'/top/a']))
+
+    def test_migrate_pickled_state(self):
+        self.state.close()
+        os.remove(config['statedb'].as_filename())
+        with open(config['statefile'].as_filename(), 'w') as f:
+            pickle.dump({
+                importer.PROGRESS_KEY: {b'/top': [b'/top/a']},
+                importer.HISTORY_KEY: set([(b'/top/b', b'/top/c')]),
+            }, f)
+
+        state = importer.ImportState(config['statedb'].as_filename())
+        self.assertTrue(state.progress_element(b'/top', b'/top/a'))
+        self.assertTrue(state.history_contains([b'/top/b', b'/top/c']))
+
+
 def _mkmp3(path):
     shutil.copyfile(os.path.join(_common.RSRC, 'min.mp3'), path)
 
@@ -1468,6 +1673,12 @@ class MultiDiscAlbumsInDirTest(_common.TestCase):
         self.assertEqual(root, self.dirs[0:3])
         self.assertEqual(len(items), 3)
 
+    def test_walk_threads_same_albums(self):
+        self.create_music()
+        albums = list(albums_in_dir(self.base))
+        config['import']['walk_threads'] = 4
+        self.assertEqual(list(albums_in_dir(self.base)), albums)
+
     def test_coalesce_nested_album_single_subdir(self):
         self.create_music()
         albums = list(albums_in_dir(self.base))
@@ -1509,6 +1720,57 @@ class MultiDiscAlbumsInDirTest(_common.TestCase):
         self.assertEqual(root, self.dirs[0:3])
         self.assertEqual(len(items), 3)
 
+    def _age_dirs(self):
+        """Make the directories look old enough for their fingerprints
+        to be recorded.
+        """
+        past = time.time() - 60
+        for path in [self.base] + self.dirs:
+            os.utime(path, (past, past))
+
+    def _pruned_walk(self):
+        """Walk the music skipping unchanged albums, as incremental
+        imports do, and record the albums found as imported.
+        """
+        pruner = importer.DirectoryPruner()
+        albums = list(albums_in_dir(self.base, pruner))
+        for dirs, _ in albums:
+            pruner.done(dirs)
+        return albums
+
+    def test_pruned_walk_skips_unchanged_albums(self):
+        self.create_music()
+        self._age_dirs()
+        self.assertEqual(self._pruned_walk(), list(albums_in_dir(self.base)))
+        self.assertEqual(self._pruned_walk(), [])
+
+    def test_pruned_walk_yields_whole_changed_nested_album(self):
+        self.create_music()
+        self._age_dirs()
+        self._pruned_walk()
+
+        _mkmp3(os.path.join(self.dirs[2], b'song8.mp3'))
+        albums = self._pruned_walk()
+        self.assertEqual(len(albums), 1)
+        root, items = albums[0]
+        self.assertEqual(root, self.dirs[0:3])
+        self.assertEqual(len(items), 4)
+
+    def test_pruned_walk_yields_whole_flattened_album_with_new_disc(self):
+        self.create_music()
+        self._age_dirs()
+        self._pruned_walk()
+
+        disc = os.path.join(self.base, b'artist [CD5]', b'CAT disc 3')
+        os.mkdir(disc)
+        _mkmp3(os.path.join(disc, b'song8.mp3'))
+        config['import']['walk_threads'] = 4
+        albums = self._pruned_walk()
+        self.assertEqual(len(albums), 1)
+        root, items = albums[0]
+        self.assertEqual(root, self.dirs[6:8] + [disc])
+        self.assertEqual(len(items), 3)
+
 
 class ReimportTest(unittest.TestCase, ImportHelper):
     """Test "re-imports", in which the autotagging machinery is used for
@@ -25,6 +25,7 @@ import shutil
 import re
 import unicodedata
 import sys
+import threading
 
 from test import _common
 from test._common import unittest
@@ -37,6 +38,7 @@ from beets import plugins
 from beets import config
 from beets.mediafile import MediaFile
 from test.helper import TestHelper
+from mock import patch
 
 # Shortcut to path normalization.
 np = util.normpath
@@ -103,6 +105,24 @@ class AddTest(_common.TestCase):
             'where composer="the composer"').fetchone()[b'grouping']
         self.assertEqual(new_grouping, self.i.grouping)
 
+    def test_add_many_inserts_rows(self):
+        items = [item(), item()]
+        items[1].title = 'another title'
+        items[1].foo = 'bar'
+        ids = self.lib.add_many(items)
+        self.assertEqual(ids, [items[0].id, items[1].id])
+        self.assertEqual(len(set(ids)), 2)
+        stored = self.lib.get_item(items[1].id)
+        self.assertEqual(stored.title, 'another title')
+        self.assertEqual(stored.foo, 'bar')
+        self.assertEqual(stored.added, items[1].added)
+
+    def test_add_many_clears_dirty_flags(self):
+        i = item()
+        self.lib.add_many([i])
+        self.assertEqual(i._dirty, set())
+        self.assertEqual(i._db, self.lib)
+
 
 class RemoveTest(_common.LibTestCase):
     def test_remove_deletes_from_db(self):
@@ -261,6 +281,28 @@ class DestinationTest(_common.TestCase):
                                  ('comp:true', 'three')]
         self.assertEqual(self.i.destination(), np('one/two'))
 
+    def test_parsed_path_formats_default_last(self):
+        self.lib.path_formats = [('default', 'two'),
+                                 ('comp:true', 'three')]
+        parsed = self.lib.parsed_path_formats()
+        self.assertEqual([t.original for _, t in parsed], ['three', 'two'])
+        self.assertIsInstance(parsed[-1][0], beets.dbcore.query.TrueQuery)
+
+    def test_parsed_path_formats_reused(self):
+        self.lib.path_formats = [('default', 'two'),
+                                 ('comp:true', 'three')]
+        parsed = self.lib.parsed_path_formats()
+        self.assertIs(self.lib.parsed_path_formats(), parsed)
+
+    def test_parsed_path_formats_rebuilt_on_change(self):
+        self.lib.path_formats = [('default', 'two')]
+        parsed = self.lib.parsed_path_formats()
+        self.lib.path_formats.insert(0, ('comp:true', 'three'))
+        self.assertIsNot(self.lib.parsed_path_formats(), parsed)
+        self.i.comp = True
+        self.lib.directory = 'one'
+        self.assertEqual(self.i.destination(), np('one/three'))
+
     def test_singleton_path(self):
         i = item(self.lib)
         self.lib.directory = 'one'
@@ -511,6 +553,20 @@ class ItemFormattedMappingTest(_common.LibTestCase):
         formatted = self.i.formatted(for_path=True)
         self.assertEqual(formatted['album'], 'foo')
 
+    def test_keys_include_album_keys(self):
+        album = self.lib.add_album([self.i])
+        album['flex'] = 'foo'
+        album.store()
+        keys = set(self.i.formatted().keys())
+        self.assertTrue(set(self.i.keys(True)) <= keys)
+        self.assertIn('flex', keys)
+        self.assertIn('artpath', keys)
+
+    def test_path_separator_replaced_for_path(self):
+        self.i.title = 'a/b'
+        formatted = self.i.formatted(for_path=True)
+        self.assertEqual(formatted['title'], 'a_b')
+
     def test_artist_falls_back_to_albumartist(self):
         self.i.artist = ''
         formatted = self.i.formatted()
@@ -652,6 +708,67 @@ class DisambiguationTest(_common.TestCase, PathFormattingMixin):
         self._setf(u'foo%aunique{albumartist album,month year}/$title')
         self._assert_dest('/base/foo [2001]/the title', self.i1)
 
+    def test_change_to_album_invalidates_memoized_value(self):
+        self._assert_dest('/base/foo [2001]/the title', self.i1)
+        album2 = self.lib.get_album(self.i2)
+        album2.album = 'different album'
+        album2.store()
+        self._assert_dest('/base/foo/the title', self.i1)
+
+    def test_new_album_invalidates_memoized_value(self):
+        self._assert_dest('/base/foo [2001]/the title', self.i1)
+        i3 = item()
+        i3.year = 2001
+        self.lib.add_album([i3])
+        self._assert_dest('/base/foo 1/the title', self.i1)
+
+    def test_store_of_unrelated_field_keeps_memoized_value(self):
+        self._assert_dest('/base/foo [2001]/the title', self.i1)
+        album1 = self.lib.get_album(self.i1)
+        album1.genre = 'new genre'
+        album1.store()
+        with patch.object(self.lib, '_album_disambiguators') as mock:
+            self._assert_dest('/base/foo [2001]/the title', self.i1)
+        self.assertFalse(mock.called)
+
+    def test_move_queries_disambiguators_once(self):
+        self.lib.directory = self.temp_dir
+        items = [item() for _ in range(3)]
+        for i, track in enumerate(items):
+            track.title = 'track {0}'.format(i)
+            track.year = 2001
+        self.lib.add_album(items)
+
+        query = self.lib._album_disambiguators
+        with patch.object(self.lib, '_album_disambiguators',
+                          wraps=query) as mock:
+            with patch.object(beets.library.Item, 'move_file'):
+                for track in items:
+                    track.move()
+        self.assertEqual(mock.call_count, 1)
+
+    def test_album_disambiguators(self):
+        album1 = self.lib.get_album(self.i1)
+        album2 = self.lib.get_album(self.i2)
+        i3 = item()
+        i3.album = 'other album'
+        album3 = self.lib.add_album([i3])
+        disambiguators = self.lib._album_disambiguators(
+            ['albumartist', 'album'], ['albumtype', 'year'])
+        self.assertEqual(disambiguators, {album1.id: 'year',
+                                          album2.id: 'year'})
+        self.assertNotIn(album3.id, disambiguators)
+
+    def test_unique_with_flexible_attribute(self):
+        album1 = self.lib.get_album(self.i1)
+        album1['flex'] = 'foo'
+        album1.store()
+        album2 = self.lib.get_album(self.i2)
+        album2['flex'] = 'bar'
+        album2.store()
+        self._setf(u'foo%aunique{albumartist album,flex}/$title')
+        self._assert_dest('/base/foo [foo]/the title', self.i1)
+
     def test_unique_sanitized(self):
         album2 = self.lib.get_album(self.i2)
         album2.year = 2001
@@ -813,6 +930,119 @@ class AlbumInfoTest(_common.TestCase):
         self.assertEqual(i.album, ai.album)
 
 
+class ObjectCacheTest(_common.TestCase):
+    def setUp(self):
+        super(ObjectCacheTest, self).setUp()
+        self.lib = beets.library.Library(':memory:')
+        self.i = item()
+        self.album = self.lib.add_album((self.i,))
+
+    def test_get_album_reuses_object(self):
+        self.assertIs(self.lib.get_album(self.i), self.lib.get_album(self.i))
+
+    def test_get_item_reuses_object(self):
+        self.assertIs(self.lib.get_item(self.i.id),
+                      self.lib.get_item(self.i.id))
+
+    def test_store_invalidates(self):
+        cached = self.lib.get_album(self.i)
+        self.album.album = 'new title'
+        self.album.store()
+        new = self.lib.get_album(self.i)
+        self.assertIsNot(new, cached)
+        self.assertEqual(new.album, 'new title')
+
+    def test_remove_invalidates(self):
+        self.lib.get_item(self.i.id)
+        self.i.remove()
+        self.assertIsNone(self.lib.get_item(self.i.id))
+
+    def test_object_with_unsaved_changes_not_reused(self):
+        cached = self.lib.get_album(self.i)
+        cached.album = 'unsaved'
+        new = self.lib.get_album(self.i)
+        self.assertIsNot(new, cached)
+        self.assertEqual(new.album, self.album.album)
+
+    def test_cache_size_bounded(self):
+        self.lib.object_cache_size = 1
+        self.lib.get_album(self.i)
+        self.lib.get_item(self.i.id)
+        self.assertEqual(list(self.lib._object_cache().objects),
+                         [(beets.library.Item, self.i.id)])
+
+    def test_threads_do_not_share_objects(self):
+        path = os.path.join(self.temp_dir, b'library.db')
+        self.lib = beets.library.Library(path)
+        self.album = self.lib.add_album((item(),))
+        fetched = []
+
+        def fetch():
+            fetched.append(self.lib.get_album(self.album.id))
+            fetched.append(self.lib.get_album(self.album.id))
+        thread = threading.Thread(target=fetch)
+        thread.start()
+        thread.join()
+
+        self.assertIs(fetched[0], fetched[1])
+        self.assertIsNot(self.lib.get_album(self.album.id), fetched[0])
+
+    def test_cache_goes_away_with_its_thread(self):
+        self.lib.get_album(self.i)
+        thread = threading.Thread(target=self.lib.get_album, args=(self.i,))
+        thread.start()
+        thread.join()
+        self.assertEqual(len(self.lib._object_caches), 1)
+
+    def test_lookups_after_query_reuse_version_check(self):
+        list(self.lib.items())
+        with patch.object(self.lib, '_data_version',
+                          wraps=self.lib._data_version) as data_version:
+            for _ in range(3):
+                self.lib.get_item(self.i.id)
+                self.lib.get_album(self.i)
+        self.assertEqual(data_version.call_count, 0)
+
+    def test_version_checked_once_per_transaction(self):
+        with patch.object(self.lib, '_data_version',
+                          wraps=self.lib._data_version) as data_version:
+            with self.lib.transaction(False):
+                for _ in range(3):
+                    self.lib.get_item(self.i.id)
+        self.assertEqual(data_version.call_count, 1)
+
+    def test_change_from_other_connection_invalidates(self):
+        path = os.path.join(self.temp_dir, b'library.db')
+        self.lib = beets.library.Library(path)
+        self.album = self.lib.add_album((item(),))
+        cached = self.lib.get_album(self.album.id)
+
+        other = beets.library.Library(path)
+        album = other.get_album(self.album.id)
+        album.album = 'changed elsewhere'
+        album.store()
+
+        with self.lib.transaction(False):
+            new = self.lib.get_album(self.album.id)
+        self.assertIsNot(new, cached)
+        self.assertEqual(new.album, 'changed elsewhere')
+
+    def test_change_from_other_connection_noticed_by_query(self):
+        path = os.path.join(self.temp_dir, b'library.db')
+        self.lib = beets.library.Library(path)
+        self.album = self.lib.add_album((item(),))
+        list(self.lib.albums())
+        cached = self.lib.get_album(self.album.id)
+
+        other = beets.library.Library(path)
+        album = other.get_album(self.album.id)
+        album.album = 'changed elsewhere'
+        album.store()
+
+        list(self.lib.albums())
+        self.assertIsNot(self.lib.get_album(self.album.id), cached)
+
+
 class ArtDestinationTest(_common.TestCase):
     def setUp(self):
         super(ArtDestinationTest, self).setUp()
@@ -1004,6 +1234,23 @@ class TemplateTest(_common.LibTestCase):
         self.assertEqual("{0}".format(item), "bar bar")
         self.assertEqual("{0:$tagada}".format(item), "togodo")
 
+    def test_template_fields(self):
+        fields = beets.library.Album._template_fields('$album %upper{$year}')
+        self.assertEqual(fields, set(['album', 'year']))
+
+    def test_item_template_fields_include_fallbacks(self):
+        fields = beets.library.Item._template_fields('$artist - $title')
+        self.assertEqual(fields, set(['artist', 'albumartist', 'title',
+                                      'album_id']))
+
+    def test_item_with_template_fields_formats_like_full_item(self):
+        self.lib.add_album([self.i])
+        template = '$artist - $album - $title'
+        fields = beets.library.Item._template_fields(template)
+        item = self.lib.items(fields=fields).get()
+        self.assertEqual(format(item, template), format(self.i, template))
+        self.assertTrue(item._incomplete)  # Nothing was reloaded.
+
 
 class UnicodePathTest(_common.LibTestCase):
     def test_unicode_path(self):
@@ -1110,6 +1357,47 @@ class ParseQueryTest(unittest.TestCase):
         with self.assertRaises(AssertionError):
             beets.library.parse_query_string(b"query", None)
 
+    def test_parse_query_string_memoized(self):
+        parsed = beets.library.parse_query_string('foo year+',
+                                                  beets.library.Item)
+        self.assertIs(beets.library.parse_query_string('foo year+',
+                                                       beets.library.Item),
+                      parsed)
+
+    def test_parse_query_parts_memoized(self):
+        parsed = beets.library.parse_query_parts(['foo', 'year+'],
+                                                 beets.library.Item)
+        self.assertIs(beets.library.parse_query_parts(['foo', 'year+'],
+                                                      beets.library.Item),
+                      parsed)
+
+    def test_memoized_per_model(self):
+        item_query, _ = beets.library.parse_query_string('foo',
+                                                         beets.library.Item)
+        album_query, _ = beets.library.parse_query_string('foo',
+                                                          beets.library.Album)
+        self.assertEqual(item_query.subqueries[0].fields,
+                         beets.library.Item._search_fields)
+        self.assertEqual(album_query.subqueries[0].fields,
+                         beets.library.Album._search_fields)
+
+    def test_config_change_invalidates(self):
+        _, sort = beets.library.parse_query_string('title+',
+                                                   beets.library.Item)
+        config['sort_case_insensitive'] = not sort.case_insensitive
+        try:
+            _, new_sort = beets.library.parse_query_string(
+                'title+', beets.library.Item)
+        finally:
+            config['sort_case_insensitive'] = sort.case_insensitive
+        self.assertNotEqual(new_sort.case_insensitive, sort.case_insensitive)
+
+    def test_path_query_not_memoized(self):
+        path = os.path.dirname(os.path.abspath(__file__)).decode('utf8')
+        parsed = beets.library.parse_query_string(path, beets.library.Item)
+        self.assertIsNot(beets.library.parse_query_string(
+            path, beets.library.Item), parsed)
+
 
 def suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
@@ -17,6 +17,12 @@
 from __future__ import (division, absolute_import, print_function,
                         unicode_literals)
 
+import multiprocessing
+import threading
+import time
+
+from mock import patch
+
 from test._common import unittest
 from beets.util import pipeline
 
@@ -65,6 +71,15 @@ def _bub_work(num=3):
             i *= 2
 
 
+# A worker that takes longer for earlier messages.
+def _slow_work(num=5):
+    i = None
+    while True:
+        i = yield i
+        time.sleep((num - i) * 0.01)
+        i *= 2
+
+
 # Yet another worker that yields multiple messages.
 def _multi_work():
     i = None
@@ -73,6 +88,20 @@ def _multi_work():
         i = pipeline.multiple([i, -i])
 
 
+@pipeline.process_stage
+def _proc_work(factor, i):
+    if i == 3:
+        return pipeline.BUBBLE
+    return pipeline.multiple([i * factor, -i * factor])
+
+
+@pipeline.process_stage
+def _proc_exc_work(i):
+    if i == 3:
+        raise TestException()
+    return i
+
+
 class SimplePipelineTest(unittest.TestCase):
     def setUp(self):
         self.l = []
@@ -117,6 +146,185 @@ class ParallelStageTest(unittest.TestCase):
         self.assertEqual(list(pl.pull()), [0, 2, 4, 6, 8])
 
 
+class OrderedStageTest(unittest.TestCase):
+    def setUp(self):
+        self.l = []
+        self.pl = pipeline.Pipeline((
+            _produce(),
+            pipeline.OrderedStage([_slow_work(), _slow_work(), _slow_work()]),
+            _consume(self.l)
+        ))
+
+    def test_run_sequential(self):
+        self.pl.run_sequential()
+        self.assertEqual(self.l, [0, 2, 4, 6, 8])
+
+    def test_run_parallel_preserves_order(self):
+        self.pl.run_parallel()
+        self.assertEqual(self.l, [0, 2, 4, 6, 8])
+
+    def test_run_parallel_bubble_and_multiple(self):
+        out = []
+        pl = pipeline.Pipeline((
+            _produce(),
+            pipeline.OrderedStage([_bub_work(), _bub_work()]),
+            pipeline.OrderedStage([_multi_work(), _multi_work()]),
+            _consume(out)
+        ))
+        pl.run_parallel(1)
+        self.assertEqual(out, [0, 0, 2, -2, 4, -4, 8, -8])
+
+    def test_run_parallel_exception(self):
+        pl = pipeline.Pipeline((
+            _produce(),
+            pipeline.OrderedStage([_exc_work(), _exc_work()]),
+            _consume([])
+        ))
+        self.assertRaises(TestException, pl.run_parallel)
+
+
+class ProcessStageTest(unittest.TestCase):
+    def setUp(self):
+        self.l = []
+        self.pl = pipeline.Pipeline((
+            _produce(), _proc_work(2), _consume(self.l)
+        ))
+
+    def test_run_sequential(self):
+        self.pl.run_sequential()
+        self.assertEqual(self.l, [0, 0, 2, -2, 4, -4, 8, -8])
+
+    def test_run_parallel(self):
+        self.pl.run_parallel(processes=2)
+        self.assertEqual(self.l, [0, 0, 2, -2, 4, -4, 8, -8])
+
+    def test_run_parallel_constrained(self):
+        out = []
+        pl = pipeline.Pipeline((
+            _produce(100), _proc_work(1), _consume(out)
+        ))
+        pl.run_parallel(1, processes=3)
+        expected = []
+        for i in range(100):
+            if i != 3:
+                expected += [i, -i]
+        self.assertEqual(out, expected)
+
+    def test_run_parallel_exception(self):
+        pl = pipeline.Pipeline((
+            _produce(), _proc_exc_work(), _consume([])
+        ))
+        self.assertRaises(TestException, pl.run_parallel, processes=2)
+
+    def test_pool_created_before_threads_start(self):
+        running = []
+        pools = []
+        pool = multiprocessing.Pool
+
+        def make_pool(processes):
+            running.extend(t for t in threading.enumerate()
+                           if isinstance(t, pipeline.PipelineThread))
+            pools.append(pool(processes))
+            return pools[-1]
+        with patch('multiprocessing.Pool', side_effect=make_pool):
+            self.pl.run_parallel(processes=2)
+        self.assertEqual(running, [])
+        self.assertEqual(len(pools), 1)
+        self.assertEqual(self.l, [0, 0, 2, -2, 4, -4, 8, -8])
+
+    def test_first_stage_rejected(self):
+        self.assertRaises(ValueError, pipeline.Pipeline,
+                          (_proc_work(2), _consume([])))
+
+
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.l = []
+        self.pl = pipeline.Pipeline((
+            _produce(), _bub_work(), _multi_work(), _consume(self.l)
+        ), stats=True)
+
+    def assert_counts(self):
+        self.assertEqual([(st.msgs_in, st.msgs_out) for st in self.pl.stats],
+                         [(0, 5), (5, 4), (4, 8), (8, 0)])
+
+    def test_names(self):
+        self.assertEqual([st.name for st in self.pl.stats],
+                         ['_produce', '_bub_work', '_multi_work', '_consume'])
+
+    def test_decorated_stage_names(self):
+        @pipeline.stage
+        def add(n, i):
+            return i + n
+
+        pl = pipeline.Pipeline((iter([1]), add(1), _proc_work(1)),
+                               stats=True)
+        self.assertEqual([st.name for st in pl.stats[1:]],
+                         ['add', '_proc_work'])
+
+    def test_run_sequential(self):
+        self.pl.run_sequential()
+        self.assert_counts()
+        self.assertIsNone(self.pl.stats[0].queue_high_water)
+
+    def test_run_parallel(self):
+        self.pl.run_parallel(2)
+        self.assert_counts()
+        for st in self.pl.stats[:-1]:
+            self.assertTrue(1 <= st.queue_high_water <= 2)
+        self.assertIsNone(self.pl.stats[-1].queue_high_water)
+
+    def test_busy_time(self):
+        pl = pipeline.Pipeline((
+            _produce(), _slow_work(), _consume([])
+        ), stats=True)
+        pl.run_parallel()
+        self.assertGreater(pl.stats[1].busy, 0.0)
+        self.assertGreater(pl.stats[2].idle, 0.0)
+
+    def test_no_stats_by_default(self):
+        self.assertIsNone(pipeline.Pipeline((_produce(), _work())).stats)
+
+
+class WeighedQueueTest(unittest.TestCase):
+    def test_limits_total_weight(self):
+        q = pipeline.CountedQueue(5, len)
+        q.put('abc')
+        self.assertFalse(q.full())
+        q.put('abc')
+        self.assertTrue(q.full())
+        self.assertEqual(q.get(), 'abc')
+        self.assertFalse(q.full())
+        self.assertEqual(q.high_water, 6)
+
+    def test_empty_queue_accepts_heavy_message(self):
+        q = pipeline.CountedQueue(2, len)
+        q.put('abcdef')
+        self.assertTrue(q.full())
+        self.assertEqual(q.get(), 'abcdef')
+        self.assertTrue(q.empty())
+
+    def test_light_messages_count_as_one(self):
+        q = pipeline.CountedQueue(2, len)
+        q.put('')
+        self.assertFalse(q.empty())
+        self.assertFalse(q.full())
+
+    def test_run_parallel_weighed(self):
+        out = []
+        pl = pipeline.Pipeline((
+            _produce(100), _multi_work(), _work(), _consume(out)
+        ), stats=True)
+        pl.run_parallel([10, 1, 3], weigh=lambda n: abs(n) % 4)
+        self.assertEqual(len(out), 200)
+        self.assertLessEqual(pl.stats[0].queue_high_water, 10 + 3)
+        self.assertLessEqual(pl.stats[2].queue_high_water, 3 + 3)
+
+    def test_wrong_number_of_sizes(self):
+        pl = pipeline.Pipeline((_produce(), _work(), _consume([])))
+        self.assertRaises(ValueError, pl.run_parallel, [1, 2, 3])
+
+
 class ExceptionTest(unittest.TestCase):
     def setUp(self):
         self.l = []
@@ -108,10 +108,11 @@ class DummyDataTestCase(_common.TestCase, AssertsMixin):
         self.lib.add_album(items[:2])
 
     def assert_items_matched_all(self, results):
+        # Sorted by artist: "one", "three", "two".
         self.assert_items_matched(results, [
             'foo bar',
-            'baz qux',
             'beets 4 eva',
+            'baz qux',
         ])
 
 
@@ -308,6 +309,96 @@ class GetTest(DummyDataTestCase):
         self.assertIsInstance(raised.exception, ParsingError)
 
 
+class RegexpQueryTest(DummyDataTestCase):
+    def test_fixed_field_clause_uses_regexp_operator(self):
+        q = dbcore.query.RegexpQuery('title', '^foo')
+        clause, subvals = q.clause()
+        self.assertEqual(clause, 'title REGEXP ?')
+        self.assertEqual(subvals, ['^foo'])
+
+    def test_match_in_sql(self):
+        results = self.lib.items(dbcore.query.RegexpQuery('title', 'q.x$'))
+        self.assert_items_matched(results, ['baz qux'])
+
+    def test_match_int_field(self):
+        results = self.lib.items(dbcore.query.RegexpQuery('year', '^200[13]$'))
+        self.assert_items_matched(results, ['foo bar', 'beets 4 eva'])
+
+    def test_match_path(self):
+        results = self.lib.items('path::^somepath[0-9]+$')
+        self.assertEqual(len(results), 3)
+
+    def test_non_string_field_matched_in_python(self):
+        q = dbcore.queryparse.construct_query_part(
+            Item, {':': dbcore.query.RegexpQuery}, 'year::^2001$'
+        )
+        self.assertEqual(q.clause(), (None, ()))
+
+    def test_match_bool_field(self):
+        with self.lib.transaction() as tx:
+            tx.mutate('UPDATE items SET comp = NULL')
+        results = self.lib.items('comp::False')
+        self.assert_items_matched_all(results)
+
+    def test_match_null_column(self):
+        with self.lib.transaction() as tx:
+            tx.mutate('UPDATE items SET bpm = NULL')
+        results = self.lib.items('bpm::^0$')
+        self.assert_items_matched_all(results)
+
+    def test_flex_field_clause(self):
+        q = dbcore.query.RegexpQuery('flex', '^some', False)
+        q.table, q.flex_table = 'items', 'item_attributes'
+        clause, subvals = q.clause()
+        self.assertIn('REGEXP', clause)
+        self.assertEqual(subvals, ['flex', '^some'])
+
+    def test_match_flex_field(self):
+        item = self.lib.items('title:qux').get()
+        item['flex'] = 'some value'
+        item.store()
+        results = self.lib.items('flex::^some')
+        self.assert_items_matched(results, ['baz qux'])
+
+    def test_empty_match_includes_missing_flex_field(self):
+        item = self.lib.items('title:qux').get()
+        item['flex'] = 'some value'
+        item.store()
+        q = dbcore.query.RegexpQuery('flex', '^$', False)
+        q.table, q.flex_table = 'items', 'item_attributes'
+        self.assertEqual(q.clause(), (None, ()))
+        results = self.lib.items('flex::^$')
+        self.assert_items_matched(results, ['foo bar', 'beets 4 eva'])
+
+    def test_compiled_patterns_are_reused(self):
+        q1 = dbcore.query.RegexpQuery('title', 'a+b')
+        q2 = dbcore.query.RegexpQuery('album', 'a+b')
+        self.assertIs(q1.pattern, q2.pattern)
+
+
+class FlexFieldMissingTest(DummyDataTestCase):
+    def setUp(self):
+        super(FlexFieldMissingTest, self).setUp()
+        item = self.lib.items('title:qux').get()
+        item['foo'] = 'bar'
+        item.store()
+
+    def test_empty_substring_includes_missing_field(self):
+        q = dbcore.query.SubstringQuery('foo', '', False)
+        q.table, q.flex_table = 'items', 'item_attributes'
+        self.assertEqual(q.clause(), (None, ()))
+        results = self.lib.items('foo:')
+        self.assert_items_matched_all(results)
+
+    def test_substring_excludes_missing_field(self):
+        results = self.lib.items('foo:ba')
+        self.assert_items_matched(results, ['baz qux'])
+
+    def test_empty_query_on_absent_field(self):
+        results = self.lib.items('^foo:')
+        self.assert_items_matched_all(results)
+
+
 class MatchTest(_common.TestCase):
     def setUp(self):
         super(MatchTest, self).setUp()
@@ -576,6 +667,21 @@ class IntQueryTest(unittest.TestCase, TestHelper):
         matched = self.lib.items('myint:2').get()
         self.assertEqual(item.id, matched.id)
 
+    def test_flex_range_compares_numerically(self):
+        Item._types = {'myint': types.Integer()}
+        self.add_item(myint=8)
+        item = self.add_item(myint=10)
+        matched = self.lib.items('myint:9..')
+        self.assertEqual(1, len(matched))
+        self.assertEqual(item.id, matched.get().id)
+
+    def test_flex_range_skips_non_numeric_values(self):
+        self.add_item(myint=u'abc')
+        self.add_item(myint=u'')
+        Item._types = {'myint': types.Integer()}
+        matched = self.lib.items('myint:..5')
+        self.assertEqual(0, len(matched))
+
     def test_flex_dont_match_missing(self):
         Item._types = {'myint': types.Integer()}
         self.add_item()
@@ -659,6 +765,56 @@ class DefaultSearchFieldsTest(DummyDataTestCase):
         self.assert_items_matched(items, [])
 
 
+@unittest.skipUnless(dbcore.db.fts_supported(), 'SQLite lacks FTS5 trigrams')
+class FullTextSearchTest(DefaultSearchFieldsTest):
+    """Run the default search field tests with the full-text search
+    table enabled on the existing library.
+    """
+    def setUp(self):
+        super(FullTextSearchTest, self).setUp()
+        beets.config['fulltext_search'] = True
+        for model_cls in (beets.library.Item, beets.library.Album):
+            self.lib._make_fts_table(model_cls)
+
+    def test_query_uses_fts_table(self):
+        q, _ = beets.library.parse_query_string('beets', Item)
+        self.assertEqual(q.subqueries[0].fts_table, 'items_fts')
+
+    def test_short_term_does_not_use_fts_table(self):
+        q, _ = beets.library.parse_query_string('be', Item)
+        self.assertIsNone(q.subqueries[0].fts_table)
+        self.assert_items_matched(self.lib.items('be'), ['beets 4 eva'])
+
+    def test_substring_in_word_matches(self):
+        self.assert_items_matched(self.lib.items('eets'), ['beets 4 eva'])
+
+    def test_case_insensitive(self):
+        self.assert_items_matched(self.lib.items('BEETS'), ['beets 4 eva'])
+
+    def test_stored_changes_indexed(self):
+        item = self.lib.items('beets').get()
+        item.title = 'turnips'
+        item.store()
+        self.assert_items_matched(self.lib.items('beets'), [])
+        self.assert_items_matched(self.lib.items('turnip'), ['turnips'])
+
+    def test_new_and_removed_items_indexed(self):
+        item = _common.item()
+        item.title = 'radishes'
+        self.lib.add(item)
+        self.assert_items_matched(self.lib.items('radish'), ['radishes'])
+        item.remove()
+        self.assert_items_matched(self.lib.items('radish'), [])
+
+    def test_disabling_drops_table(self):
+        beets.config['fulltext_search'] = False
+        self.lib._make_fts_table(Item)
+        tables = [row[0] for row in self.lib._connection().execute(
+            "SELECT name FROM sqlite_master WHERE name LIKE 'items_fts%'"
+        )]
+        self.assertEqual(tables, [])
+
+
 class NoneQueryTest(unittest.TestCase, TestHelper):
 
     def setUp(self):
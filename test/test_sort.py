@@ -188,6 +188,52 @@ class SortFlexFieldTest(DummyDataTestCase):
         for r1, r2 in zip(results, results2):
             self.assertEqual(r1.id, r2.id)
 
+    def test_sort_in_sql(self):
+        results = self.lib.items('flex1+')
+        self.assertIsNone(results.sort)
+        self.assertEqual([r['flex1'] for r in results],
+                         ['Flex1-0', 'Flex1-1', 'Flex1-2', 'Flex1-2'])
+
+    def test_sort_numeric(self):
+        for item, value in zip(self.lib.items(), ['10', '9', '100', '-1']):
+            item.num = value
+            item.store()
+        sort = dbcore.query.FlexFieldSort('num', True, True, 'items',
+                                          'item_attributes', True)
+        results = self.lib.items('', sort)
+        self.assertEqual([r['num'] for r in results],
+                         ['-1', '9', '10', '100'])
+
+    def test_missing_values_sort_first(self):
+        item = self.lib.items().get()
+        del item.flex1
+        item.store()
+        results = self.lib.items('flex1+')
+        self.assertEqual(results[0].id, item.id)
+
+
+class SmartArtistSortTest(DummyDataTestCase):
+    def test_sort_field_preferred(self):
+        for item in self.lib.items('artist:three'):
+            item.artist_sort = 'A Three'
+            item.store()
+        results = self.lib.items('artist+')
+        self.assertEqual([r.artist for r in results],
+                         ['Three', 'Three', 'One', 'Two'])
+
+    def test_empty_sort_field_ignored(self):
+        for item in self.lib.items():
+            item.artist_sort = ''
+            item.store()
+        results = self.lib.items('artist+')
+        self.assertEqual([r.artist for r in results],
+                         ['One', 'Three', 'Three', 'Two'])
+
+    def test_null_sort_field_ignored(self):
+        results = self.lib.items('artist-')
+        self.assertEqual([r.artist for r in results],
+                         ['Two', 'Three', 'Three', 'One'])
+
 
 class SortAlbumFixedFieldTest(DummyDataTestCase):
     def test_sort_asc(self):
@@ -357,6 +403,24 @@ class ConfigSortTest(DummyDataTestCase):
         results = list(self.lib.albums())
         self.assertGreater(results[0].albumartist, results[1].albumartist)
 
+    def assertSortUsesIndex(self, model_cls, sort):
+        for cols in ('*', 'id'):
+            sql = self.lib._select_sql(model_cls, cols, None,
+                                       sort.order_clause())
+            with self.lib.transaction(False) as tx:
+                plan = tx.query('EXPLAIN QUERY PLAN ' + sql, (-1, 0))
+            details = ' '.join(row[-1] for row in plan)
+            self.assertIn('_index_default_sort', details)
+            self.assertNotIn('TEMP B-TREE', details)
+
+    def test_default_sort_item_uses_index(self):
+        self.assertSortUsesIndex(beets.library.Item,
+                                 self.lib.get_default_item_sort())
+
+    def test_default_sort_album_uses_index(self):
+        self.assertSortUsesIndex(beets.library.Album,
+                                 self.lib.get_default_album_sort())
+
 
 class CaseSensitivityTest(DummyDataTestCase, _common.TestCase):
     """If case_insensitive is false, lower-case values should be placed
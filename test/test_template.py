@@ -274,6 +274,28 @@ class EvalTest(unittest.TestCase):
         self.assertEqual(self._eval(u"%len{}"), u"0")
 
 
+class VariablesTest(unittest.TestCase):
+    def test_variables(self):
+        t = functemplate.Template(u'$foo - ${bar} %lower{$baz} $foo')
+        self.assertEqual(t.variables(), set([u'foo', u'bar', u'baz']))
+
+    def test_no_variables(self):
+        t = functemplate.Template(u'%lower{FOO} text')
+        self.assertEqual(t.variables(), set())
+
+
+class TemplateCacheTest(unittest.TestCase):
+    def test_same_string_returns_same_template(self):
+        t = functemplate.template(u'$foo %lower{$bar}')
+        self.assertIs(functemplate.template(u'$foo %lower{$bar}'), t)
+
+    def test_different_strings_return_different_templates(self):
+        t1 = functemplate.template(u'$foo')
+        t2 = functemplate.template(u'$bar')
+        self.assertEqual(t1.original, u'$foo')
+        self.assertEqual(t2.original, u'$bar')
+
+
 def suite():
     return unittest.TestLoader().loadTestsFromName(__name__)
 
@@ -116,6 +116,50 @@ class ListTest(unittest.TestCase):
         self.assertNotIn(u'the album', stdout.getvalue())
 
 
+class StatsTest(unittest.TestCase):
+    def setUp(self):
+        self.lib = library.Library(':memory:')
+        for i in range(2):
+            item = _common.item()
+            item.length = 60.0
+            item.bitrate = 128000
+            self.lib.add(item)
+        self.lib.add_album([item])
+
+    def _run_stats(self, query=''):
+        with capture_stdout() as stdout:
+            commands.show_stats(self.lib, query, False)
+        return stdout.getvalue()
+
+    def test_stats_counts(self):
+        out = self._run_stats()
+        self.assertIn(u'Tracks: 2', out)
+        self.assertIn(u'Total time: 2.0 minutes', out)
+        self.assertIn(u'Approximate total size: 1.8 MB', out)
+        self.assertIn(u'Artists: 1', out)
+        self.assertIn(u'Albums: 1', out)
+
+    def test_stats_query(self):
+        out = self._run_stats(u'artist:nobody')
+        self.assertIn(u'Tracks: 0', out)
+        self.assertIn(u'Total time: 0.0 seconds', out)
+
+
+class IndexCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.lib = library.Library(':memory:')
+
+    def test_list_indices(self):
+        with capture_stdout() as stdout:
+            commands.show_indices(self.lib, [], False)
+        self.assertIn(u'items_index_album_id: album_id', stdout.getvalue())
+
+    def test_query_uses_index(self):
+        with capture_stdout() as stdout:
+            commands.show_indices(self.lib, [u'album_id:1'], False)
+        self.assertIn(u'items_index_album_id', stdout.getvalue())
+
+
 class RemoveTest(_common.TestCase):
     def setUp(self):
         super(RemoveTest, self).setUp()
@@ -36,6 +36,14 @@ class WebPluginTest(_common.LibTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.json['items']), 2)
 
+    def test_get_item_page(self):
+        response = self.client.get('/item/?limit=1&offset=1')
+        response.json = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json['items']), 1)
+        self.assertEqual(response.json['items'][0]['id'], 2)
+
     def test_get_single_item_by_id(self):
         response = self.client.get('/item/1')
         response.json = json.loads(response.data)
@@ -80,6 +88,13 @@ class WebPluginTest(_common.LibTestCase):
         response_albums = [album['album'] for album in response.json['albums']]
         self.assertItemsEqual(response_albums, ['album', 'another album'])
 
+    def test_get_album_page(self):
+        response = self.client.get('/album/?limit=1')
+        response.json = json.loads(response.data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json['albums']), 1)
+
     def test_get_single_album_by_id(self):
         response = self.client.get('/album/2')
         response.json = json.loads(response.data)